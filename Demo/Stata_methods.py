@@ -1,5 +1,9 @@
+import time
+import warnings
 import pandas as pd
 import numpy as np
+from scipy import stats
+from scipy.linalg import cho_factor, cho_solve
 from statsmodels.regression.linear_model import OLS
 from statsmodels.regression.linear_model import RegressionResults
 from linearmodels.panel.model import PanelOLS
@@ -7,7 +11,9 @@ from statsmodels.discrete.discrete_model import Probit
 from statsmodels.discrete.discrete_model import Logit
 from statsmodels.sandbox.regression.gmm import IV2SLS
 from statsmodels.regression.linear_model import OLSResults  # get_robustcov_results
-# from .tobit import *
+from statsmodels.tools.sm_exceptions import ConvergenceWarning
+from .tobit import *
+from .group_index import GroupIndex
 import statsmodels.api as sm
 
 
@@ -40,13 +46,14 @@ def convert_to_dummies(categorical_var):
     return dummies
 
 
-def convert_to_dummies_list(data, categorical_var_list):
+def convert_to_dummies_list(data, categorical_var_list, group_indexes=None):
     """
     改进convert_to_dummies方法, 使得可以直接根据传进来的categorical_var_list转化dummies参数
     --------
     data: pd.DataFrame类型, 数据集.
     categorical_var_list: List类型, dummies变量字段列表.
     var_name: str类型, dummies字段名.
+    group_indexes: dict类型, 可选, {dummies变量字段: GroupIndex}, 已缓存的分组索引, 有则不再重新计算各水平.
 
 
     Outputs.
@@ -63,14 +70,14 @@ def convert_to_dummies_list(data, categorical_var_list):
 
     """
     dummies_var_list = []
+    group_indexes = group_indexes or {}
     for categorical_var in categorical_var_list:
-        tmp = data[categorical_var]
-        levels = list(set(tmp))
-        levels.sort()
-        dummies = pd.DataFrame()
-        for i in range(0, len(levels)):
-            res = (tmp == levels[i])
-            dummies[str(levels[i])] = res.astype(int)
+        group_index = group_indexes.get(categorical_var)
+        if group_index is None:
+            group_index = GroupIndex.from_frame(data, [categorical_var])
+        # 各水平已排序, 每个水平一列0-1变量, 由组号一次生成
+        dummies = pd.DataFrame(group_index.dummies(), index=data.index,
+                               columns=[str(level) for level in group_index.keys])
         data = pd.concat([data, dummies], axis=1)
         dummies_var = list(dummies.columns)
         dummies_var_list += dummies_var[1:]
@@ -168,23 +175,92 @@ def xtreg(df, y_var, other_X_vars, fix1, fix2=None, add_intercept=True):
     return res
 
 
-def probit(df, y_var, X_vars, add_intercept=True):
+BINARY_FIT_METHODS = ("newton", "bfgs", "irls")
+
+
+def lpm_start_params(y, X, link="probit"):
     """
-    This function replicates probit in STATA, for probit model.
-    至少有一个固定效应变量，至多只能有两个。
-    被解释变量y为0-1变量时，模型才有意义
+    This function computes starting values for probit/logit from the linear probability model,
+    rescaled by the usual factors (2.5 for probit, 4 for logit, Amemiya 1981).
 
     Inputs.
     ---------
-    df:pd.DataFrame, the data for OLS.
-    y_var:str, the column name of the dependent variable, 被解释变量y应为0-1变量
-    X_vars:list of str, the list of explanatory variable names
+    y:1darray, 0-1 dependent variable
+    X:2darray, the explanatory variables, the first column must be the intercept if there is one
+    link:str, "probit" or "logit"
 
     Outputs.
     ---------
-    res:obj
+    start_params:1darray
+
+    """
+    XtX = X.T @ X
+    beta = cho_solve(cho_factor(XtX), X.T @ y)
+    scale = 2.5 if link == "probit" else 4.0
+    start_params = scale * beta
+    if np.all(X[:, 0] == 1.0):
+        start_params[0] = scale * (beta[0] - 0.5)
+    return start_params
+
+
+def irls_binary(y, X, link="probit", start_params=None, maxiter=35, tol=1e-8, callback=None):
+    """
+    Iteratively reweighted least squares (Fisher scoring) for probit/logit, each step is a
+    Cholesky solve of X'WX, no Hessian of the full model has to be formed by statsmodels.
 
+    Outputs.
+    ---------
+    params:1darray
+    iterations:int
+    converged:bool
+
+    """
+    params = np.zeros(X.shape[1]) if start_params is None else np.asarray(start_params, dtype=float)
+    eps = 1e-10
+    converged = False
+    iterations = 0
+    for iterations in range(1, maxiter + 1):
+        eta = X @ params
+        if link == "probit":
+            mu = np.clip(stats.norm.cdf(eta), eps, 1 - eps)
+            d_mu = np.maximum(stats.norm.pdf(eta), eps)
+            w = d_mu ** 2 / (mu * (1 - mu))
+        else:
+            mu = np.clip(1 / (1 + np.exp(-eta)), eps, 1 - eps)
+            d_mu = mu * (1 - mu)
+            w = d_mu
+        z = eta + (y - mu) / d_mu
+        XtW = X.T * w
+        new_params = cho_solve(cho_factor(XtW @ X), XtW @ z)
+        step = np.max(np.abs(new_params - params))
+        params = new_params
+        if callback is not None:
+            callback(params)
+        if step < tol:
+            converged = True
+            break
+    return params, iterations, converged
+
+
+def _binary_start_params(start_params, y, X, names, link):
     """
+    start_params:None, "lpm", array, or pd.Series/dict of a previous spec (matched by name,
+                 variables not in the previous spec start at 0).
+    """
+    if start_params is None:
+        return None
+    if isinstance(start_params, str):
+        if start_params != "lpm":
+            raise ValueError("unknown start_params: {}".format(start_params))
+        return lpm_start_params(y, X, link)
+    if isinstance(start_params, (pd.Series, dict)):
+        previous = pd.Series(start_params, dtype=float)
+        return previous.reindex(names).fillna(0.0).to_numpy()
+    return np.asarray(start_params, dtype=float)
+
+
+def _fit_binary(model_class, df, y_var, X_vars, add_intercept, method, start_params, maxiter, disp, callback,
+                check_rank):
     new_df = df.copy()
     new_df = new_df.dropna()
     y = new_df[y_var]
@@ -195,43 +271,94 @@ def probit(df, y_var, X_vars, add_intercept=True):
     else:
         X = new_df[X_vars]
 
-    probit_mod = Probit(endog=y, exog=X, check_rank=True, missing="drop")
-    res = probit_mod.fit(start_params=None, method='newton', maxiter=35, full_output=1, disp=1, callback=None)
-
+    if method not in BINARY_FIT_METHODS:
+        raise ValueError("unknown fit method: {}".format(method))
+
+    link = "probit" if model_class is Probit else "logit"
+    start_time = time.perf_counter()
+    mod = model_class(endog=y, exog=X, check_rank=check_rank, missing="drop")
+    start = _binary_start_params(start_params, mod.endog, mod.exog, list(X.columns), link)
+
+    if method == "irls":
+        params, iterations, converged = irls_binary(mod.endog, mod.exog, link, start_params=start,
+                                                    maxiter=maxiter, callback=callback)
+        # 参数已由IRLS求得, statsmodels只用来生成结果对象(协方差、summary等), 不再迭代
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", ConvergenceWarning)
+            res = mod.fit(start_params=params, method='newton', maxiter=0, full_output=1, disp=0)
+        res.mle_retvals['iterations'] = iterations
+        res.mle_retvals['converged'] = converged
+    else:
+        res = mod.fit(start_params=start, method=method, maxiter=maxiter, full_output=1, disp=disp,
+                      callback=callback)
+
+    res.convergence = {
+        "method": method,
+        "warm_start": start is not None,
+        "iterations": int(res.mle_retvals.get('iterations', res.mle_retvals.get('gcalls', 0))),
+        "converged": bool(res.mle_retvals.get('converged')),
+        "grad_norm": float(np.linalg.norm(mod.score(np.asarray(res.params)))),
+        "seconds": time.perf_counter() - start_time,
+    }
     return res
 
 
-def logit(df, y_var, X_vars, add_intercept=True):
+def probit(df, y_var, X_vars, add_intercept=True, method='newton', start_params=None, maxiter=35, disp=1,
+           callback=None, check_rank=True):
     """
     This function replicates probit in STATA, for probit model.
     至少有一个固定效应变量，至多只能有两个。
-    y变量应为0-1变量。
+    被解释变量y为0-1变量时，模型才有意义
 
     Inputs.
     ---------
     df:pd.DataFrame, the data for OLS.
-    y_var:str, the column name of the dependent variable
+    y_var:str, the column name of the dependent variable, 被解释变量y应为0-1变量
     X_vars:list of str, the list of explanatory variable names
+    method:str, "newton", "bfgs" or "irls" (Fisher scoring with a Cholesky solve)
+    start_params:None, "lpm" (linear probability model), array, or pd.Series of a previous
+                 estimate (matched by variable name)
+    disp:int, 0 for silent mode
+    callback:callable or None, called with the params after each iteration
+    check_rank:bool, False skips the rank computation of statsmodels (a QR of the whole X),
+               only when the design was already checked (see preflight)
 
     Outputs.
     ---------
-    res:obj
+    res:obj, res.convergence holds method, warm_start, iterations, converged, grad_norm, seconds
 
     """
-    new_df = df.copy()
-    new_df = new_df.dropna()
-    y = new_df[y_var]
+    return _fit_binary(Probit, df, y_var, X_vars, add_intercept, method, start_params, maxiter, disp, callback,
+                       check_rank)
 
-    if add_intercept:
-        new_df['intercept'] = 1.0
-        X = new_df[['intercept'] + X_vars]
-    else:
-        X = new_df[X_vars]
 
-    logit_mod = Logit(endog=y, exog=X, check_rank=True, missing="drop")
-    res = logit_mod.fit(start_params=None, method='newton', maxiter=35, full_output=1, disp=1, callback=None)
+def logit(df, y_var, X_vars, add_intercept=True, method='newton', start_params=None, maxiter=35, disp=1,
+          callback=None, check_rank=True):
+    """
+    This function replicates probit in STATA, for probit model.
+    至少有一个固定效应变量，至多只能有两个。
+    y变量应为0-1变量。
 
-    return res
+    Inputs.
+    ---------
+    df:pd.DataFrame, the data for OLS.
+    y_var:str, the column name of the dependent variable
+    X_vars:list of str, the list of explanatory variable names
+    method:str, "newton", "bfgs" or "irls" (Fisher scoring with a Cholesky solve)
+    start_params:None, "lpm" (linear probability model), array, or pd.Series of a previous
+                 estimate (matched by variable name)
+    disp:int, 0 for silent mode
+    callback:callable or None, called with the params after each iteration
+    check_rank:bool, False skips the rank computation of statsmodels (a QR of the whole X),
+               only when the design was already checked (see preflight)
+
+    Outputs.
+    ---------
+    res:obj, res.convergence holds method, warm_start, iterations, converged, grad_norm, seconds
+
+    """
+    return _fit_binary(Logit, df, y_var, X_vars, add_intercept, method, start_params, maxiter, disp, callback,
+                       check_rank)
 
 
 def TSLS(df, y_var, firsts_y, X_vars, IV, add_intercept=True):
@@ -280,7 +407,7 @@ def demean(dat):
     return dat - np.mean(dat, axis=0)
 
 
-def TSLS_FIX(df, y_var, first_y, X_vars, IV, fix1, fix2=None, add_intercept=True):
+def TSLS_FIX(df, y_var, first_y, X_vars, IV, fix1, fix2=None, add_intercept=True, group_index=None):
     """
     This function replicates probit in STATA, for probit model.
     至少有一个固定效应变量，至多只能有两个。
@@ -294,24 +421,28 @@ def TSLS_FIX(df, y_var, first_y, X_vars, IV, fix1, fix2=None, add_intercept=True
     IV:list str, the list of instrument variable names
     fix1:str, the column name of the first fix effect variable
     fix2:str, the column name of the second fix effect variable
+    group_index:GroupIndex or None, the grouping of the rows of df by [fix1] or [fix1, fix2],
+                computed here if not given
 
     Outputs.
     ---------
     res:obj
 
     """
-    new_df = df.copy()
-    new_df = new_df.dropna()
-
-    if fix2 is None:
-        #         data.dropna(subset=[fix1], inplace=True)
-        fix2 = 'time_index'
-        #         new_df = new_df[[y_var] + [first_y] + X_vars + IV + [fix1]]
-        new_df = new_df.groupby(fix1).apply(demean)
-    else:
-        #         data.dropna(subset=[fix1,fix2], inplace=True)
-        #         new_df = new_df[[y_var] + [first_y] + X_vars + IV + [fix1, fix2]]
-        new_df = new_df.groupby([fix1, fix2]).apply(demean)
+    fe_vars = [fix1] if fix2 is None else [fix1, fix2]
+    keep = df.notna().all(axis=1).to_numpy()
+    new_df = df[keep]
+
+    if group_index is None:
+        group_index = GroupIndex.from_frame(new_df, fe_vars)
+    elif not keep.all():
+        group_index = group_index.subset(np.flatnonzero(keep))
+
+    # within transformation by the fixed effects (one group mean per column, no groupby.apply)
+    cols = list(dict.fromkeys([y_var, first_y] + X_vars + IV))
+    new_df = pd.DataFrame(group_index.demean(new_df[cols].to_numpy(dtype=float)), index=new_df.index, columns=cols)
+    # groupby.apply 按组排列各行, 保持同样的行序(Durbin-Watson 等依赖行序的统计量不变)
+    new_df = new_df.iloc[group_index.order]
 
     y = new_df[y_var]
 
@@ -1,7 +1,9 @@
 import os
+import gc
+import glob
 import time
-import uuid
 import logging
+import numpy as np
 import pandas as pd
 
 from numpy.linalg import LinAlgError
@@ -12,11 +14,29 @@ from rest_framework.response import Response
 
 from utils.response_code import RespCode, RespMessage, RespData
 from utils.serializers import BaseResponse
-
-from .Stata_methods import areg, xtreg, probit, logit, TSLS, TSLS_FIX, convert_to_dummies_list
+from share import idgen
+
+from .Stata_methods import areg, xtreg, probit, logit, tobit, TSLS, TSLS_FIX, convert_to_dummies_list
+from .bootstrap import bootstrap
+from .preflight import preflight, DesignCheckError
+from .data_profile import profile_frame
+from .dataset_cache import dataset_cache, DatasetCache
+from .stat_kernel import describe_frame, describe_groups
+from .group_index import GroupIndex
+from .partitioned_reader import read_dataset, read_filtered
+from .where_filter import stats_from_profile
+from .result_writer import write_results, file_suffix
+from .result_record import ResultRecord, LazyResultFiles
+from .job_context import JobContext, JobCancelled, job_registry
+from .job_cost import design_columns, estimate_job, runtime_model
+from .memory_probe import memory_probe
 
 logger = logging.getLogger('finance')
 
+# 同一数据文件、同一被解释变量最近一次probit/logit的估计结果, 供下一次相近的设定热启动
+_previous_params = {}
+MAX_PREVIOUS_PARAMS = 256
+
 
 class CloudAnalysisBase:
     location = settings.SAS_SCRIPT_DIR
@@ -31,90 +51,164 @@ class CloudAnalysisBase:
         self.out_file_prefix_path = None
         self.out_file = None
         self.out_file_name = None
+        self.artifacts = None
+        # 回归分析的精简结果记录(见 result_record.ResultRecord)
+        self.record = None
+        # clean_data 删除了空行时, 保留下来的行在筛选后数据集中的位置
+        self.row_positions = None
+        # 读入的数据单元格数(行数 x 字段数), 运行时间模型中读取文件部分的规模
+        self.read_cells = 0
+        self.memory_report = None
+        # 可取消的任务上下文: 时间预算(settings.ANALYSIS_TIME_BUDGET, 秒)、阶段及迭代进度, 按 job_id 轮询.
+        # 排队(scheduler.run)或运行(result)时才登记到 job_registry, 只做 dry_run 的实例不登记
+        self.context = JobContext(analysis_name=self.analysis_name,
+                                  time_budget=getattr(settings, "ANALYSIS_TIME_BUDGET", None))
+
+    @property
+    def job_id(self):
+        return self.context.job_id
 
     def read_csv_file(self):
         """
         判断文件是否存在, 并读取文件数据, 若读取文件有误则返回False.
+        file_path 也可以是目录或通配符(按月等分区导出的多个csv/csv.gz文件), 此时并发解析各分区并合并,
+        路径中以 key=value 表示的分区键会根据筛选条件裁剪.
+        有筛选条件时读入后即筛选(分区数据集在解析各分区时筛选), 条件编译为向量化的掩码(见 where_filter).
         :return:
         """
         try:
-            file_exist = os.path.isfile(self.file_path)
-            if not file_exist:
+            engine = getattr(settings, "CSV_READ_ENGINE", None)
+            if self.where_string:
+                df, read_cells = read_filtered(self.file_path, self.where_string, engine=engine,
+                                               stats=self.unfiltered_stats())
+            else:
+                df = read_dataset(self.file_path, engine=engine)
+                read_cells = df.size if df is not None else 0
+            if df is None:
                 print("文件不存在!")
                 return False
-            self.df = pd.read_csv(self.file_path)
+            self.df = df
+            self.read_cells = read_cells
             return True
         except Exception as e:
             print("数据文件有误! 错误:", e)
             return False
 
+    def unfiltered_stats(self):
+        """
+        同一文件未筛选时缓存的列概况中各数值列的(最小值, 最大值, 缺失值个数), 用于跳过恒真/恒假的筛选条件,
+        没有缓存时返回None.
+        """
+        try:
+            artifacts = dataset_cache.peek(DatasetCache.make_key(self.file_path))
+        except OSError:
+            return None
+        if artifacts is None or artifacts.profile is None:
+            return None
+        return stats_from_profile(artifacts.profile)
+
     def filter_data(self):
-        # 1. 判断文件是否存在, 并读取文件数据.
+        # 1. 判断文件是否存在, 读取文件数据并根据筛选条件进行分析数据的预筛选
+        self.context.phase("read")
         read_file_result = self.read_csv_file()
         if not read_file_result:
             return False
-        # 2. 根据筛选条件进行分析数据的预筛选
-        if self.where_string:
-            self.df = self.df.query(self.where_string)
+        # 2. 筛选后没有数据时不再分析
+        self.context.phase("filter")
         if self.df.empty:
             print("没有符合筛选条件的数据!!!")
             return False
+        # 3. 同一文件、同一筛选条件的衍生数据(列概况等)在多次分析之间复用
+        self.artifacts = dataset_cache.get(DatasetCache.make_key(self.file_path, self.where_string))
         return True
 
+    @property
+    def profile(self):
+        """
+        筛选后数据集各列的概况(缺失值个数、是否全空、类型、最小最大值、不同值个数估计),
+        对数据只扫描一次, 并随数据集缓存, 供各项检查及描述性统计的nmiss使用.
+        """
+        if self.artifacts is None:
+            return profile_frame(self.df)
+        if self.artifacts.profile is None:
+            self.artifacts.profile = profile_frame(self.df)
+        return self.artifacts.profile
+
     def col_is_na(self, data, check_fields):
         # 检验是否有空列
+        profile = self.profile if data is self.df else profile_frame(data[check_fields])
         for col in check_fields:
-            assert False in data[col].isnull().values, "COLUMN_CAN_NOT_BE_NULL"
+            assert not profile.at[col, "all_null"], "COLUMN_CAN_NOT_BE_NULL"
         return True
 
     def clean_data(self, fields):
         data_is_ready = self.filter_data()
         assert data_is_ready, "READ_FILE_FAIL"
         assert not self.df.empty, "DATASET_CAN_NOT_BE_EMPTY"
+        self.context.phase("clean")
         self.col_is_na(self.df, fields)
+        has_null = self.profile.loc[fields, "nmiss"].any()
         self.df = self.df[fields]
-        self.df = self.df.dropna(axis=0, how="all")
+        if has_null:
+            keep = self.df.notna().any(axis=1).to_numpy()
+            if not keep.all():
+                self.row_positions = np.flatnonzero(keep)
+                self.df = self.df[keep]
 
-    def to_sub_csv(self, res_data):
-        self.return_file = {}
+    def group_index(self, columns):
+        """
+        按columns分组的分组索引(组号、排序、各组边界), 同一数据集同一组分组变量只计算一次并随数据集缓存,
+        供分组统计、分组相关系数、固定效应去均值及dummies转换使用.
+        """
+        if self.artifacts is None:
+            return GroupIndex.from_frame(self.df, columns)
+        key = tuple(columns)
+        group_index = self.artifacts.group_indexes.get(key)
+        if group_index is None:
+            if self.row_positions is not None:
+                # 缓存的分组索引对应筛选后的完整数据集, 已删除部分行时不能由当前数据生成缓存
+                return GroupIndex.from_frame(self.df, columns)
+            group_index = GroupIndex.from_frame(self.df, columns)
+            self.artifacts.group_indexes[key] = group_index
+        if self.row_positions is not None:
+            group_index = group_index.subset(self.row_positions)
+        return group_index
+
+    @staticmethod
+    def name_index(data):
+        """
+        把结果表索引中未命名的层命名为 "Parameters".
+        """
         try:
-            for title, data in res_data.items():
-                try:
-                    # print(data)
-                    index_list = data.index.names.copy()
-                    none_index = index_list.index(None)
-                    index_list[none_index] = "Parameters"
-                    data.index.set_names(index_list, inplace=True)
-                except Exception as e:
-                    print(e)
-                file_path = "{}_{}.csv".format(self.out_file_prefix_path, title)
-                data.to_csv(file_path)
-                self.return_file[title] = file_path
-            return True
+            # print(data)
+            index_list = data.index.names.copy()
+            none_index = index_list.index(None)
+            index_list[none_index] = "Parameters"
+            data.index.set_names(index_list, inplace=True)
         except Exception as e:
             print(e)
-            logger.error("生成csv子结果文件出错, 文件为:{}, 错误为 : {}".format(self.out_file_prefix_path, e))
-            # raise Exception(e)
-            return False
 
-    def to_sum_csv(self, res_data):
+    def to_result_files(self, res_data):
+        """
+        并发生成各子结果文件和总结果文件.
+        结果文件格式由 settings.RESULT_FILE_FORMAT 指定("csv" 或 "parquet", 默认 csv);
+        settings.RESULT_SUMMARY_MODE 为 "index" 时总结果文件只列出各子结果文件, 不再合并各结果表.
+        """
+        self.return_file = {}
+        fmt = getattr(settings, "RESULT_FILE_FORMAT", "csv")
+        summary_mode = getattr(settings, "RESULT_SUMMARY_MODE", "merged")
         try:
-            full_res = res_data.get(self.analysis_show_name)
-            if len(res_data) == 1 and full_res is not None:
-                res = pd.concat([full_res])
-            else:
-                res = pd.concat(res_data, axis=0)
-            # print(res)
-            # index_list = res.index.names.copy()
-            # none_index = index_list.index(None)
-            # index_list[none_index] = "Parameters"
-            # res.index.set_names(index_list, inplace=True)
-            res.to_csv(self.out_file)
+            for data in res_data.values():
+                self.name_index(data)
+            if fmt != "csv" and summary_mode == "merged":
+                self.out_file = os.path.splitext(self.out_file)[0] + file_suffix(fmt)
+                self.out_file_name = os.path.basename(self.out_file)
+            self.return_file = write_results(res_data, self.out_file_prefix_path, self.out_file, fmt=fmt,
+                                             summary_mode=summary_mode, single_key=self.analysis_show_name)
             return True
         except Exception as e:
             print(e)
-            logger.error("生成csv总结果文件出错, 文件为:{}, 错误为 : {}".format(self.out_file, e))
-            # raise Exception(e)
+            logger.error("生成结果文件出错, 文件为:{}, 错误为 : {}".format(self.out_file, e))
             return False
 
     def to_res_html(self, res_data):
@@ -140,20 +234,156 @@ class CloudAnalysisBase:
             # raise Exception(e)
             return False
 
+    def to_res_record(self, res, summary=None):
+        """
+        把回归结果保存为精简记录(系数、标准误、统计量、模型信息及summary表格), 不再引用结果对象和数据.
+        HTML在第一次读取 return_file["res_html_table"] 时生成, csv在 result() 返回前写出.
+        """
+        self.return_file = LazyResultFiles()
+        try:
+            self.record = ResultRecord.from_results(res, summary)
+            self.return_file.set_lazy("res_html_table", self.record.as_html)
+            return True
+        except Exception as e:
+            print(e)
+            logger.error("保存回归结果时出错, 错误为 : {}".format(e))
+            return False
+
+    def write_record_csv(self):
+        try:
+            self.record.write_csv(self.out_file)
+            return True
+        except Exception as e:
+            print(e)
+            logger.error("生成csv结果文件出错, 文件为:{}, 错误为 : {}".format(self.out_file, e))
+            return False
+
+    def to_bootstrap_res(self, boot_res):
+        """
+        把bootstrap的结果(标准误及正态/百分位置信区间)附加到HTML和csv结果之后.
+        """
+        try:
+            res = round(boot_res.summary_frame(), self.accuracy)
+            text = boot_res.summary_text()
+            self.return_file["bootstrap_html_table"] = "<p>{}</p>{}".format(text, res.to_html())
+            if self.record is not None:
+                self.record.add_section(text, res)
+            else:
+                with open(self.out_file, "a") as f:
+                    f.write("\n{}\n".format(text))
+                    res.to_csv(f)
+            return True
+        except Exception as e:
+            print(e)
+            logger.error("生成bootstrap结果时出错, 文件为:{}, 错误为 : {}".format(self.out_file, e))
+            return False
+
+    def analysis_fields(self):
+        """
+        参与分析的字段, 供清洗数据及分析前的资源估算使用. 为空表示使用文件中的全部字段.
+        """
+        return []
+
+    def model_fields(self):
+        """
+        模型中的字段(不含只用于 bootstrap 分群的 bootstrap_cluster).
+        """
+        return self.analysis_fields()
+
+    def estimation_frame(self):
+        """
+        点估计使用的数据: bootstrap_cluster 不是模型中的字段时去掉该列, 分群变量缺失的行只在 bootstrap 重抽样时剔除,
+        不改变点估计的样本.
+        """
+        cluster = getattr(self, "bootstrap_cluster", None)
+        if not cluster or cluster in self.model_fields() or cluster not in self.df.columns:
+            return self.df
+        return self.df.drop(columns=[cluster])
+
+    def dummy_fields(self):
+        """
+        会由 convert_to_dummies_list 展开为虚拟变量的字段.
+        """
+        return list(getattr(self, "dummies_var_list", None) or [])
+
+    def release(self):
+        """
+        任务被取消时立即释放数据及中间结果, 并删除已生成的结果文件.
+        """
+        self.df = None
+        self.record = None
+        self.artifacts = None
+        self.return_file = None
+        if self.out_file_prefix_path:
+            for path in glob.glob(glob.escape(self.out_file_prefix_path) + "*"):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.error("删除结果文件出错, 文件为:{}, 错误为 : {}".format(path, e))
+        gc.collect()
+
     def analyse(self):
         return True
 
     def result(self):
-        res = self.analyse()
+        # 按 settings.MEMORY_PROBE_SAMPLE_RATE 抽样检测运行前后的内存增长, 报告见 self.memory_report
+        job_registry.register(self.context)
+        fields, dummy_fields = list(self.analysis_fields()), self.dummy_fields()
+        probe = None
+        try:
+            with memory_probe(self.analysis_name) as probe:
+                res = self.analyse()
+                # 分析结束后不再使用数据集: 记下规模后在检测结束前释放, 不计入运行后的内存增长
+                shape = self.job_shape(fields, dummy_fields)
+                self.df = None
+        except JobCancelled as e:
+            res = e
+            shape = self.job_shape(fields, dummy_fields)
+        self.memory_report = probe.report if probe is not None else None
+        if res is True and self.record is not None and not self.write_record_csv():
+            res = AssertionError("CAN_NOT_MAKE_RESULT_FILE")
         if res is True:
+            self.finish("done")
+            runtime_model.observe(self.analysis_name, *shape, self.context.elapsed())
             return self.out_file, self.out_file_name, self.return_file
 
+        if isinstance(res, JobCancelled):
+            # 已取消或超出时间预算的任务, 立即释放内存和结果文件
+            self.release()
+            self.finish(res.reason, str(res))
+        else:
+            self.finish("failed", str(res))
+        return self.error_response(res)
+
+    def finish(self, state, message=""):
+        """
+        记录任务的结束状态, 并移入 job_registry 的已结束记录.
+        """
+        self.context.finish(state, message)
+        job_registry.retire(self.context)
+
+    def error_response(self, res):
+        """
+        把分析(或预估)过程中的异常转换为返回给前端的错误响应.
+        """
+        res_data = None
+        if isinstance(res, JobCancelled):
+            res_code = RespCode.ANALYSE_ERROR
+            res_msg = RespMessage.ANALYSE_ERROR
+            res_data = str(res)
+
         elif isinstance(res, AssertionError):
             e_str = str(res)
             print(res)
             res_code = getattr(RespCode, e_str)
             res_msg = getattr(RespMessage, e_str)
 
+        elif isinstance(res, DesignCheckError):
+            # 拟合前的预检查已找出有问题的变量, 一并返回给前端
+            res_code = RespCode.DATASET_MUST_BE_FULL_RANK
+            res_msg = RespMessage.DATASET_MUST_BE_FULL_RANK
+            res_data = str(res)
+
         elif isinstance(res, ValueError) or isinstance(res, ZeroDivisionError) or isinstance(res, PerfectSeparationError):
             res_code = RespCode.DATASET_MUST_BE_FULL_RANK
             res_msg = RespMessage.DATASET_MUST_BE_FULL_RANK
@@ -177,9 +407,41 @@ class CloudAnalysisBase:
             res_code = RespCode.ANALYSE_ERROR
             res_msg = RespMessage.ANALYSE_ERROR
 
-        response = BaseResponse(res_code, res_msg, res_msg)
+        if res_data is None:
+            res_data = res_msg
+        response = BaseResponse(res_code, res_msg, res_data)
         return response
 
+    def job_shape(self, fields=None, dummy_fields=None):
+        """
+        本次分析实际的(文件行数 x 文件字段数, 分析行数, 设计矩阵列数), 供运行时间模型校准.
+        设计矩阵列数与 dry_run 的预估按同样的口径计算(dummies 字段按实际的水平数展开);
+        analyse 会把展开后的 dummies 列加入 x_var_list, 因此由 result() 传入运行前的字段.
+        """
+        if self.df is None:
+            return 0, 0, 0
+        fields = self.analysis_fields() if fields is None else fields
+        dummy_fields = self.dummy_fields() if dummy_fields is None else dummy_fields
+        dummies = {f: max(self.df[f].nunique() - 1, 0) for f in dummy_fields if f in self.df.columns}
+        return self.read_cells, len(self.df), design_columns(fields, self.df.columns, dummies)
+
+    def dry_run(self):
+        """
+        只读取文件元数据和样本行, 预估筛选后的行数、dummies列数、设计矩阵大小、峰值内存以及运行时间(按历史运行校准),
+        供前端在提交耗时很长的任务前提示或拒绝.
+        :return: dict, 出错时返回错误响应
+        """
+        try:
+            estimate = estimate_job(self)
+            estimate["predicted_seconds"] = runtime_model.predict(
+                self.analysis_name, estimate["rows"] * estimate["columns"], estimate["rows_after_filter"],
+                estimate["design_columns"])
+            return estimate
+        except Exception as e:
+            print(e)
+            logger.error("预估分析任务出错, 文件为:{}, 错误为 : {}".format(self.file_path, e))
+            return self.error_response(e)
+
 
 class MethodStatAnalysis(CloudAnalysisBase):
     """
@@ -232,11 +494,14 @@ class MethodStatAnalysis(CloudAnalysisBase):
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def analysis_fields(self):
+        return [*(self.var_list or []), *(self.group_list or [])]
+
     def analyse(self):
         try:
             data_is_ready = self.filter_data()
@@ -250,18 +515,26 @@ class MethodStatAnalysis(CloudAnalysisBase):
             # print(self.df[self.group_list])
             # print(self.df[self.group_list].isna())
             if self.group_list:
-                assert False in self.df[self.group_list].isna().values, "GROUP_VAR_CAN_NOT_BE_NULL"
+                assert not self.profile.loc[self.group_list, "all_null"].all(), "GROUP_VAR_CAN_NOT_BE_NULL"
 
             # 3. 根据要分析的字段列表以及分组条件列表进行组合分析并进行结果的精度调整
+            self.context.phase("compute")
             res_data = {}
 
             # 若有分组参数和分析参数传入
             if self.group_list and self.var_list:
-                # 首先根据分组参数进行分组
-                group_data = self.df.groupby(self.group_list)
-                # 将分组过后的数据集根据要分析的参数进行拆分
+                # 首先根据分组参数进行分组(分组索引随数据集缓存), 数值变量由 describe_groups 一次排序算出全部统计量
+                group_index = self.group_index(self.group_list)
                 for var in self.var_list:
-                    res_data[var] = group_data[var]
+                    if self.profile.at[var, "numeric"]:
+                        values = self.df[var].to_numpy(dtype=float, na_value=np.nan)
+                        res, sizes = describe_groups(values, group_index.codes, group_index.keys)
+                        res['nmiss'] = sizes - res['count']
+                    else:
+                        item = self.df.groupby(self.group_list)[var]
+                        res = item.describe()
+                        res['nmiss'] = item.size() - res['count']
+                    res_data[var] = round(res, self.accuracy)
             # 否则直接对整个数据集进行操作
             else:
                 if self.var_list:
@@ -269,20 +542,18 @@ class MethodStatAnalysis(CloudAnalysisBase):
                 else:
                     res_data[self.analysis_show_name] = self.df
 
-            for label, item in res_data.items():
-                res = item.describe()
-                res = res if self.group_list else res.T
-                if self.group_list:
-                    total_count = item.size()
-                else:
-                    total_count = len(item)
-                res['nmiss'] = total_count - res['count']
-                res = round(res, self.accuracy)
-                res_data[label] = res
-
-            sub_res = self.to_sub_csv(res_data)
-            sum_res = self.to_sum_csv(res_data)
-            assert sub_res and sum_res, "CAN_NOT_MAKE_RESULT_FILE"
+                for label, item in res_data.items():
+                    if self.group_list:
+                        res = item.describe()
+                        res['nmiss'] = item.size() - res['count']
+                    else:
+                        res = describe_frame(item)
+                        res['nmiss'] = self.profile.loc[res.index, "nmiss"].astype(res['count'].dtype)
+                    res = round(res, self.accuracy)
+                    res_data[label] = res
+
+            self.context.phase("result")
+            assert self.to_result_files(res_data), "CAN_NOT_MAKE_RESULT_FILE"
             return True
 
         except Exception as e:
@@ -339,11 +610,14 @@ class MethodCorrAnalysis(CloudAnalysisBase):
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def analysis_fields(self):
+        return [*(self.var_list or []), *(self.group_list or [])]
+
     def analyse(self, methods=None):
         try:
             data_is_ready = self.filter_data()
@@ -351,7 +625,7 @@ class MethodCorrAnalysis(CloudAnalysisBase):
             #     raise Exception("READ_FILE_FAIL")
             assert data_is_ready, "READ_FILE_FAIL"
             if self.group_list:
-                assert False in self.df[self.group_list].isna().values, "GROUP_VAR_CAN_NOT_BE_NULL"
+                assert not self.profile.loc[self.group_list, "all_null"].all(), "GROUP_VAR_CAN_NOT_BE_NULL"
 
             if not methods:
                 methods = [
@@ -362,20 +636,24 @@ class MethodCorrAnalysis(CloudAnalysisBase):
 
             res_data = {}
 
+            self.context.phase("compute")
             if self.group_list:
                 # 分组
-                for m in methods:
-                    res_data[m] = round(self.df.groupby(self.group_list)[self.var_list].corr(m), self.accuracy)
+                group_index = self.group_index(self.group_list)
+                values = self.df[self.var_list]
+                for i, m in enumerate(methods):
+                    self.context.progress(i, len(methods))
+                    frames = [values.iloc[positions].corr(m) for _, positions in group_index.iter_groups()]
+                    res = pd.concat(frames, keys=group_index.keys, names=[*self.group_list, None])
+                    res_data[m] = round(res, self.accuracy)
             else:
                 # 不分组
-                for m in methods:
+                for i, m in enumerate(methods):
+                    self.context.progress(i, len(methods))
                     res_data[m] = round(self.df[self.var_list].corr(m), self.accuracy)
 
-            sub_res = self.to_sub_csv(res_data)
-            sum_res = self.to_sum_csv(res_data)
-            # print(sub_res)
-            # print(sum_res)
-            assert sub_res and sum_res, "CAN_NOT_MAKE_RESULT_FILE"
+            self.context.phase("result")
+            assert self.to_result_files(res_data), "CAN_NOT_MAKE_RESULT_FILE"
             return True
 
         except Exception as e:
@@ -407,29 +685,37 @@ class MethodOLSRegressionWithDummiesAnalysis(CloudAnalysisBase):
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def analysis_fields(self):
+        return [self.y_var, *self.x_var_list, self.absorb_var, *self.dummies_var_list]
+
     def analyse(self):
         try:
-            fields = [self.y_var, *self.x_var_list, self.absorb_var, *self.dummies_var_list]
+            fields = self.analysis_fields()
 
             self.clean_data(fields)
 
             # convert the year column to dummies and append to data
-            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list)
+            self.context.phase("dummies")
+            group_indexes = {var: self.group_index([var]) for var in self.dummies_var_list}
+            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list, group_indexes)
             self.x_var_list = self.x_var_list + dummies_var_list
 
             add_intercept = True
+            self.context.phase("preflight")
+            preflight(self.df, self.y_var, self.x_var_list, add_intercept=add_intercept)
+            self.context.phase("fit")
             res = areg(self.df, y_var=self.y_var, X_vars=self.x_var_list, absorb_var=self.absorb_var,
                        add_intercept=add_intercept)
 
-            res_data = res.summary
-            html_res = self.to_res_html(res_data)
-            csv_res = self.to_res_csv(res_data)
-            assert html_res and csv_res, "CAN_NOT_MAKE_RESULT_FILE"
+            self.context.phase("result")
+            assert self.to_res_record(res), "CAN_NOT_MAKE_RESULT_FILE"
+            # 结果已保存为精简记录, 释放结果对象及其引用的数据
+            del res
 
             # return self.result()
             return True
@@ -463,27 +749,34 @@ class MethodLinearFixedEffectModelAnalysis(CloudAnalysisBase):
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def analysis_fields(self):
+        fields = [self.y_var, *self.x_var_list, self.fix1]
+        if self.fix2:
+            fields.append(self.fix2)
+        return fields
+
     def analyse(self):
         try:
-            fields = [self.y_var, *self.x_var_list, self.fix1]
-            if self.fix2:
-                fields.append(self.fix2)
+            fields = self.analysis_fields()
 
             self.clean_data(fields)
 
             add_intercept = True
+            self.context.phase("preflight")
+            preflight(self.df, self.y_var, self.x_var_list, add_intercept=add_intercept)
+            self.context.phase("fit")
             res = xtreg(self.df, y_var=self.y_var, other_X_vars=self.x_var_list, fix1=self.fix1, fix2=self.fix2,
                         add_intercept=add_intercept)
 
-            res_data = res.summary
-            html_res = self.to_res_html(res_data)
-            csv_res = self.to_res_csv(res_data)
-            assert html_res and csv_res, "CAN_NOT_MAKE_RESULT_FILE"
+            self.context.phase("result")
+            assert self.to_res_record(res), "CAN_NOT_MAKE_RESULT_FILE"
+            # 结果已保存为精简记录, 释放结果对象及其引用的数据
+            del res
 
             # return self.result()
             return True
@@ -502,39 +795,86 @@ class MethodProbitModelWithDummiesAnalysis(CloudAnalysisBase):
     analysis_name = "probit_with_dum"
     analysis_show_name = "Probit Model With Dummies"
 
-    def __init__(self, file_path, y_var, x_var_list, dummies_var_list, where_string=None, accuracy=3):
+    def __init__(self, file_path, y_var, x_var_list, dummies_var_list, where_string=None, accuracy=3,
+                 bootstrap_reps=0, bootstrap_cluster=None, bootstrap_seed=None, fit_method="newton",
+                 warm_start="previous"):
         super().__init__(file_path, where_string)
         self.y_var = y_var
         self.x_var_list = x_var_list
         self.dummies_var_list = dummies_var_list
         self.accuracy = accuracy
+        self.bootstrap_reps = bootstrap_reps
+        self.bootstrap_cluster = bootstrap_cluster
+        self.bootstrap_seed = bootstrap_seed
+        # fit_method: newton/bfgs/irls; warm_start: None, "lpm", 或 "previous"(无历史结果时退回"lpm")
+        self.fit_method = fit_method
+        self.warm_start = warm_start
 
         self.mid_dir = os.path.join(self.analysis_name, time.strftime('%Y%m%d'))
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def model_fields(self):
+        return [self.y_var, *self.x_var_list, *self.dummies_var_list]
+
+    def analysis_fields(self):
+        fields = self.model_fields()
+        if self.bootstrap_cluster and self.bootstrap_cluster not in fields:
+            fields.append(self.bootstrap_cluster)
+        return fields
+
     def analyse(self):
         try:
-            fields = [self.y_var, *self.x_var_list, *self.dummies_var_list]
+            fields = self.analysis_fields()
 
             self.clean_data(fields)
 
             # convert the year column to dummies and append to data
-            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list)
+            self.context.phase("dummies")
+            group_indexes = {var: self.group_index([var]) for var in self.dummies_var_list}
+            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list, group_indexes)
 
             self.x_var_list = self.x_var_list + dummies_var_list
             add_intercept = True
-            res = probit(self.df, y_var=self.y_var, X_vars=self.x_var_list, add_intercept=add_intercept)
-
-            res_data = res.summary()
-            html_res = self.to_res_html(res_data)
-            csv_res = self.to_res_csv(res_data)
-            assert html_res and csv_res, "CAN_NOT_MAKE_RESULT_FILE"
+            previous_key = (self.analysis_name, self.file_path, self.y_var)
+            start_params = self.warm_start
+            if start_params == "previous":
+                start_params = _previous_params.get(previous_key, "lpm")
+            self.context.phase("preflight")
+            model_df = self.estimation_frame()
+            warnings = preflight(model_df, self.y_var, self.x_var_list, add_intercept=add_intercept, binary=True)
+            self.context.phase("fit")
+            res = probit(model_df, y_var=self.y_var, X_vars=self.x_var_list, add_intercept=add_intercept,
+                         method=self.fit_method, start_params=start_params, disp=0, check_rank=False,
+                         callback=self.context.callback)
+            if res.convergence["converged"]:
+                if len(_previous_params) >= MAX_PREVIOUS_PARAMS:
+                    _previous_params.pop(next(iter(_previous_params)))
+                _previous_params[previous_key] = res.params
+
+            self.context.phase("result")
+            assert self.to_res_record(res), "CAN_NOT_MAKE_RESULT_FILE"
+            # 结果已保存为精简记录, 释放结果对象及其引用的数据
+            del res
+            self.return_file["convergence"] = self.record.convergence
+            if warnings:
+                # 准完全分离的变量仍可估计(Stata 会删除该变量), 只作为提示返回
+                logger.warning("{}的变量准完全分离, 文件为:{}, 变量为 : {}".format(
+                    self.analysis_show_name, self.file_path, warnings["quasi_separation"]))
+                self.return_file["convergence"] = dict(self.record.convergence, **warnings)
+
+            if self.bootstrap_reps:
+                self.context.phase("bootstrap")
+                boot_res = bootstrap("probit", self.df, y_var=self.y_var, X_vars=self.x_var_list,
+                                     cluster_var=self.bootstrap_cluster, reps=self.bootstrap_reps,
+                                     seed=self.bootstrap_seed, start_params=self.record.params,
+                                     add_intercept=add_intercept, callback=self.context.progress)
+                assert self.to_bootstrap_res(boot_res), "CAN_NOT_MAKE_RESULT_FILE"
 
             # return self.result()
             return True
@@ -553,39 +893,86 @@ class MethodLogitModelWithDummiesAnalysis(CloudAnalysisBase):
     analysis_name = "logit_with_dum"
     analysis_show_name = "Logit Model With Dummies"
 
-    def __init__(self, file_path, y_var, x_var_list, dummies_var_list, where_string=None, accuracy=3):
+    def __init__(self, file_path, y_var, x_var_list, dummies_var_list, where_string=None, accuracy=3,
+                 bootstrap_reps=0, bootstrap_cluster=None, bootstrap_seed=None, fit_method="newton",
+                 warm_start="previous"):
         super().__init__(file_path, where_string)
         self.y_var = y_var
         self.x_var_list = x_var_list
         self.dummies_var_list = dummies_var_list
         self.accuracy = accuracy
+        self.bootstrap_reps = bootstrap_reps
+        self.bootstrap_cluster = bootstrap_cluster
+        self.bootstrap_seed = bootstrap_seed
+        # fit_method: newton/bfgs/irls; warm_start: None, "lpm", 或 "previous"(无历史结果时退回"lpm")
+        self.fit_method = fit_method
+        self.warm_start = warm_start
 
         self.mid_dir = os.path.join(self.analysis_name, time.strftime('%Y%m%d'))
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def model_fields(self):
+        return [self.y_var, *self.x_var_list, *self.dummies_var_list]
+
+    def analysis_fields(self):
+        fields = self.model_fields()
+        if self.bootstrap_cluster and self.bootstrap_cluster not in fields:
+            fields.append(self.bootstrap_cluster)
+        return fields
+
     def analyse(self):
         try:
-            fields = [self.y_var, *self.x_var_list, *self.dummies_var_list]
+            fields = self.analysis_fields()
 
             self.clean_data(fields)
 
             # convert the year column to dummies and append to data
-            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list)
+            self.context.phase("dummies")
+            group_indexes = {var: self.group_index([var]) for var in self.dummies_var_list}
+            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list, group_indexes)
 
             self.x_var_list = self.x_var_list + dummies_var_list
             add_intercept = True
-            res = logit(self.df, y_var=self.y_var, X_vars=self.x_var_list, add_intercept=add_intercept)
-
-            res_data = res.summary()
-            html_res = self.to_res_html(res_data)
-            csv_res = self.to_res_csv(res_data)
-            assert html_res and csv_res, "CAN_NOT_MAKE_RESULT_FILE"
+            previous_key = (self.analysis_name, self.file_path, self.y_var)
+            start_params = self.warm_start
+            if start_params == "previous":
+                start_params = _previous_params.get(previous_key, "lpm")
+            self.context.phase("preflight")
+            model_df = self.estimation_frame()
+            warnings = preflight(model_df, self.y_var, self.x_var_list, add_intercept=add_intercept, binary=True)
+            self.context.phase("fit")
+            res = logit(model_df, y_var=self.y_var, X_vars=self.x_var_list, add_intercept=add_intercept,
+                        method=self.fit_method, start_params=start_params, disp=0, check_rank=False,
+                        callback=self.context.callback)
+            if res.convergence["converged"]:
+                if len(_previous_params) >= MAX_PREVIOUS_PARAMS:
+                    _previous_params.pop(next(iter(_previous_params)))
+                _previous_params[previous_key] = res.params
+
+            self.context.phase("result")
+            assert self.to_res_record(res), "CAN_NOT_MAKE_RESULT_FILE"
+            # 结果已保存为精简记录, 释放结果对象及其引用的数据
+            del res
+            self.return_file["convergence"] = self.record.convergence
+            if warnings:
+                # 准完全分离的变量仍可估计(Stata 会删除该变量), 只作为提示返回
+                logger.warning("{}的变量准完全分离, 文件为:{}, 变量为 : {}".format(
+                    self.analysis_show_name, self.file_path, warnings["quasi_separation"]))
+                self.return_file["convergence"] = dict(self.record.convergence, **warnings)
+
+            if self.bootstrap_reps:
+                self.context.phase("bootstrap")
+                boot_res = bootstrap("logit", self.df, y_var=self.y_var, X_vars=self.x_var_list,
+                                     cluster_var=self.bootstrap_cluster, reps=self.bootstrap_reps,
+                                     seed=self.bootstrap_seed, start_params=self.record.params,
+                                     add_intercept=add_intercept, callback=self.context.progress)
+                assert self.to_bootstrap_res(boot_res), "CAN_NOT_MAKE_RESULT_FILE"
 
             # return self.result()
             return True
@@ -601,14 +988,77 @@ class MethodLogitModelWithDummiesAnalysis(CloudAnalysisBase):
 
 
 class MethodTobitModelWithDummiesAnalysis(CloudAnalysisBase):
-    pass
+    """
+    Tobit截断回归分析方法, 被解释变量在left处左截断, 在right处右截断(为None时表示该侧不截断).
+    """
+    analysis_name = "tobit_with_dum"
+    analysis_show_name = "Tobit Model With Dummies"
+
+    def __init__(self, file_path, y_var, x_var_list, dummies_var_list, where_string=None, accuracy=3, left=0.0,
+                 right=None):
+        super().__init__(file_path, where_string)
+        self.y_var = y_var
+        self.x_var_list = x_var_list
+        self.dummies_var_list = dummies_var_list
+        self.accuracy = accuracy
+        self.left = left
+        self.right = right
+
+        self.mid_dir = os.path.join(self.analysis_name, time.strftime('%Y%m%d'))
+        self.out_dir = os.path.join(self.out_dir, self.mid_dir)
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        self.out_file_prefix = idgen.new_id()
+        self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
+        self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
+        self.out_file = os.path.join(self.out_dir, self.out_file_name)
+
+    def analysis_fields(self):
+        return [self.y_var, *self.x_var_list, *self.dummies_var_list]
+
+    def analyse(self):
+        try:
+            fields = self.analysis_fields()
+
+            self.clean_data(fields)
+
+            # convert the year column to dummies and append to data
+            self.context.phase("dummies")
+            group_indexes = {var: self.group_index([var]) for var in self.dummies_var_list}
+            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list, group_indexes)
+
+            self.x_var_list = self.x_var_list + dummies_var_list
+            add_intercept = True
+            self.context.phase("preflight")
+            preflight(self.df, self.y_var, self.x_var_list, add_intercept=add_intercept)
+            self.context.phase("fit")
+            res = tobit(self.df, y_var=self.y_var, X_vars=self.x_var_list, left=self.left, right=self.right,
+                        add_intercept=add_intercept, disp=0, callback=self.context.callback)
+
+            self.context.phase("result")
+            assert self.to_res_record(res), "CAN_NOT_MAKE_RESULT_FILE"
+            # 结果已保存为精简记录, 释放结果对象及其引用的数据
+            del res
+
+            # return self.result()
+            return True
+
+        except Exception as e:
+            print(type(e))
+            print(e)
+            logger.error("Tobit Model With Dummies回归分析出错, 错误为 : {}".format(e))
+            # response = BaseResponse(RespCode.ERROR, RespMessage.ERROR, repr(e))
+            # response = BaseResponse(RespCode.ERROR, RespMessage.ERROR, str(e))
+            # return response.data
+            return e
 
 
 class MethodTwoStatgeLinearRegressionsWithDummiesAnalysis(CloudAnalysisBase):
     analysis_name = "ts_lin_reg_with_dum"
     analysis_show_name = "Two Statge Linear Regressions With Dummies"
 
-    def __init__(self, file_path, y_var, x_var_list, first_y, IV_list, dummies_var_list, where_string=None, accuracy=3):
+    def __init__(self, file_path, y_var, x_var_list, first_y, IV_list, dummies_var_list, where_string=None, accuracy=3,
+                 bootstrap_reps=0, bootstrap_cluster=None, bootstrap_seed=None):
         super().__init__(file_path, where_string)
         self.y_var = y_var
         self.x_var_list = x_var_list
@@ -616,34 +1066,61 @@ class MethodTwoStatgeLinearRegressionsWithDummiesAnalysis(CloudAnalysisBase):
         self.IV_list = IV_list
         self.dummies_var_list = dummies_var_list
         self.accuracy = accuracy
+        self.bootstrap_reps = bootstrap_reps
+        self.bootstrap_cluster = bootstrap_cluster
+        self.bootstrap_seed = bootstrap_seed
 
         self.mid_dir = os.path.join(self.analysis_name, time.strftime('%Y%m%d'))
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def model_fields(self):
+        return [self.y_var, *self.x_var_list, self.first_y, *self.IV_list, *self.dummies_var_list]
+
+    def analysis_fields(self):
+        fields = self.model_fields()
+        if self.bootstrap_cluster and self.bootstrap_cluster not in fields:
+            fields.append(self.bootstrap_cluster)
+        return fields
+
     def analyse(self):
         try:
-            fields = [self.y_var, *self.x_var_list, self.first_y, *self.IV_list, *self.dummies_var_list]
+            fields = self.analysis_fields()
 
             self.clean_data(fields)
 
             # convert the year column to dummies and append to data
-            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list)
+            self.context.phase("dummies")
+            group_indexes = {var: self.group_index([var]) for var in self.dummies_var_list}
+            self.df, dummies_var_list = convert_to_dummies_list(self.df, self.dummies_var_list, group_indexes)
 
             self.x_var_list = self.x_var_list + dummies_var_list
             add_intercept = True
-            res = TSLS(self.df, y_var=self.y_var, firsts_y=self.first_y, X_vars=self.x_var_list, IV=self.IV_list,
+            self.context.phase("preflight")
+            model_df = self.estimation_frame()
+            preflight(model_df, self.y_var, [self.first_y, *self.x_var_list], add_intercept=add_intercept,
+                      instruments=[*self.x_var_list, *self.IV_list])
+            self.context.phase("fit")
+            res = TSLS(model_df, y_var=self.y_var, firsts_y=self.first_y, X_vars=self.x_var_list, IV=self.IV_list,
                        add_intercept=add_intercept)
 
-            res_data = res.summary()
-            html_res = self.to_res_html(res_data)
-            csv_res = self.to_res_csv(res_data)
-            assert html_res and csv_res, "CAN_NOT_MAKE_RESULT_FILE"
+            self.context.phase("result")
+            assert self.to_res_record(res), "CAN_NOT_MAKE_RESULT_FILE"
+            # 结果已保存为精简记录, 释放结果对象及其引用的数据
+            del res
+
+            if self.bootstrap_reps:
+                self.context.phase("bootstrap")
+                boot_res = bootstrap("tsls", self.df, y_var=self.y_var, X_vars=self.x_var_list, first_y=self.first_y,
+                                     IV=self.IV_list, cluster_var=self.bootstrap_cluster, reps=self.bootstrap_reps,
+                                     seed=self.bootstrap_seed, start_params=self.record.params,
+                                     add_intercept=add_intercept, callback=self.context.progress)
+                assert self.to_bootstrap_res(boot_res), "CAN_NOT_MAKE_RESULT_FILE"
 
             # return self.result()
             return True
@@ -676,27 +1153,37 @@ class MethodTwoStatgeFixedEffectModelAnalysis(CloudAnalysisBase):
         self.out_dir = os.path.join(self.out_dir, self.mid_dir)
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
-        self.out_file_prefix = str(uuid.uuid1())
+        self.out_file_prefix = idgen.new_id()
         self.out_file_prefix_path = os.path.join(self.out_dir, self.out_file_prefix)
         self.out_file_name = "".join([self.out_file_prefix, "_{}.csv".format(self.analysis_name)])
         self.out_file = os.path.join(self.out_dir, self.out_file_name)
 
+    def analysis_fields(self):
+        fields = [self.y_var, *self.x_var_list, self.first_y, *self.IV_list, self.fix1]
+        if self.fix2:
+            fields.append(self.fix2)
+        return fields
+
     def analyse(self):
         try:
-            fields = [self.y_var, *self.x_var_list, self.first_y, *self.IV_list, self.fix1]
-            if self.fix2:
-                fields.append(self.fix2)
+            fields = self.analysis_fields()
 
             self.clean_data(fields)
 
             add_intercept = False
+            fe_vars = [self.fix1, self.fix2] if self.fix2 else [self.fix1]
+            self.context.phase("preflight")
+            preflight(self.df, self.y_var, [self.first_y, *self.x_var_list], add_intercept=add_intercept,
+                      instruments=[*self.x_var_list, *self.IV_list], fe_vars=fe_vars)
+            self.context.phase("fit")
             res = TSLS_FIX(self.df, y_var=self.y_var, first_y=self.first_y, X_vars=self.x_var_list, IV=self.IV_list,
-                           fix1=self.fix1, fix2=self.fix2, add_intercept=add_intercept)
+                           fix1=self.fix1, fix2=self.fix2, add_intercept=add_intercept,
+                           group_index=self.group_index(fe_vars))
 
-            res_data = res.summary()
-            html_res = self.to_res_html(res_data)
-            csv_res = self.to_res_csv(res_data)
-            assert html_res and csv_res, "CAN_NOT_MAKE_RESULT_FILE"
+            self.context.phase("result")
+            assert self.to_res_record(res), "CAN_NOT_MAKE_RESULT_FILE"
+            # 结果已保存为精简记录, 释放结果对象及其引用的数据
+            del res
 
             # return self.result()
             return True
@@ -0,0 +1,297 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from statsmodels.discrete.discrete_model import Probit
+from statsmodels.discrete.discrete_model import Logit
+from statsmodels.regression.linear_model import OLS
+from statsmodels.sandbox.regression.gmm import IV2SLS
+
+
+BOOTSTRAP_MODELS = ("ols", "probit", "logit", "tsls")
+# 每个工作进程分到的批次数, 批次越小进度回报越及时
+BATCHES_PER_WORKER = 4
+
+# 每个工作进程只接收一次的数据, 由 _init_worker 设置, 各次重抽样只传递随机数种子
+_worker_state = None
+
+
+def build_design(df, y_var, X_vars, first_y=None, IV=None, add_intercept=True):
+    """
+    This function builds the numpy arrays used by the bootstrap, with the same
+    column layout as probit/logit/TSLS in Stata_methods.
+
+    Inputs.
+    ---------
+    df:pd.DataFrame, the data, rows with missing values are dropped.
+    y_var:str, the column name of the dependent variable
+    X_vars:list of str, the list of explanatory variable names
+    first_y:str or None, the column name of the first-stage y (TSLS only)
+    IV:list of str or None, the list of instrument variable names (TSLS only)
+
+    Outputs.
+    ---------
+    new_df:pd.DataFrame, the data after dropna
+    y:1darray
+    X:2darray
+    Z:2darray or None, the instruments
+    names:list of str, the names of the columns of X
+
+    """
+    new_df = df.dropna()
+    y = new_df[y_var].to_numpy(dtype=float)
+
+    names = ([first_y] if first_y else []) + list(X_vars)
+    exog_vars = list(X_vars)
+    if add_intercept:
+        names = ['intercept'] + names
+        exog_vars = ['intercept'] + exog_vars
+
+    X = _columns(new_df, names)
+    Z = _columns(new_df, exog_vars + list(IV)) if IV else None
+    return new_df, y, X, Z, names
+
+
+def _columns(df, names):
+    X = np.empty((len(df), len(names)), dtype=float)
+    for i, name in enumerate(names):
+        X[:, i] = 1.0 if name == 'intercept' else df[name].to_numpy(dtype=float)
+    return X
+
+
+def fit_params(model, y, X, Z=None, start_params=None):
+    """
+    Fits one of BOOTSTRAP_MODELS on arrays and returns the parameter vector.
+    Probit/Logit are warm-started from start_params and run silently.
+    """
+    if model == "probit":
+        res = Probit(y, X).fit(start_params=start_params, method='newton', maxiter=35, disp=0)
+    elif model == "logit":
+        res = Logit(y, X).fit(start_params=start_params, method='newton', maxiter=35, disp=0)
+    elif model == "tsls":
+        res = IV2SLS(y, X, instrument=Z).fit()
+    elif model == "ols":
+        res = OLS(y, X).fit()
+    else:
+        raise ValueError("unknown bootstrap model: {}".format(model))
+    return np.asarray(res.params, dtype=float)
+
+
+def cluster_layout(cluster_values):
+    """
+    Groups the row positions by cluster once, so that a cluster resample is only
+    a draw of cluster ids.
+
+    Outputs.
+    ---------
+    order:1darray, row positions sorted by cluster
+    starts:1darray, the start of each cluster in order
+    sizes:1darray, the number of rows of each cluster
+
+    """
+    codes, _ = pd.factorize(cluster_values, sort=False)
+    order = np.argsort(codes, kind='stable')
+    # 分群变量缺失的行(编码为 -1)排在最前, 不参与重抽样
+    order = order[np.count_nonzero(codes < 0):]
+    if not len(order):
+        raise ValueError("the cluster variable has no non-missing values")
+    sizes = np.bincount(codes[codes >= 0])
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    return order, starts, sizes
+
+
+def draw_indices(rng, n, layout=None):
+    """
+    Draws the row positions of one bootstrap sample.
+    Without layout the rows are resampled in pairs (y, X), otherwise whole
+    clusters are resampled with replacement.
+    """
+    if layout is None:
+        return rng.integers(0, n, size=n)
+
+    order, starts, sizes = layout
+    chosen = rng.integers(0, len(sizes), size=len(sizes))
+    lengths = sizes[chosen]
+    ends = np.cumsum(lengths)
+    offsets = np.repeat(starts[chosen] - (ends - lengths), lengths)
+    return order[offsets + np.arange(ends[-1])]
+
+
+def _init_worker(model, y, X, Z, start_params, layout):
+    global _worker_state
+    _worker_state = (model, y, X, Z, start_params, layout)
+
+
+def _fit_batch(seeds):
+    model, y, X, Z, start_params, layout = _worker_state
+    out = np.full((len(seeds), X.shape[1]), np.nan)
+    for i, seed in enumerate(seeds):
+        idx = draw_indices(np.random.default_rng(seed), len(y), layout)
+        try:
+            out[i] = fit_params(model, y[idx], X[idx], None if Z is None else Z[idx], start_params)
+        except Exception:
+            # 和STATA一致, 无法估计的重抽样样本记为缺失, 不影响其它样本
+            pass
+    return out
+
+
+class BootstrapResult:
+    """
+    Bootstrap replicates of an estimator with the usual vce(bootstrap) report.
+
+    params:1darray, the full-sample estimate
+    replicates:2darray, one row of estimates for each replicate (nan if failed)
+    names:list of str, parameter names
+    level:float, confidence level of the intervals
+    unclustered:int, rows of the full sample left out of the cluster resample for a missing cluster id
+    """
+
+    def __init__(self, params, replicates, names, level=0.95, cluster_var=None, unclustered=0):
+        self.params = np.asarray(params, dtype=float)
+        self.replicates = replicates
+        self.names = names
+        self.level = level
+        self.cluster_var = cluster_var
+        self.unclustered = unclustered
+
+    @property
+    def reps(self):
+        return len(self.replicates)
+
+    @property
+    def failed_reps(self):
+        return int(np.isnan(self.replicates).any(axis=1).sum())
+
+    @property
+    def bse(self):
+        return np.nanstd(self.replicates, axis=0, ddof=1)
+
+    def conf_int_normal(self):
+        z = stats.norm.ppf(0.5 + self.level / 2)
+        return self.params - z * self.bse, self.params + z * self.bse
+
+    def conf_int_percentile(self):
+        alpha = (1 - self.level) / 2
+        return tuple(np.nanpercentile(self.replicates, [100 * alpha, 100 * (1 - alpha)], axis=0))
+
+    def summary_frame(self):
+        bse = self.bse
+        z = self.params / bse
+        lo = (1 - self.level) / 2
+        normal_lo, normal_hi = self.conf_int_normal()
+        pct_lo, pct_hi = self.conf_int_percentile()
+        res = pd.DataFrame({
+            "Observed Coef.": self.params,
+            "Bootstrap Std. Err.": bse,
+            "z": z,
+            "P>|z|": 2 * stats.norm.sf(np.abs(z)),
+            "Normal [{:g}".format(lo): normal_lo,
+            "Normal {:g}]".format(1 - lo): normal_hi,
+            "Percentile [{:g}".format(lo): pct_lo,
+            "Percentile {:g}]".format(1 - lo): pct_hi,
+        }, index=pd.Index(self.names, name="Parameters"))
+        return res
+
+    def summary_text(self):
+        title = "Bootstrap results: replications = {}, failed = {}".format(self.reps, self.failed_reps)
+        if self.cluster_var:
+            title += ", clustered by {}".format(self.cluster_var)
+        if self.unclustered:
+            title += ", {} observations with missing {} not resampled".format(self.unclustered, self.cluster_var)
+        return title
+
+
+def bootstrap(model, df, y_var, X_vars, first_y=None, IV=None, cluster_var=None, reps=200, seed=None,
+              n_jobs=None, start_params=None, add_intercept=True, level=0.95, callback=None):
+    """
+    This function replicates vce(bootstrap) in STATA for probit/logit/TSLS/OLS.
+
+    Inputs.
+    ---------
+    model:str, one of "probit", "logit", "tsls", "ols"
+    df:pd.DataFrame, the data
+    y_var:str, the column name of the dependent variable
+    X_vars:list of str, the list of explanatory variable names
+    first_y:str, the column name of the first-stage y (TSLS only)
+    IV:list of str, the list of instrument variable names (TSLS only)
+    cluster_var:str or None, resample whole clusters of this column instead of single rows,
+                rows with a missing cluster id stay in the full-sample estimate but are not resampled
+    reps:int, the number of bootstrap replications
+    seed:int or None, replicate i always uses the i-th child stream of this seed,
+         so the result does not depend on n_jobs
+    n_jobs:int or None, the number of worker processes (default os.cpu_count())
+    start_params:array or None, the full-sample estimate used as warm start
+                 (computed here if not given)
+    callback:callable or None, called as callback(done, reps) after each batch of replications,
+             an exception raised by it stops the bootstrap
+
+    Outputs.
+    ---------
+    res:BootstrapResult
+
+    Example use.
+    -------------
+    res = probit(df, "y", ["x1", "x2"])
+    boot = bootstrap("probit", df, "y", ["x1", "x2"], reps=500, seed=1, start_params=res.params)
+    boot.summary_frame()
+
+    """
+    if model not in BOOTSTRAP_MODELS:
+        raise ValueError("unknown bootstrap model: {}".format(model))
+
+    clusters = None
+    model_vars = [y_var, *X_vars, *([first_y] if first_y else []), *(IV or [])]
+    if cluster_var and cluster_var not in model_vars:
+        # 分群变量不在模型中时不参与 dropna, 使样本与点估计相同
+        df, clusters = df.drop(columns=[cluster_var]), df[cluster_var].to_numpy()
+        clusters = clusters[df.notna().all(axis=1).to_numpy()]
+    new_df, y, X, Z, names = build_design(df, y_var, X_vars, first_y=first_y, IV=IV, add_intercept=add_intercept)
+    if cluster_var and clusters is None:
+        clusters = new_df[cluster_var].to_numpy()
+    if start_params is None:
+        start_params = fit_params(model, y, X, Z)
+    start_params = np.asarray(start_params, dtype=float)
+
+    layout = cluster_layout(clusters) if cluster_var else None
+    unclustered = int(pd.isna(clusters).sum()) if cluster_var else 0
+    seeds = np.random.SeedSequence(seed).spawn(reps)
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    n_jobs = max(1, min(n_jobs, reps))
+    size = -(-reps // (n_jobs * BATCHES_PER_WORKER))
+    starts = range(0, reps, size)
+    init_args = (model, y, X, Z, start_params, layout)
+
+    # 各批次的结果按重抽样编号放回原来的顺序
+    replicates = np.empty((reps, len(names)))
+    done = 0
+    if n_jobs == 1:
+        _init_worker(*init_args)
+        try:
+            for start in starts:
+                batch = _fit_batch(seeds[start:start + size])
+                replicates[start:start + len(batch)] = batch
+                done += len(batch)
+                if callback is not None:
+                    callback(done, reps)
+        finally:
+            _init_worker(None, None, None, None, None, None)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=init_args) as pool:
+            futures = {pool.submit(_fit_batch, seeds[start:start + size]): start for start in starts}
+            try:
+                for future in as_completed(futures):
+                    start = futures[future]
+                    batch = future.result()
+                    replicates[start:start + len(batch)] = batch
+                    done += len(batch)
+                    if callback is not None:
+                        callback(done, reps)
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    return BootstrapResult(start_params, replicates, names, level=level, cluster_var=cluster_var,
+                           unclustered=unclustered)
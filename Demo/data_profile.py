@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+
+PROFILE_FIELDS = ["dtype", "numeric", "nmiss", "all_null", "min", "max", "distinct"]
+# 估计不同值个数时使用的样本行数, 行数不超过该值时为精确值
+DISTINCT_SAMPLE_ROWS = 20000
+
+
+def estimate_distinct(sample, total_rows):
+    """
+    This function estimates the number of distinct values of a column from a row sample with
+    the GEE estimator (Charikar et al. 2000): sqrt(n/m) * f1 + (d - f1), f1 being the number of
+    values seen exactly once in the sample.
+
+    Inputs.
+    ---------
+    sample:pd.Series, the sampled values (nulls excluded)
+    total_rows:int, the number of non-null rows of the full column
+
+    Outputs.
+    ---------
+    distinct:int
+
+    """
+    counts = sample.value_counts(dropna=True)
+    if len(sample) >= total_rows:
+        return len(counts)
+    f1 = int((counts == 1).sum())
+    estimate = np.sqrt(total_rows / max(len(sample), 1)) * f1 + (len(counts) - f1)
+    return int(min(round(estimate), total_rows))
+
+
+def profile_frame(df, distinct_sample=DISTINCT_SAMPLE_ROWS):
+    """
+    This function computes a profile of every column of df in one vectorized pass per dtype block:
+    dtype, numeric-ness, number of missing values, all-null flag, min, max and an estimate of the
+    number of distinct values.
+
+    Inputs.
+    ---------
+    df:pd.DataFrame
+    distinct_sample:int, the number of rows sampled for the distinct estimate
+
+    Outputs.
+    ---------
+    profile:pd.DataFrame, indexed by column name, the columns are PROFILE_FIELDS
+
+    Example use.
+    -------------
+    profile = profile_frame(data)
+    profile.loc["year", "nmiss"]
+
+    """
+    n = len(df)
+    profile = pd.DataFrame(index=df.columns, columns=PROFILE_FIELDS, dtype=object)
+    profile["dtype"] = [str(t) for t in df.dtypes]
+
+    numeric_cols = [c for c, t in df.dtypes.items() if pd.api.types.is_numeric_dtype(t)
+                    and not pd.api.types.is_bool_dtype(t)]
+    numeric = df.columns.isin(numeric_cols)
+    profile["numeric"] = numeric
+
+    nmiss = np.zeros(len(df.columns), dtype=np.int64)
+    mins = np.full(len(df.columns), np.nan)
+    maxs = np.full(len(df.columns), np.nan)
+    if numeric_cols:
+        # 数值列整体取为一个二维数组, 缺失值个数、最小值、最大值各为一次按列的向量化归约
+        values = df[numeric_cols].to_numpy(dtype=float, na_value=np.nan)
+        null = np.isnan(values)
+        nmiss[numeric] = null.sum(axis=0)
+        if n:
+            # fmin/fmax 忽略缺失值, 整列缺失时结果仍为 nan
+            mins[numeric] = np.fmin.reduce(values, axis=0)
+            maxs[numeric] = np.fmax.reduce(values, axis=0)
+    if not numeric.all():
+        nmiss[~numeric] = df.loc[:, ~numeric].isna().sum(axis=0).to_numpy()
+
+    profile["nmiss"] = nmiss
+    profile["all_null"] = nmiss == n
+    profile["min"] = mins
+    profile["max"] = maxs
+
+    sample = df if n <= distinct_sample else df.sample(n=distinct_sample, random_state=0)
+    profile["distinct"] = [estimate_distinct(sample.iloc[:, i].dropna(), n - nmiss[i])
+                           for i in range(len(df.columns))]
+    return profile
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+
+from .partitioned_reader import is_partitioned, list_partitions
+
+
+# 最多缓存多少个(文件, 筛选条件)组合的衍生数据
+MAX_CACHED_DATASETS = 64
+
+
+class DatasetArtifacts:
+    """
+    同一数据集(同一文件内容 + 同一筛选条件)上可重复使用的衍生数据, 不保存数据本身.
+        profile: 各列的概况(见 data_profile.profile_frame)
+        group_indexes: {分组变量元组: GroupIndex}, 分组索引(见 group_index.GroupIndex)
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.profile = None
+        self.group_indexes = {}
+
+
+class DatasetCache:
+    """
+    进程内的数据集衍生数据缓存, 按最近使用淘汰.
+    key 为 (文件绝对路径, 文件大小, 修改时间, 筛选条件), 文件被覆盖后 key 随之改变, 旧的缓存自然失效;
+    目录/通配符数据集的 key 包含每个分区文件的路径、大小和修改时间.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_DATASETS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(file_path, where_string=None):
+        if not is_partitioned(file_path):
+            stat = os.stat(file_path)
+            return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, where_string or ""
+        # 分区数据集: 任何一个分区文件变化(或增删分区)都使 key 改变
+        stats = []
+        for f in list_partitions(file_path):
+            stat = os.stat(f)
+            stats.append((f, stat.st_size, stat.st_mtime_ns))
+        return os.path.abspath(file_path), tuple(stats), None, where_string or ""
+
+    def get(self, key):
+        """
+        获取 key 对应的衍生数据, 不存在时新建.
+        """
+        with self._lock:
+            artifacts = self._entries.get(key)
+            if artifacts is None:
+                artifacts = DatasetArtifacts(key)
+                self._entries[key] = artifacts
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            return artifacts
+
+    def peek(self, key):
+        """
+        获取 key 对应的衍生数据, 不存在时返回 None(不新建, 不影响淘汰顺序).
+        """
+        with self._lock:
+            return self._entries.get(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+dataset_cache = DatasetCache()
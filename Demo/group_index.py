@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+    """
+    Factorized grouping of a dataset by one or more columns, computed once and reused by grouped
+    statistics, grouped correlations, fixed-effect demeaning and dummy expansion instead of
+    hashing the keys again on every groupby.
+
+    codes:1darray of int64, the group number of each row, -1 when a key is missing
+          (these rows are dropped, like groupby(dropna=True))
+    keys:pd.Index or pd.MultiIndex, the sorted observed keys, keys[i] is the key of group i,
+         the same as df.groupby(columns).size().index
+    order:1darray, positions of the grouped rows sorted by group (stable)
+    starts, sizes:1darray, group i is order[starts[i]:starts[i] + sizes[i]]
+    """
+
+    def __init__(self, codes, keys):
+        self.codes = codes
+        self.keys = keys
+        self.sizes = np.bincount(codes[codes >= 0], minlength=len(keys))
+        self.starts = np.cumsum(self.sizes) - self.sizes
+        order = np.argsort(codes, kind='stable')
+        self.order = order[np.count_nonzero(codes < 0):]
+
+    @property
+    def n_groups(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.order.nbytes + self.sizes.nbytes + self.starts.nbytes
+
+    @classmethod
+    def from_frame(cls, df, columns):
+        """
+        This function factorizes the key columns of df (each column once, sorted) and combines
+        them into one group number per row.
+
+        Inputs.
+        ---------
+        df:pd.DataFrame
+        columns:list of str, the group columns
+
+        Outputs.
+        ---------
+        GroupIndex
+
+        """
+        columns = list(columns)
+        factorized = [pd.factorize(df[col], sort=True) for col in columns]
+        if len(columns) == 1:
+            codes, uniques = factorized[0]
+            return cls(codes.astype(np.int64), pd.Index(uniques, name=columns[0]))
+
+        shape = tuple(max(len(uniques), 1) for _, uniques in factorized)
+        col_codes = [codes for codes, _ in factorized]
+        valid = np.logical_and.reduce([c >= 0 for c in col_codes])
+        if np.prod(shape, dtype=float) < 2 ** 62:
+            flat = np.ravel_multi_index([c[valid] for c in col_codes], shape)
+            observed, inverse = np.unique(flat, return_inverse=True)
+            key_codes = np.unravel_index(observed, shape)
+        else:
+            # 组合数过多时退回按行比较组合键
+            stacked = np.column_stack([c[valid] for c in col_codes])
+            key_codes_2d, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            key_codes = key_codes_2d.T
+        codes = np.full(len(df), -1, dtype=np.int64)
+        codes[valid] = inverse.ravel()
+        keys = pd.MultiIndex.from_arrays(
+            [uniques.take(k) for (_, uniques), k in zip(factorized, key_codes)], names=columns)
+        return cls(codes, keys)
+
+    def subset(self, positions):
+        """
+        Returns the GroupIndex of the rows at positions (e.g. after dropna), groups that become
+        empty are removed.
+        """
+        codes = self.codes[positions]
+        used = np.bincount(codes[codes >= 0], minlength=self.n_groups) > 0
+        remap = np.full(self.n_groups + 1, -1, dtype=np.int64)
+        remap[np.flatnonzero(used)] = np.arange(used.sum())
+        return GroupIndex(remap[codes], self.keys[used])
+
+    def group_means(self, values):
+        """
+        values:2darray (n x k), returns the (n_groups x k) means of each group, nan ignored.
+        """
+        valid_rows = self.codes >= 0
+        codes = self.codes[valid_rows]
+        values = values[valid_rows]
+        means = np.empty((self.n_groups, values.shape[1]))
+        for j in range(values.shape[1]):
+            x = values[:, j]
+            ok = ~np.isnan(x)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[:, j] = (np.bincount(codes[ok], weights=x[ok], minlength=self.n_groups) /
+                               np.bincount(codes[ok], minlength=self.n_groups))
+        return means
+
+    def demean(self, values):
+        """
+        Within transformation: subtracts the group mean from each row, rows without a group
+        become nan.
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            return self.demean(values[:, None])[:, 0]
+        out = np.full(values.shape, np.nan)
+        valid_rows = self.codes >= 0
+        out[valid_rows] = values[valid_rows] - self.group_means(values)[self.codes[valid_rows]]
+        return out
+
+    def dummies(self):
+        """
+        Returns the (n x n_groups) 0-1 matrix, column i is the indicator of group i.
+        """
+        res = np.zeros((len(self.codes), self.n_groups), dtype=int)
+        rows = np.flatnonzero(self.codes >= 0)
+        res[rows, self.codes[rows]] = 1
+        return res
+
+    def iter_groups(self):
+        """
+        Yields (key, positions) for each group in key order.
+        """
+        for i, key in enumerate(self.keys):
+            start = self.starts[i]
+            yield key, self.order[start:start + self.sizes[i]]
@@ -0,0 +1,164 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+# 各阶段开始时的进度(百分比)
+PHASE_PERCENT = {
+    "queued": 0,
+    "read": 5,
+    "filter": 15,
+    "clean": 25,
+    "dummies": 35,
+    "preflight": 45,
+    "compute": 50,
+    "fit": 50,
+    "result": 70,
+    "bootstrap": 75,
+    "done": 100,
+}
+# 状态记录中保留的已结束任务数
+MAX_FINISHED_JOBS = 1000
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside an analysis when its job was cancelled or ran out of its time budget.
+    reason:str, "cancelled" or "timeout"
+    """
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class JobContext:
+    """
+    The cancellable context an analysis runs under. The analysis reports its phases and the
+    optimizer iterations to it, and at each report the context raises JobCancelled if the job was
+    cancelled or has run longer than its wall-time budget (the check is cooperative, a running
+    numpy/statsmodels call is not interrupted).
+
+    job_id:str
+    time_budget:float or None, seconds
+    """
+
+    def __init__(self, job_id=None, analysis_name="", time_budget=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.analysis_name = analysis_name
+        self.time_budget = time_budget
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.state = "queued"
+        self.phase_name = "queued"
+        self.percent = 0
+        self.iteration = 0
+        self.message = ""
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled("cancelled", "job {} was cancelled".format(self.job_id))
+        if self.time_budget is not None and self.elapsed() > self.time_budget:
+            raise JobCancelled("timeout", "job {} exceeded its time budget of {}s".format(self.job_id,
+                                                                                         self.time_budget))
+
+    def phase(self, name, percent=None):
+        """
+        进入新的阶段, 更新进度并检查是否已取消或超时.
+        """
+        if self.started_at is None:
+            self.started_at = time.time()
+            self.state = "running"
+        self.phase_name = name
+        self.percent = PHASE_PERCENT.get(name, self.percent) if percent is None else percent
+        self.iteration = 0
+        self.check()
+
+    def callback(self, *args):
+        """
+        优化器每次迭代的回调(statsmodels fit 的 callback), 记录迭代次数并检查是否已取消或超时.
+        """
+        self.iteration += 1
+        self.check()
+
+    def progress(self, done, total):
+        """
+        阶段内的进度回调(如bootstrap已完成的重抽样次数), 在当前阶段与下一阶段之间按比例推进.
+        """
+        start = PHASE_PERCENT.get(self.phase_name, self.percent)
+        following = [p for p in PHASE_PERCENT.values() if p > start]
+        end = min(following) if following else 100
+        self.percent = start + (end - start) * done / max(total, 1)
+        self.iteration = done
+        self.check()
+
+    def finish(self, state, message=""):
+        self.state = state
+        self.message = message
+        self.finished_at = time.time()
+        if state == "done":
+            self.phase_name = "done"
+            self.percent = 100
+
+    def status(self):
+        return {
+            "job_id": self.job_id,
+            "analysis": self.analysis_name,
+            "state": self.state,
+            "phase": self.phase_name,
+            "percent": round(self.percent, 1),
+            "iteration": self.iteration,
+            "elapsed": round(self.elapsed(), 3),
+            "time_budget": self.time_budget,
+            "message": self.message,
+        }
+
+
+class JobRegistry:
+    """
+    进程内的任务状态记录, 供前端按 job_id 轮询进度或取消任务.
+    任务开始排队或运行时登记, 结束后移入已结束记录, 只保留最近 max_finished 个.
+    """
+
+    def __init__(self, max_finished=MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, context):
+        with self._lock:
+            if context.job_id not in self._finished:
+                self._jobs[context.job_id] = context
+        return context
+
+    def retire(self, context):
+        """
+        任务结束后调用, 移入已结束记录并删除最早的记录.
+        """
+        with self._lock:
+            self._jobs.pop(context.job_id, None)
+            self._finished[context.job_id] = context
+            while len(self._finished) > self.max_finished:
+                self._finished.popitem(last=False)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id) or self._finished.get(job_id)
+
+job_registry = JobRegistry()
@@ -0,0 +1,229 @@
+import gzip
+import io
+import os
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import nnls
+
+from .data_profile import estimate_distinct
+from .partitioned_reader import list_partitions, add_partition_columns, prune_partitions
+from .where_filter import apply_where
+
+
+# 估算时读取的样本大小(解压后的字节数)
+SAMPLE_BYTES = 1 << 20
+# 各类分析的峰值内存相对于设计矩阵大小的倍数(数据拷贝、dummies、协方差及迭代的工作区等)
+ESTIMATOR_MEMORY_FACTORS = {
+    "ts_stat": 2.0,
+    "ts_corr": 2.0,
+    "ols_reg_with_dum": 4.0,
+    "lin_fix_eff": 4.0,
+    "probit_with_dum": 5.0,
+    "logit_with_dum": 5.0,
+    "tobit_with_dum": 5.0,
+    "ts_lin_reg_with_dum": 5.0,
+    "ts_fix_eff": 4.0,
+}
+DEFAULT_MEMORY_FACTOR = 5.0
+# 读入数据时解析缓冲区及筛选产生的拷贝, 相对于数据本身大小的倍数
+READ_MEMORY_FACTOR = 2.0
+
+# 运行时间模型: 秒数 = 固定开销 + 读取系数 * 读入单元格数 + 计算系数 * work_units, 系数由历史运行校准,
+# 历史运行不足时使用下列默认值
+DEFAULT_OVERHEAD_SECONDS = 0.05
+DEFAULT_READ_SECONDS_PER_CELL = 1e-7
+DEFAULT_WORK_SECONDS_PER_UNIT = {
+    "ts_stat": 5e-9,
+    "ts_corr": 2e-8,
+    "ols_reg_with_dum": 2e-9,
+    "lin_fix_eff": 2e-9,
+    "probit_with_dum": 1e-8,
+    "logit_with_dum": 1e-8,
+    "tobit_with_dum": 2e-8,
+    "ts_lin_reg_with_dum": 3e-9,
+    "ts_fix_eff": 3e-9,
+}
+MIN_RUNTIME_OBSERVATIONS = 5
+MAX_RUNTIME_OBSERVATIONS = 200
+
+
+def sample_dataset(path, nbytes=SAMPLE_BYTES, where_string=None):
+    """
+    This function reads the head of a dataset (the first partition of a partitioned one) and
+    extrapolates the number of rows from the file sizes, without loading the data.
+
+    Inputs.
+    ---------
+    path:str, a csv/csv.gz file, a directory or a glob of partitions
+    nbytes:int, the number of (uncompressed) bytes sampled
+    where_string:str or None, partitions excluded by the filter are not counted, if all of them
+                 are excluded only the header is read and the dataset counts as empty
+
+    Outputs.
+    ---------
+    sample:pd.DataFrame, the sampled rows
+    rows:int, the estimated number of rows of the whole dataset
+    file_bytes:int, the total size of the files on disk
+
+    """
+    files = list_partitions(path)
+    assert files, "READ_FILE_FAIL"
+    selected = prune_partitions(files, where_string)
+    if not selected:
+        # 所有分区均被裁剪, 与读取时一样只有表头, 不会读入任何数据
+        return add_partition_columns(pd.read_csv(files[0], nrows=0), files[0]), 0, 0
+    files = selected
+    file_bytes = sum(os.path.getsize(f) for f in files)
+    first = files[0]
+    with open(first, "rb") as raw:
+        stream = gzip.GzipFile(fileobj=raw) if first.endswith(".gz") else raw
+        data = stream.read(nbytes + 1)
+        # 磁盘字节数 / 解压后字节数, 未压缩时为1
+        disk_ratio = raw.tell() / max(len(data), 1)
+    complete = len(data) <= nbytes
+    if not complete:
+        # 只保留完整的行
+        data = data[:data.rfind(b"\n") + 1]
+    sample = add_partition_columns(pd.read_csv(io.BytesIO(data)), first)
+
+    if complete and len(files) == 1:
+        return sample, len(sample), file_bytes
+    # 由样本每行(含表头)的磁盘字节数和总文件大小推算总行数
+    disk_bytes_per_row = disk_ratio * len(data) / (len(sample) + 1)
+    rows = int(file_bytes / max(disk_bytes_per_row, 1))
+    return sample, rows, file_bytes
+
+
+def dummy_columns(sample, rows, dummy_fields):
+    """
+    This function estimates the number of dummy columns convert_to_dummies_list generates for
+    each field (number of distinct values - 1), from a row sample.
+
+    Outputs.
+    ---------
+    columns:dict, {field: estimated number of dummy columns}
+
+    """
+    columns = {}
+    for field in dummy_fields:
+        if field not in sample.columns:
+            continue
+        values = sample[field].dropna()
+        non_null_rows = int(rows * len(values) / max(len(sample), 1))
+        columns[field] = max(estimate_distinct(values, non_null_rows) - 1, 0)
+    return columns
+
+
+def design_columns(fields, columns, dummies):
+    """
+    设计矩阵的列数: 参与分析的字段(文件中存在的, 未指定时为全部字段)中 dummies 字段展开为 dummies 列, 加上常数项.
+    dry_run 的预估与运行后的实际规模(job_shape)都按此计算.
+    :param fields: list, 参与分析的字段(analysis_fields)
+    :param columns: 数据集的字段
+    :param dummies: dict, {dummies字段: dummies列数}
+    :return: int
+    """
+    fields = [f for f in fields if f in columns] or list(columns)
+    return len(fields) - len(dummies) + sum(dummies.values()) + 1
+
+
+def estimate_job(analysis, sample=None, rows=None, file_bytes=None):
+    """
+    This function estimates the size of an analysis job from the file metadata and a row sample:
+    rows before and after the where filter (the filter is applied to the sample), design-matrix
+    columns (dummies expanded) and peak memory.
+
+    Inputs.
+    ---------
+    analysis:CloudAnalysisBase
+    sample, rows, file_bytes:the output of sample_dataset(analysis.file_path), read if not given
+
+    Outputs.
+    ---------
+    estimate:dict, rows, rows_after_filter, sample_rows, file_bytes, columns, dummy_columns,
+             design_columns, design_bytes, memory_bytes
+
+    """
+    if sample is None:
+        sample, rows, file_bytes = sample_dataset(analysis.file_path, where_string=analysis.where_string)
+    filtered = apply_where(sample, analysis.where_string)
+    rows_after_filter = int(rows * len(filtered) / max(len(sample), 1))
+    dummies = dummy_columns(filtered, rows_after_filter, analysis.dummy_fields())
+
+    # 读入时解析全部字段, 之后只保留参与分析的字段并展开dummies
+    data_bytes = rows * sample.memory_usage(index=False, deep=True).sum() / max(len(sample), 1)
+    columns = design_columns(analysis.analysis_fields(), sample.columns, dummies)
+    design_bytes = rows_after_filter * columns * 8
+    factor = ESTIMATOR_MEMORY_FACTORS.get(analysis.analysis_name, DEFAULT_MEMORY_FACTOR)
+    return {
+        "rows": rows,
+        "rows_after_filter": rows_after_filter,
+        "sample_rows": len(sample),
+        "file_bytes": file_bytes,
+        "columns": len(sample.columns),
+        "dummy_columns": dummies,
+        "design_columns": columns,
+        "design_bytes": int(design_bytes),
+        "memory_bytes": int(READ_MEMORY_FACTOR * data_bytes + factor * design_bytes),
+    }
+
+
+def work_units(analysis_name, rows, columns):
+    """
+    计算部分的规模: 描述性统计按排序 n*k*log(n), 相关系数按 n*k^2*log(n), 回归按 X'X 的 n*k^2.
+    """
+    if analysis_name == "ts_stat":
+        return rows * columns * np.log2(rows + 2)
+    if analysis_name == "ts_corr":
+        return rows * columns ** 2 * np.log2(rows + 2)
+    return rows * columns ** 2
+
+
+class RuntimeModel:
+    """
+    Predicts the runtime of an analysis as overhead + a * read_cells + b * work_units, fitted per
+    analysis by non-negative least squares on the recent runs, the DEFAULT_* coefficients are used
+    until MIN_RUNTIME_OBSERVATIONS runs are recorded.
+    """
+
+    def __init__(self):
+        self._observations = {}
+        self._coefficients = {}
+        self._lock = threading.Lock()
+
+    def _default(self, analysis_name):
+        return np.array([DEFAULT_OVERHEAD_SECONDS, DEFAULT_READ_SECONDS_PER_CELL,
+                         DEFAULT_WORK_SECONDS_PER_UNIT.get(analysis_name, 1e-8)])
+
+    def coefficients(self, analysis_name):
+        with self._lock:
+            coefficients = self._coefficients.get(analysis_name)
+        return coefficients if coefficients is not None else self._default(analysis_name)
+
+    def observe(self, analysis_name, read_cells, rows, columns, seconds):
+        """
+        记录一次实际运行并重新拟合该分析的系数.
+        """
+        if rows <= 0:
+            return
+        with self._lock:
+            observations = self._observations.setdefault(analysis_name, deque(maxlen=MAX_RUNTIME_OBSERVATIONS))
+            observations.append((1.0, read_cells, work_units(analysis_name, rows, columns), seconds))
+            if len(observations) < MIN_RUNTIME_OBSERVATIONS:
+                return
+            data = np.array(observations, dtype=float)
+            # 各列缩放到相近的量级再求解, 避免病态
+            scale = np.abs(data[:, :3]).max(axis=0)
+            scale[scale == 0] = 1.0
+            coefficients, _ = nnls(data[:, :3] / scale, data[:, 3])
+            self._coefficients[analysis_name] = coefficients / scale
+
+    def predict(self, analysis_name, read_cells, rows, columns):
+        features = np.array([1.0, read_cells, work_units(analysis_name, rows, columns)])
+        return float(features @ self.coefficients(analysis_name))
+
+
+runtime_model = RuntimeModel()
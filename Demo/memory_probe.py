@@ -0,0 +1,165 @@
+import gc
+import logging
+import random
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import nullcontext
+
+from django.conf import settings
+
+try:
+    import objgraph
+except ImportError:
+    objgraph = None
+
+logger = logging.getLogger('finance')
+
+
+# 默认不采样; settings.MEMORY_PROBE_SAMPLE_RATE 为被检测的运行比例(0~1)
+DEFAULT_SAMPLE_RATE = 0.0
+# 运行前后 Python 分配的内存增长超过该值(字节)时记录分配最多的代码位置
+DEFAULT_GROWTH_THRESHOLD = 32 << 20
+# 记录的分配位置及对象类型个数
+DEFAULT_TOP_SITES = 10
+# tracemalloc 记录的调用栈深度, 越深开销越大
+DEFAULT_TRACE_FRAMES = 1
+MAX_REPORTS = 100
+
+# tracemalloc 和 gc 统计是进程级的, 同一时间只检测一个运行, 其他运行直接跳过
+_active = threading.Lock()
+reports = deque(maxlen=MAX_REPORTS)
+
+
+def _gc_totals():
+    # 各代的 (回收次数, 回收对象数, 无法回收对象数)
+    return [(s["collections"], s["collected"], s["uncollectable"]) for s in gc.get_stats()]
+
+
+class MemoryProbe:
+    """
+    Measures what a run leaves behind in the process: a tracemalloc snapshot is taken before and
+    after the run (after a full collection), the difference is grouped by allocation site, together
+    with the gc collections per generation during the run, the objects gc could not free and, when
+    objgraph is installed, the growth in the number of objects per type. When the retained growth
+    exceeds threshold the top allocation sites are logged.
+
+    name:str, the name in the log (e.g. the analysis name)
+    threshold:int, bytes
+    report:dict, set when the run finishes
+    """
+
+    def __init__(self, name, threshold=DEFAULT_GROWTH_THRESHOLD, top=DEFAULT_TOP_SITES, frames=DEFAULT_TRACE_FRAMES):
+        self.name = name
+        self.threshold = threshold
+        self.top = top
+        self.frames = frames
+        self.report = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        gc.collect()
+        self._gc_counts = gc.get_count()
+        self._gc_totals = _gc_totals()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._types = objgraph.typestats(shortnames=False) if objgraph is not None else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.report = self.measure()
+            reports.append(self.report)
+            if self.report["growth_bytes"] > self.threshold:
+                self.log()
+        finally:
+            if self._started_tracing:
+                tracemalloc.stop()
+        return False
+
+    def measure(self):
+        # 先完整回收一次, 剩下的增长才是运行后仍被引用(可能泄漏)的内存
+        collected = gc.collect()
+        # 对象计数在取快照之前, 不计入快照本身产生的对象
+        types = objgraph.typestats(shortnames=False) if self._types is not None else None
+        snapshot = tracemalloc.take_snapshot()
+        # 不计入检测本身(tracemalloc、本模块及 objgraph 的对象计数)分配的内存
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        if objgraph is not None:
+            filters.append(tracemalloc.Filter(False, objgraph.__file__))
+        diff = snapshot.filter_traces(filters).compare_to(self._snapshot.filter_traces(filters), "lineno")
+        _, peak = tracemalloc.get_traced_memory()
+
+        report = {
+            "name": self.name,
+            "growth_bytes": sum(stat.size_diff for stat in diff),
+            "peak_traced_bytes": peak,
+            "top_sites": [{"site": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                          for stat in diff[:self.top] if stat.size_diff > 0],
+            "gc_collections": [after[0] - before[0] for before, after in zip(self._gc_totals, _gc_totals())],
+            "gc_counts_before": self._gc_counts,
+            "gc_collected_at_exit": collected,
+            "gc_garbage": len(gc.garbage),
+            "type_growth": [],
+        }
+        if types is not None:
+            growth = [(name, count - self._types.get(name, 0)) for name, count in types.items()]
+            report["type_growth"] = sorted((g for g in growth if g[1] > 0), key=lambda g: -g[1])[:self.top]
+        return report
+
+    def log(self):
+        report = self.report
+        lines = ["{} 运行后内存增长 {:.1f} MB (峰值 {:.1f} MB), 无法回收对象 {} 个, 分配最多的位置:".format(
+            report["name"], report["growth_bytes"] / 2 ** 20, report["peak_traced_bytes"] / 2 ** 20,
+            report["gc_garbage"])]
+        lines.extend("    {site}: {size_diff:+d} B, {count_diff:+d} 个".format(**s) for s in report["top_sites"])
+        if report["type_growth"]:
+            lines.append("    对象增长: " + ", ".join("{} +{}".format(name, n) for name, n in report["type_growth"]))
+        logger.warning("\n".join(lines))
+
+
+class _ProbeSlot:
+    # 检测结束时释放进程级的检测锁
+    def __init__(self, probe):
+        self.probe = probe
+
+    def __enter__(self):
+        try:
+            return self.probe.__enter__()
+        except BaseException:
+            _active.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            return self.probe.__exit__(*exc_info)
+        finally:
+            _active.release()
+
+
+def memory_probe(name, sample_rate=None):
+    """
+    This function returns a context manager that instruments one run with MemoryProbe when the
+    run is sampled, and a no-op context otherwise (so the cost of an unsampled run is one random
+    draw). Runs that start while another run is being probed are not sampled.
+
+    Inputs.
+    ---------
+    name:str
+    sample_rate:float or None, settings.MEMORY_PROBE_SAMPLE_RATE if not given
+
+    Outputs.
+    ---------
+    context manager, yields the MemoryProbe (its report is set on exit) or None
+
+    """
+    if sample_rate is None:
+        sample_rate = getattr(settings, "MEMORY_PROBE_SAMPLE_RATE", DEFAULT_SAMPLE_RATE)
+    if sample_rate <= 0 or random.random() >= sample_rate or not _active.acquire(blocking=False):
+        return nullcontext()
+    probe = MemoryProbe(name, threshold=getattr(settings, "MEMORY_PROBE_THRESHOLD", DEFAULT_GROWTH_THRESHOLD),
+                        top=getattr(settings, "MEMORY_PROBE_TOP_SITES", DEFAULT_TOP_SITES),
+                        frames=getattr(settings, "MEMORY_PROBE_FRAMES", DEFAULT_TRACE_FRAMES))
+    return _ProbeSlot(probe)
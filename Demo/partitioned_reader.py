@@ -0,0 +1,140 @@
+import glob
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .where_filter import compile_where, apply_where, typed_value
+
+
+CSV_SUFFIXES = (".csv", ".csv.gz")
+# 同时解析的分区文件数
+MAX_READ_WORKERS = min(8, os.cpu_count() or 1)
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+_PARTITION_DIR = re.compile(r"^([A-Za-z_]\w*)=(.+)$")
+
+
+def is_partitioned(path):
+    """
+    数据路径是否为目录或通配符(多个分区文件); 已存在的文件(即使文件名中有 [ ] * ?, 如 data[1].csv)不是分区数据集.
+    """
+    if os.path.isfile(path):
+        return False
+    return os.path.isdir(path) or bool(_GLOB_CHARS.search(path))
+
+
+def list_partitions(path):
+    """
+    列出数据路径下的全部分区文件(.csv / .csv.gz), 按路径排序, 单个文件时返回 [path].
+    :param path: 文件、目录或通配符, 如 /data/EVA/year=*/*.csv.gz
+    :return: list
+    """
+    if os.path.isfile(path):
+        return [path]
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in names if name.endswith(CSV_SUFFIXES))
+        return sorted(files)
+    if _GLOB_CHARS.search(path):
+        return sorted(f for f in glob.glob(path, recursive=True) if os.path.isfile(f))
+    return []
+
+
+def partition_values(file_path):
+    """
+    从路径中解析分区键, 如 .../year=2019/month=01/part.csv 得到 {"year": "2019", "month": "01"}.
+    """
+    values = {}
+    for part in os.path.dirname(file_path).split(os.sep):
+        match = _PARTITION_DIR.match(part)
+        if match:
+            values[match.group(1)] = match.group(2)
+    return values
+
+
+def prune_partitions(files, where_string):
+    """
+    根据筛选条件去掉不可能满足条件的分区文件(分区键取自路径中的 key=value), 条件无法编译时不裁剪.
+    """
+    where_filter = compile_where(where_string) if where_string else None
+    if where_filter is None:
+        return files
+    return [f for f in files if where_filter.partition_match(partition_values(f)) is not False]
+
+
+def add_partition_columns(df, file_path):
+    """
+    分区键不在文件中时作为列补上, 便于筛选与分组.
+    """
+    for key, value in partition_values(file_path).items():
+        if key not in df.columns:
+            df[key] = typed_value(value)
+    return df
+
+
+def _read_partition(file_path, engine=None, nrows=None):
+    return add_partition_columns(pd.read_csv(file_path, engine=engine, nrows=nrows), file_path)
+
+
+def _read_filtered_partition(file_path, where_string, engine=None, stats=None):
+    df = _read_partition(file_path, engine)
+    return apply_where(df, where_string, stats), df.size
+
+
+def read_partitions(files, engine=None, max_workers=MAX_READ_WORKERS):
+    """
+    并发解析多个分区文件(可为gzip压缩), 并合并为一个数据集.
+    :param files: list, 分区文件
+    :param engine: pd.read_csv 的解析引擎, "pyarrow" 为多线程解析
+    :param max_workers: int, 同时解析的文件数
+    :return: pd.DataFrame
+    """
+    if len(files) == 1:
+        return _read_partition(files[0], engine)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as pool:
+        frames = list(pool.map(lambda f: _read_partition(f, engine), files))
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+def read_dataset(path, where_string=None, engine=None, max_workers=MAX_READ_WORKERS):
+    """
+    读取单个csv文件, 或目录/通配符下的全部分区文件(按筛选条件裁剪分区).
+    :return: pd.DataFrame, 路径下没有文件时返回 None
+    """
+    files = list_partitions(path)
+    if not files:
+        return None
+    if not is_partitioned(path):
+        return pd.read_csv(path, engine=engine)
+    selected = prune_partitions(files, where_string)
+    if not selected:
+        # 所有分区均被裁剪, 返回只有表头的空数据集
+        return _read_partition(files[0], engine, nrows=0)
+    return read_partitions(selected, engine=engine, max_workers=max_workers)
+
+
+def read_filtered(path, where_string, engine=None, stats=None, max_workers=MAX_READ_WORKERS):
+    """
+    读取数据集并按筛选条件筛选. 分区数据集在并发解析各分区时即筛选(下推), 只合并符合条件的行,
+    避免先合并全部分区再整体筛选产生的大量中间数据.
+    :param where_string: str, 筛选条件
+    :param stats: dict, 未筛选数据集各数值列的 {列名: (最小值, 最大值, 缺失值个数)}, 用于跳过恒真/恒假的条件
+    :return: (pd.DataFrame, int), 筛选后的数据及读入的单元格数(筛选前); 路径下没有文件时返回 (None, 0)
+    """
+    files = list_partitions(path)
+    if not files:
+        return None, 0
+    if not is_partitioned(path):
+        df = pd.read_csv(path, engine=engine)
+        return apply_where(df, where_string, stats), df.size
+    selected = prune_partitions(files, where_string)
+    if not selected:
+        return _read_partition(files[0], engine, nrows=0), 0
+    if len(selected) == 1:
+        return _read_filtered_partition(selected[0], where_string, engine, stats)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(selected)))) as pool:
+        parts = list(pool.map(lambda f: _read_filtered_partition(f, where_string, engine, stats), selected))
+    return pd.concat([df for df, _ in parts], axis=0, ignore_index=True), sum(cells for _, cells in parts)
@@ -0,0 +1,197 @@
+import numpy as np
+from scipy.linalg import qr
+
+
+# 缩放后的 X'X 做列主元QR, 对角元相对值小于该阈值的列视为与其它列共线
+RANK_TOL = 1e-11
+# 行数超过该值时先在随机抽取的行上检查秩: 子样本满秩则全样本必然满秩, 否则再用全样本确认
+SAMPLE_ROWS = 20000
+# 组内平方和相对总平方和小于该阈值的变量视为在固定效应组内不变
+WITHIN_TOL = 1e-10
+
+
+class DesignCheckError(ValueError):
+    """
+    Raised by the pre-flight checks before an estimator is fitted.
+    It is a ValueError so that CloudAnalysisBase.result() maps it to DATASET_MUST_BE_FULL_RANK,
+    columns holds the names of the offending variables.
+    """
+
+    def __init__(self, reason, columns):
+        self.reason = reason
+        self.columns = list(columns)
+        super().__init__("{}: {}".format(reason, ", ".join(str(c) for c in self.columns)))
+
+
+def design_matrix(df, X_vars, add_intercept=True):
+    names = (['intercept'] if add_intercept else []) + list(X_vars)
+    X = np.empty((len(df), len(names)), dtype=float)
+    for i, name in enumerate(names):
+        X[:, i] = 1.0 if name == 'intercept' else df[name].to_numpy(dtype=float)
+    return X, names
+
+
+def collinear_columns(X, names, tol=RANK_TOL):
+    """
+    This function finds the columns of X that are (numerically) linear combinations of the others
+    with a pivoted QR of the scaled Gram matrix X'X, one pass over the rows and O(k^3) afterwards.
+
+    Inputs.
+    ---------
+    X:2darray, the design matrix
+    names:list of str, the column names of X
+
+    Outputs.
+    ---------
+    columns:list of str, empty if X has full column rank
+
+    """
+    gram = X.T @ X
+    norms = np.sqrt(np.diag(gram))
+    zero = norms == 0
+    norms[zero] = 1.0
+    scaled = gram / np.outer(norms, norms)
+    scaled[:, zero] = 0.0
+
+    _, r, pivot = qr(scaled, mode='economic', pivoting=True)
+    diag = np.abs(np.diag(r))
+    if diag.size == 0 or diag[0] == 0:
+        return list(names)
+    rank = int(np.sum(diag > tol * diag[0]))
+    return [names[i] for i in sorted(pivot[rank:])]
+
+
+def collinear_in(df, X_vars, add_intercept=True, sample_rows=SAMPLE_ROWS):
+    """
+    Returns the collinear variables of [intercept] + X_vars in df. A full rank row sample proves
+    that the full data has full rank, so a passing job only pays for the sample.
+    """
+    if len(df) > sample_rows:
+        rows = np.random.default_rng(0).choice(len(df), sample_rows, replace=False)
+        X, names = design_matrix(df.iloc[np.sort(rows)], X_vars, add_intercept)
+        if not collinear_columns(X, names):
+            return []
+    X, names = design_matrix(df, X_vars, add_intercept)
+    return collinear_columns(X, names)
+
+
+def _complete_separation(y, X):
+    ones = y == 1
+    max0, min0 = X[~ones].max(axis=0), X[~ones].min(axis=0)
+    max1, min1 = X[ones].max(axis=0), X[ones].min(axis=0)
+    return (max0 < min1) | (max1 < min0)
+
+
+def separated_columns(y, X, names):
+    """
+    This function finds the variables that predict a 0-1 outcome perfectly (complete separation:
+    max of one class below min of the other), with these the MLE does not exist.
+    """
+    return [names[i] for i in np.flatnonzero(_complete_separation(y, X))]
+
+
+def quasi_separated_columns(y, X, names):
+    """
+    This function finds the 0-1 variables for which all observations with x == 1 (or x == 0) have
+    the same outcome, without complete separation (e.g. a rare dummy level whose rows are all y=0).
+    The estimators still return estimates for these (Stata drops the variable), so they are only
+    reported as a warning.
+    """
+    binary = np.all((X == 0) | (X == 1), axis=0)
+    c1 = X.sum(axis=0)
+    s1 = X.T @ y
+    c0 = len(y) - c1
+    s0 = y.sum() - s1
+    quasi = binary & (c1 > 0) & (c0 > 0) & ((s1 == 0) | (s1 == c1) | (s0 == 0) | (s0 == c0))
+    return [names[i] for i in np.flatnonzero(quasi & ~_complete_separation(y, X))]
+
+
+def absorbed_columns(X, names, fe_codes, tol=WITHIN_TOL):
+    """
+    This function finds the variables that are constant within every group of a fixed effect,
+    these are wiped out by the within transformation.
+
+    Inputs.
+    ---------
+    X:2darray, the explanatory variables (without intercept)
+    names:list of str
+    fe_codes:1darray of int, the group code of each row (pd.factorize of the fixed effect)
+
+    """
+    counts = np.bincount(fe_codes).astype(float)
+    counts[counts == 0] = 1.0
+    columns = []
+    for i, name in enumerate(names):
+        x = X[:, i]
+        x = x - x.mean()
+        sums = np.bincount(fe_codes, weights=x)
+        total = x @ x
+        within = total - np.sum(sums ** 2 / counts)
+        if within <= tol * max(total, 1e-300):
+            columns.append(name)
+    return columns
+
+
+def preflight(df, y_var, X_vars, add_intercept=True, binary=False, instruments=None, fe_vars=None):
+    """
+    This function runs the cheap checks before an expensive fit and raises DesignCheckError
+    naming the offending columns instead of waiting for LinAlgError/PerfectSeparationError.
+
+    Inputs.
+    ---------
+    df:pd.DataFrame, the data, rows with missing values are dropped as the estimators do.
+    y_var:str, the column name of the dependent variable
+    X_vars:list of str, the list of explanatory variable names
+    binary:bool, check perfect separation of a 0-1 dependent variable (probit/logit)
+    instruments:list of str or None, all instruments of a TSLS (exogenous X_vars + IV), they must
+                have full rank too
+    fe_vars:list of str or None, fixed effects whose groups are demeaned together (TSLS_FIX),
+            variables constant within these groups are rejected
+
+    Outputs.
+    ---------
+    warnings:dict, {"quasi_separation": [variables]} when binary and some 0-1 variables separate
+             the outcome quasi-completely, empty otherwise
+
+    """
+    warnings = {}
+    new_df = df.dropna()
+    if new_df.empty:
+        raise DesignCheckError("no complete observations", [y_var])
+
+    columns = collinear_in(new_df, X_vars, add_intercept)
+    if columns:
+        raise DesignCheckError("collinear variables", columns)
+
+    if instruments:
+        columns = collinear_in(new_df, instruments, add_intercept)
+        if columns:
+            raise DesignCheckError("collinear instruments", columns)
+
+    if binary:
+        y = new_df[y_var].to_numpy(dtype=float)
+        if np.all(y == y[0]):
+            raise DesignCheckError("constant outcome", [y_var])
+        X, names = design_matrix(new_df, X_vars, add_intercept)
+        columns = separated_columns(y, X, names)
+        if columns:
+            raise DesignCheckError("perfect separation", columns)
+        columns = quasi_separated_columns(y, X, names)
+        if columns:
+            warnings["quasi_separation"] = columns
+
+    if fe_vars:
+        columns = find_absorbed(new_df, X_vars, fe_vars)
+        if columns:
+            raise DesignCheckError("constant within fixed effect", columns)
+    return warnings
+
+
+def find_absorbed(df, X_vars, fe_vars):
+    """
+    Returns the variables of X_vars that are constant within the groups of fe_vars
+    (all fixed effects together, as in TSLS_FIX).
+    """
+    fe_codes = df.groupby(list(fe_vars), sort=False).ngroup().to_numpy()
+    X, names = design_matrix(df, X_vars, add_intercept=False)
+    return absorbed_columns(X, names, fe_codes)
@@ -0,0 +1,152 @@
+from collections.abc import MutableMapping
+
+import pandas as pd
+
+
+# 结果对象上可能存在的标量统计量, 取不到的跳过
+RECORD_STATS = ("nobs", "df_model", "df_resid", "rsquared", "rsquared_adj", "rsquared_within", "rsquared_between",
+                "rsquared_overall", "prsquared", "llf", "llnull", "aic", "bic", "fvalue", "f_pvalue")
+
+
+def _first_attr(res, names):
+    for name in names:
+        value = getattr(res, name, None)
+        if value is not None:
+            return value
+    return None
+
+
+def _dependent_name(model):
+    # statsmodels: model.endog_names; linearmodels: model.dependent.vars
+    name = getattr(model, "endog_names", None)
+    if name is None and hasattr(model, "dependent"):
+        name = model.dependent.vars[0]
+    return name
+
+
+class ResultRecord:
+    """
+    Compact record of a fitted model: coefficients, standard errors, scalar statistics, model
+    metadata and the formatted summary tables. It keeps no reference to the results object or the
+    estimation data, so the results can be released right after estimation; HTML and CSV are
+    rendered on first use and cached.
+
+    params, bse, tvalues, pvalues:pd.Series, indexed by the parameter names
+    stats:dict, the RECORD_STATS available on the results
+    meta:dict, model name, dependent variable and convergence info
+    summary:statsmodels Summary (or the linearmodels equivalent), the formatted tables only
+    sections:list of (str, pd.DataFrame), extra blocks appended to the csv (e.g. bootstrap results)
+    """
+
+    def __init__(self, params, bse, tvalues, pvalues, stats, meta, summary):
+        self.params = params
+        self.bse = bse
+        self.tvalues = tvalues
+        self.pvalues = pvalues
+        self.stats = stats
+        self.meta = meta
+        self.summary = summary
+        self.sections = []
+        self._html = None
+        self._csv = None
+
+    @classmethod
+    def from_results(cls, res, summary=None):
+        """
+        This function copies what the analyses need from a statsmodels or linearmodels results
+        object.
+
+        Inputs.
+        ---------
+        res:results object
+        summary:Summary, res.summary() if not given
+
+        Outputs.
+        ---------
+        ResultRecord
+
+        """
+        if summary is None:
+            summary = res.summary() if callable(res.summary) else res.summary
+        params = pd.Series(res.params).copy()
+        bse = pd.Series(_first_attr(res, ("bse", "std_errors")), index=params.index)
+        tvalues = pd.Series(_first_attr(res, ("tvalues", "tstats")), index=params.index)
+        pvalues = pd.Series(res.pvalues, index=params.index)
+
+        stats = {}
+        for name in RECORD_STATS:
+            try:
+                value = getattr(res, name)
+            except Exception:
+                continue
+            if value is not None and pd.api.types.is_scalar(value):
+                stats[name] = value
+
+        model = getattr(res, "model", None)
+        meta = {
+            "model": type(model).__name__ if model is not None else type(res).__name__,
+            "dependent": _dependent_name(model),
+            "convergence": getattr(res, "convergence", None),
+        }
+        return cls(params, bse, tvalues, pvalues, stats, meta, summary)
+
+    @property
+    def convergence(self):
+        return self.meta["convergence"]
+
+    def as_html(self):
+        if self._html is None:
+            self._html = self.summary.as_html()
+        return self._html
+
+    def as_csv(self):
+        if self._csv is None:
+            self._csv = self.summary.as_csv()
+        return self._csv
+
+    def add_section(self, title, data):
+        self.sections.append((title, data))
+
+    def write_csv(self, path):
+        with open(path, "w") as f:
+            f.write(self.as_csv())
+            for title, data in self.sections:
+                f.write("\n{}\n".format(title))
+                data.to_csv(f)
+        return path
+
+
+class LazyResultFiles(MutableMapping):
+    """
+    The return_file mapping of an analysis whose values may be rendered lazily: set_lazy(key, func)
+    stores func, which is called on the first read of key and its result cached.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._values = dict(*args, **kwargs)
+        self._lazy = {}
+
+    def set_lazy(self, key, func):
+        self._values.pop(key, None)
+        self._lazy[key] = func
+
+    def __getitem__(self, key):
+        if key in self._lazy:
+            self._values[key] = self._lazy.pop(key)()
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._lazy.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._lazy:
+            del self._lazy[key]
+        else:
+            del self._values[key]
+
+    def __iter__(self):
+        return iter(list(self._values) + list(self._lazy))
+
+    def __len__(self):
+        return len(self._values) + len(self._lazy)
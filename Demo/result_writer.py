@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+RESULT_FORMATS = ("csv", "parquet")
+# merged: 总结果文件为全部结果块纵向合并后的表; index: 总结果文件只列出各子结果文件
+SUMMARY_MODES = ("merged", "index")
+MAX_WRITE_WORKERS = 4
+
+
+def file_suffix(fmt):
+    if fmt not in RESULT_FORMATS:
+        raise ValueError("unsupported result format: {}".format(fmt))
+    if fmt == "parquet" and pq is None:
+        raise ImportError("pyarrow is required for parquet result files")
+    return ".{}".format(fmt)
+
+
+def write_block(data, path, fmt="csv"):
+    """
+    This function writes one result block to path in the given format.
+
+    Inputs.
+    ---------
+    data:pd.DataFrame
+    path:str
+    fmt:str, "csv" or "parquet"
+
+    """
+    if fmt == "parquet":
+        pq.write_table(pa.Table.from_pandas(data, preserve_index=True), path)
+    else:
+        data.to_csv(path)
+    return path
+
+
+def _streamable(blocks):
+    # 各结果块的列、列类型和索引层名称都相同时, 逐块写出与 pd.concat 后写出的结果一致
+    first = blocks[0]
+    return all(b.columns.equals(first.columns) and b.dtypes.equals(first.dtypes) and
+               list(b.index.names) == list(first.index.names) for b in blocks[1:])
+
+
+def write_summary(res_data, path, fmt="csv", single_key=None):
+    """
+    This function writes the summary of all result blocks, i.e. pd.concat(res_data, axis=0), block
+    by block without building the concatenated frame. Blocks with different layouts fall back to
+    pd.concat.
+
+    Inputs.
+    ---------
+    res_data:dict, {title: pd.DataFrame}
+    path:str
+    fmt:str, "csv" or "parquet"
+    single_key:str, when res_data only holds this key the block is written without the title level
+
+    """
+    titles = list(res_data)
+    blocks = list(res_data.values())
+    if len(blocks) == 1 and single_key in res_data:
+        return write_block(blocks[0], path, fmt)
+    if not blocks or not _streamable(blocks):
+        return write_block(pd.concat(res_data, axis=0), path, fmt)
+
+    if fmt == "parquet":
+        writer = None
+        try:
+            for title, block in zip(titles, blocks):
+                table = pa.Table.from_pandas(pd.concat({title: block}), preserve_index=True)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return path
+
+    with open(path, "w", newline="") as f:
+        for i, (title, block) in enumerate(zip(titles, blocks)):
+            pd.concat({title: block}).to_csv(f, header=(i == 0))
+    return path
+
+
+def write_summary_index(files, res_data, path):
+    """
+    This function writes the summary as an index over the sub-files (title, file, rows, columns)
+    instead of merging the blocks.
+    """
+    index = pd.DataFrame({
+        "file": [os.path.basename(files[title]) for title in res_data],
+        "rows": [len(data) for data in res_data.values()],
+        "columns": [data.shape[1] for data in res_data.values()],
+    }, index=pd.Index(list(res_data), name="title"))
+    index.to_csv(path)
+    return path
+
+
+def write_results(res_data, prefix_path, summary_path, fmt="csv", summary_mode="merged", single_key=None,
+                  max_workers=MAX_WRITE_WORKERS):
+    """
+    This function writes every result block to "{prefix_path}_{title}.{fmt}" and the summary to
+    summary_path, the files are written concurrently on a thread pool.
+
+    Inputs.
+    ---------
+    res_data:dict, {title: pd.DataFrame}, the blocks must not be modified while writing
+    prefix_path:str, the prefix of the sub-files
+    summary_path:str
+    fmt:str, "csv" or "parquet"
+    summary_mode:str, "merged" or "index"
+    single_key:str, see write_summary
+
+    Outputs.
+    ---------
+    files:dict, {title: sub-file path}
+
+    """
+    if summary_mode not in SUMMARY_MODES:
+        raise ValueError("unsupported summary mode: {}".format(summary_mode))
+    suffix = file_suffix(fmt)
+    files = {title: "{}_{}{}".format(prefix_path, title, suffix) for title in res_data}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(res_data) + 1))) as pool:
+        futures = [pool.submit(write_block, data, files[title], fmt) for title, data in res_data.items()]
+        if summary_mode == "merged":
+            futures.append(pool.submit(write_summary, res_data, summary_path, fmt, single_key))
+        for future in futures:
+            future.result()
+    if summary_mode == "index":
+        write_summary_index(files, res_data, summary_path)
+    return files
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .job_context import job_registry
+from .job_cost import estimate_job
+
+logger = logging.getLogger('finance')
+
+
+# 优先级数字越小越先执行, 描述性统计等短任务优先于耗时的回归
+ANALYSIS_PRIORITIES = {
+    "ts_stat": 0,
+    "ts_corr": 1,
+    "ols_reg_with_dum": 2,
+    "lin_fix_eff": 2,
+    "ts_lin_reg_with_dum": 2,
+    "ts_fix_eff": 2,
+    "probit_with_dum": 3,
+    "logit_with_dum": 3,
+    "tobit_with_dum": 3,
+}
+DEFAULT_PRIORITY = 3
+# 未配置 settings.ANALYSIS_MEMORY_BUDGET 时, 使用物理内存的比例
+DEFAULT_BUDGET_RATIO = 0.5
+MAX_JOB_HISTORY = 500
+# 运行期间采样进程常驻内存的间隔(秒)
+RSS_SAMPLE_INTERVAL = 0.05
+# 排队时检查任务是否已取消的间隔(秒)
+QUEUE_POLL_INTERVAL = 1.0
+# 校准系数的平滑权重
+CALIBRATION_WEIGHT = 0.2
+
+
+def physical_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def current_rss():
+    """
+    进程当前的常驻内存(字节), 取不到时返回0.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class _RssSampler(threading.Thread):
+    """
+    任务运行期间周期性采样进程常驻内存, 记录峰值.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_rss = current_rss()
+        self.peak_rss = self.start_rss
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(RSS_SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def stop(self):
+        self._stopped.set()
+        self.peak_rss = max(self.peak_rss, current_rss())
+        return max(self.peak_rss - self.start_rss, 0)
+
+
+class AnalysisScheduler:
+    """
+    分析任务的内存准入控制: 按文件大小、参与分析的字段数、dummies个数和估计方法估算每个任务的峰值内存,
+    只在内存预算之内放行, 其余任务按(优先级, 估算内存)排队. 正在运行的任务为空时, 超出预算的任务也放行,
+    避免永远无法执行.
+    每个任务结束后记录估算与实际(运行期间进程常驻内存的增量)内存, 单独运行的任务用于校准估算.
+    """
+
+    def __init__(self, memory_budget=None):
+        self.memory_budget = (memory_budget or getattr(settings, "ANALYSIS_MEMORY_BUDGET", None) or
+                              int(physical_memory() * DEFAULT_BUDGET_RATIO))
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._running = {}
+        self._seq = itertools.count()
+        self.history = deque(maxlen=MAX_JOB_HISTORY)
+        # {analysis_name: 实际内存 / 估算内存}
+        self.calibration = {}
+
+    def estimate(self, analysis):
+        try:
+            estimated = estimate_job(analysis)["memory_bytes"]
+        except Exception as e:
+            # 估算失败(如文件不存在)时不占预算, 由分析本身报错
+            logger.error("估算任务内存出错, 文件为:{}, 错误为 : {}".format(analysis.file_path, e))
+            return 0
+        return int(estimated * self.calibration.get(analysis.analysis_name, 1.0))
+
+    def _admissible(self, seq, estimated):
+        if self._waiting[0][2] != seq:
+            return False
+        return not self._running or sum(self._running.values()) + estimated <= self.memory_budget
+
+    def run(self, analysis):
+        """
+        排队等待内存预算, 放行后在当前线程执行 analysis.result() 并返回其结果.
+        """
+        estimated = self.estimate(analysis)
+        priority = ANALYSIS_PRIORITIES.get(analysis.analysis_name, DEFAULT_PRIORITY)
+        queued_at = time.time()
+        context = getattr(analysis, "context", None)
+        if context is not None:
+            # 排队时即可按 job_id 查询或取消
+            job_registry.register(context)
+        with self._cond:
+            seq = next(self._seq)
+            entry = (priority, estimated, seq)
+            heapq.heappush(self._waiting, entry)
+            admitted = True
+            while not self._admissible(seq, estimated):
+                self._cond.wait(QUEUE_POLL_INTERVAL)
+                if context is not None and context.cancelled:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    admitted = False
+                    break
+            if admitted:
+                heapq.heappop(self._waiting)
+                solo = not self._running
+                self._running[seq] = estimated
+            self._cond.notify_all()
+        if not admitted:
+            # 排队时被取消的任务直接出队, 由 result() 在第一个阶段返回取消结果, 不读取数据
+            return analysis.result()
+
+        started_at = time.time()
+        sampler = _RssSampler()
+        sampler.start()
+        try:
+            return analysis.result()
+        finally:
+            actual = sampler.stop()
+            with self._cond:
+                del self._running[seq]
+                solo = solo and not self._running
+                self._record(analysis.analysis_name, estimated, actual, solo, started_at - queued_at,
+                             time.time() - started_at)
+                self._cond.notify_all()
+
+    def _record(self, analysis_name, estimated, actual, solo, wait_seconds, run_seconds):
+        self.history.append({
+            "analysis": analysis_name,
+            "estimated_bytes": estimated,
+            "actual_bytes": actual,
+            "solo": solo,
+            "wait_seconds": wait_seconds,
+            "run_seconds": run_seconds,
+        })
+        # 与其他任务同时运行时, 进程内存的增量包含了其他任务, 不用于校准
+        if solo and estimated > 0 and actual > 0:
+            ratio = self.calibration.get(analysis_name, 1.0)
+            self.calibration[analysis_name] = ((1 - CALIBRATION_WEIGHT) * ratio +
+                                               CALIBRATION_WEIGHT * ratio * actual / estimated)
+
+    def metrics(self):
+        """
+        队列长度、运行中的任务及其估算内存、内存预算, 以及最近任务的估算与实际内存.
+        """
+        with self._cond:
+            return {
+                "queue_depth": len(self._waiting),
+                "running": len(self._running),
+                "running_bytes": sum(self._running.values()),
+                "memory_budget": self.memory_budget,
+                "calibration": dict(self.calibration),
+                "jobs": list(self.history),
+            }
+
+
+scheduler = AnalysisScheduler()
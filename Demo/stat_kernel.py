@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+
+STAT_COLUMNS = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+def _lerp(a, b, t):
+    # 与 numpy/pandas 线性插值分位数的计算方式一致(t >= 0.5 时从上端插值)
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def numeric_columns(df):
+    return [c for c, t in df.dtypes.items() if pd.api.types.is_numeric_dtype(t) and not pd.api.types.is_bool_dtype(t)]
+
+
+def describe_column(x):
+    """
+    This function computes count, mean, std, min, 25%, 50%, 75% and max of one column with a
+    single np.partition for all order statistics.
+
+    Inputs.
+    ---------
+    x:1darray of floats, may contain nan
+
+    Outputs.
+    ---------
+    stats:1darray, in the order of STAT_COLUMNS
+
+    """
+    x = x[~np.isnan(x)]
+    n = len(x)
+    if n == 0:
+        return np.array([0.0] + [np.nan] * 7)
+
+    mean = x.sum() / n
+    std = np.sqrt(((x - mean) ** 2).sum() / (n - 1)) if n > 1 else np.nan
+    pos = np.array(QUANTILES) * (n - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    kth = np.unique(np.concatenate(([0, n - 1], lo, hi)))
+    part = np.partition(x, kth)
+    quantiles = _lerp(part[lo], part[hi], pos - lo)
+    return np.concatenate(([n, mean, std, part[0]], quantiles, [part[n - 1]]))
+
+
+def describe_frame(df):
+    """
+    This function replaces df.describe().T for the numeric columns of df, all columns are read
+    from one column-major buffer.
+
+    Outputs.
+    ---------
+    res:pd.DataFrame, index are the numeric columns, columns are STAT_COLUMNS
+
+    """
+    cols = numeric_columns(df)
+    if not cols:
+        return df.describe().T
+    values = np.asfortranarray(df[cols].to_numpy(dtype=float, na_value=np.nan))
+    stats = np.empty((len(cols), len(STAT_COLUMNS)))
+    for i in range(len(cols)):
+        stats[i] = describe_column(values[:, i])
+    return pd.DataFrame(stats, index=pd.Index(cols, dtype=df.columns.dtype), columns=STAT_COLUMNS)
+
+
+def describe_groups(x, group_ids, group_keys):
+    """
+    This function replaces df.groupby(group_list)[var].describe() with one sort of the column
+    by (group, value) and vectorized reductions over all groups.
+
+    Inputs.
+    ---------
+    x:1darray of floats, the variable, may contain nan
+    group_ids:1darray of int, the group number of each row, -1 for rows without a group
+              (missing group variable)
+    group_keys:pd.Index, the key of each group number, in the order of the group numbers
+
+    Outputs.
+    ---------
+    res:pd.DataFrame, index is group_keys, columns are STAT_COLUMNS
+    sizes:1darray, the number of rows of each group (for nmiss)
+
+    """
+    n_groups = len(group_keys)
+    in_group = group_ids >= 0
+    x = x[in_group]
+    ids = group_ids[in_group]
+    valid = ~np.isnan(x)
+
+    sizes = np.bincount(ids, minlength=n_groups)
+    counts = np.bincount(ids[valid], minlength=n_groups)
+    sums = np.bincount(ids[valid], weights=x[valid], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+        sq = np.bincount(ids[valid], weights=(x[valid] - mean[ids[valid]]) ** 2, minlength=n_groups)
+        std = np.sqrt(sq / (counts - 1))
+    std[counts < 2] = np.nan
+
+    # 按(组号, 数值)排序一次, 每组的非缺失值连续且有序, 缺失值排在组末
+    order = np.lexsort((x, ids))
+    sorted_x = x[order]
+    starts = np.cumsum(sizes) - sizes
+
+    stats = np.full((n_groups, len(STAT_COLUMNS)), np.nan)
+    stats[:, 0] = counts
+    stats[:, 1] = mean
+    stats[:, 2] = std
+    has = counts > 0
+    first = starts[has]
+    last_pos = counts[has] - 1
+    stats[has, 3] = sorted_x[first]
+    stats[has, 7] = sorted_x[first + last_pos]
+    for j, q in enumerate(QUANTILES):
+        pos = q * last_pos
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        stats[has, 4 + j] = _lerp(sorted_x[first + lo], sorted_x[first + hi], pos - lo)
+
+    res = pd.DataFrame(stats, index=group_keys, columns=STAT_COLUMNS)
+    return res, sizes
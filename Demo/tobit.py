@@ -0,0 +1,190 @@
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.special import log_ndtr
+from statsmodels.base.model import GenericLikelihoodModel
+from statsmodels.base.model import GenericLikelihoodModelResults
+from statsmodels.base.model import LikelihoodModel
+
+
+__all__ = ["TobitModel", "TobitResults", "tobit"]
+
+_LOG_SQRT_2PI = 0.5 * np.log(2 * np.pi)
+
+
+class TobitResults(GenericLikelihoodModelResults):
+
+    def summary(self, yname=None, xname=None, title=None, alpha=.05):
+        if title is None:
+            title = "Tobit Regression Results"
+        smry = super().summary(yname=yname, xname=xname, title=title, alpha=alpha)
+        model = self.model
+        extra_txt = []
+        if model.left is not None:
+            extra_txt.append("Left-censored observations at {}: {}".format(model.left, int(model.left_mask.sum())))
+        extra_txt.append("Uncensored observations: {}".format(int(model.uncensored_mask.sum())))
+        if model.right is not None:
+            extra_txt.append("Right-censored observations at {}: {}".format(model.right, int(model.right_mask.sum())))
+        extra_txt.append("log_sigma is the log of the standard deviation of the latent error.")
+        smry.add_extra_txt(extra_txt)
+        return smry
+
+
+class TobitModel(GenericLikelihoodModel):
+    """
+    Censored regression (Tobit) model, y* = X*beta + e, e ~ N(0, sigma^2),
+    y = left if y* <= left, y = right if y* >= right, else y = y*.
+
+    The parameters are [beta, log_sigma]. The log-likelihood, the gradient and
+    the Hessian are computed analytically and fully vectorized, so the model can
+    be fitted with Newton's method without numerical differentiation.
+
+    Inputs.
+    ---------
+    endog:1darray, the dependent variable
+    exog:2darray, the explanatory variables
+    left:float or None, the left censoring limit (None for no left censoring)
+    right:float or None, the right censoring limit (None for no right censoring)
+
+    """
+
+    results_class = TobitResults
+
+    def __init__(self, endog, exog, left=0.0, right=None, **kwds):
+        super().__init__(endog, exog, extra_params_names=['log_sigma'], **kwds)
+        self.left = left
+        self.right = right
+        y = self.endog
+        self.left_mask = (y <= left) if left is not None else np.zeros(len(y), dtype=bool)
+        self.right_mask = (y >= right) if right is not None else np.zeros(len(y), dtype=bool)
+        self.uncensored_mask = ~(self.left_mask | self.right_mask)
+
+    def initialize(self):
+        # 用X'X的秩代替GenericLikelihoodModel对整个X做的SVD, 大样本下开销只有 O(k^3)
+        rank = np.linalg.matrix_rank(self.exog.T @ self.exog)
+        self.df_model = float(rank - 1)
+        self.df_resid = float(self.exog.shape[0] - rank)
+        LikelihoodModel.initialize(self)
+
+    def _derivatives(self, params, order=2):
+        """
+        Returns the per-observation log-likelihood and its derivatives with respect
+        to the linear index xb and to log_sigma.
+        """
+        beta, log_sigma = params[:-1], params[-1]
+        sigma = np.exp(log_sigma)
+        y = self.endog
+        xb = self.exog @ beta
+
+        n = len(y)
+        ll = np.empty(n)
+        d_xb = np.empty(n)
+        d_s = np.empty(n)
+        if order > 1:
+            h_xbxb = np.empty(n)
+            h_xbs = np.empty(n)
+            h_ss = np.empty(n)
+
+        m = self.uncensored_mask
+        z = (y[m] - xb[m]) / sigma
+        ll[m] = -_LOG_SQRT_2PI - log_sigma - 0.5 * z ** 2
+        d_xb[m] = z / sigma
+        d_s[m] = z ** 2 - 1
+        if order > 1:
+            h_xbxb[m] = -1 / sigma ** 2
+            h_xbs[m] = -2 * z / sigma
+            h_ss[m] = -2 * z ** 2
+
+        # 左截断: ll = log Phi(c), c = (left - xb) / sigma; 右截断: c = (xb - right) / sigma
+        for mask, limit, sign in ((self.left_mask, self.left, -1.0), (self.right_mask, self.right, 1.0)):
+            if limit is None or not mask.any():
+                continue
+            c = sign * (xb[mask] - limit) / sigma
+            log_cdf = log_ndtr(c)
+            lam = np.exp(-0.5 * c ** 2 - _LOG_SQRT_2PI - log_cdf)  # phi(c) / Phi(c)
+            ll[mask] = log_cdf
+            d_xb[mask] = sign * lam / sigma
+            d_s[mask] = -lam * c
+            if order > 1:
+                k = c * (c + lam) - 1
+                h_xbxb[mask] = -lam * (c + lam) / sigma ** 2
+                h_xbs[mask] = sign * lam * k / sigma
+                h_ss[mask] = -lam * c * k
+
+        if order > 1:
+            return ll, d_xb, d_s, h_xbxb, h_xbs, h_ss
+        return ll, d_xb, d_s
+
+    def loglikeobs(self, params):
+        return self._derivatives(params, order=1)[0]
+
+    def loglike(self, params):
+        return self.loglikeobs(params).sum()
+
+    def score_obs(self, params):
+        _, d_xb, d_s = self._derivatives(params, order=1)
+        return np.column_stack((self.exog * d_xb[:, None], d_s))
+
+    def score(self, params):
+        _, d_xb, d_s = self._derivatives(params, order=1)
+        return np.append(self.exog.T @ d_xb, d_s.sum())
+
+    def hessian(self, params):
+        _, _, _, h_xbxb, h_xbs, h_ss = self._derivatives(params)
+        X = self.exog
+        k = X.shape[1]
+        hess = np.empty((k + 1, k + 1))
+        hess[:k, :k] = (X.T * h_xbxb) @ X
+        hess[:k, k] = hess[k, :k] = X.T @ h_xbs
+        hess[k, k] = h_ss.sum()
+        return hess
+
+    def ols_start_params(self):
+        X = self.exog
+        beta = cho_solve(cho_factor(X.T @ X), X.T @ self.endog)
+        resid = self.endog - X @ beta
+        return np.append(beta, np.log(max(resid.std(), 1e-8)))
+
+    def fit(self, start_params=None, method='newton', maxiter=100, full_output=1, disp=1, callback=None,
+            **kwargs):
+        if start_params is None:
+            start_params = self.ols_start_params()
+        return super().fit(start_params=start_params, method=method, maxiter=maxiter, full_output=full_output,
+                           disp=disp, callback=callback, **kwargs)
+
+
+def tobit(df, y_var, X_vars, left=0.0, right=None, add_intercept=True, start_params=None, maxiter=100, disp=1,
+          callback=None):
+    """
+    This function replicates tobit in STATA, for censored regression model.
+    被解释变量y在left处左截断, 在right处右截断(为None时表示不截断).
+
+    Inputs.
+    ---------
+    df:pd.DataFrame, the data for Tobit.
+    y_var:str, the column name of the dependent variable
+    X_vars:list of str, the list of explanatory variable names
+    left:float or None, the left censoring limit, ll() in STATA
+    right:float or None, the right censoring limit, ul() in STATA
+    start_params:array or None, defaults to the OLS estimate
+    disp:int, 0 for silent mode
+    callback:callable or None, called with the params after each Newton iteration
+
+    Outputs.
+    ---------
+    res:obj
+
+    """
+    new_df = df.copy()
+    new_df = new_df.dropna()
+    y = new_df[y_var]
+
+    if add_intercept:
+        new_df['intercept'] = 1.0
+        X = new_df[['intercept'] + X_vars]
+    else:
+        X = new_df[X_vars]
+
+    tobit_mod = TobitModel(endog=y, exog=X, left=left, right=right, missing="drop")
+    res = tobit_mod.fit(start_params=start_params, method='newton', maxiter=maxiter, full_output=1, disp=disp,
+                        callback=callback)
+    return res
@@ -0,0 +1,527 @@
+import operator
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# 筛选条件语法(兼容 pandas query 的常用写法及 SAS/Stata 风格):
+#   x > 0 and (y ^= 0 or name in ('a', 'b')) & not z <> 1
+#   比较: == = != ^= ~= <> > >= < <=; 集合: in / not in; 逻辑: and & or | not ~
+MAX_COMPILED_FILTERS = 256
+# 浮点数能精确表示的整数上限
+_MAX_EXACT_FLOAT_INT = 2 ** 53
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<string>'[^']*'|"[^"]*")
+      | (?P<number>[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+      | (?P<op>==|!=|\^=|~=|<>|>=|<=|=|>|<)
+      | (?P<punct>[(),&|~])
+      | (?P<name>`[^`]+`|[A-Za-z_][\w.]*)
+    )""", re.VERBOSE)
+
+_OPERATORS = {
+    "==": operator.eq, "=": operator.eq,
+    "!=": operator.ne, "^=": operator.ne, "~=": operator.ne, "<>": operator.ne,
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+}
+# 常量写在左边时(0 < x)翻转为 x > 0
+_FLIPPED = {operator.eq: operator.eq, operator.ne: operator.ne, operator.gt: operator.lt, operator.lt: operator.gt,
+            operator.ge: operator.le, operator.le: operator.ge}
+_KEYWORDS = {"and", "or", "not", "in"}
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+def typed_value(value):
+    """
+    把字符串形式的值(如分区目录中的 year=2019)转换为int/float, 无法转换时保持原样.
+    """
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+
+
+def _column_values(df, column, value):
+    # 数值列与数值常量比较时直接用numpy数组, 其余情况用Series(与query的比较语义一致)
+    series = df[column]
+    if _is_number(value) and pd.api.types.is_numeric_dtype(series.dtype) and \
+            not pd.api.types.is_extension_array_dtype(series.dtype):
+        return series.to_numpy()
+    return series
+
+
+def _as_mask(values):
+    # 可空类型(Int64、Float64、boolean、string 等)的比较结果含缺失值, 保留为 BooleanArray 按三值逻辑参与
+    # not/and/or 运算(与 query 一致), 最后由 _to_numpy_mask 把缺失值当作不满足条件
+    if isinstance(values, pd.Series) and pd.api.types.is_extension_array_dtype(values.dtype):
+        return values.array
+    return np.asarray(values, dtype=bool)
+
+
+def _compare(op, left, right):
+    # query 把字符串列与常量按 object 比较: 缺失值只在 != 时为真, 不参与三值逻辑
+    result = op(left, right)
+    if isinstance(left, pd.Series) and pd.api.types.is_string_dtype(left.dtype) and \
+            pd.api.types.is_extension_array_dtype(result.dtype):
+        result = result.fillna(op is operator.ne).astype(bool)
+    return _as_mask(result)
+
+
+def _to_numpy_mask(mask):
+    if isinstance(mask, np.ndarray):
+        return mask
+    return mask.to_numpy(dtype=bool, na_value=False)
+
+
+def _is_all(mask, value):
+    # 掩码是否全部为 value, 有缺失值(未知)时不能确定
+    if not isinstance(mask, np.ndarray) and mask.isna().any():
+        return False
+    return bool(mask.all()) if value else not mask.any()
+
+
+def _column_stats(stats, column):
+    # 可用于化简的 (最小值, 最大值, 缺失值个数); 概况中的最小值/最大值为浮点数, 超过 2**53 的整数
+    # 可能被舍入, 此时不化简
+    if column not in stats:
+        return None
+    low, high, nmiss = stats[column]
+    if pd.isna(low) or pd.isna(high) or max(abs(low), abs(high)) >= _MAX_EXACT_FLOAT_INT:
+        return None
+    return low, high, nmiss
+
+
+class Const:
+    def __init__(self, value):
+        self.value = value
+
+    def columns(self):
+        return set()
+
+    def evaluate(self, df):
+        return np.full(len(df), self.value, dtype=bool)
+
+    def simplify(self, stats):
+        return self
+
+    def partition_match(self, values):
+        return self.value
+
+
+class Compare:
+    """
+    column op constant
+    """
+
+    def __init__(self, column, op, value):
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def columns(self):
+        return {self.column}
+
+    def evaluate(self, df):
+        return _compare(self.op, _column_values(df, self.column, self.value), self.value)
+
+    def simplify(self, stats):
+        """
+        由列的最小值、最大值和缺失值个数判断条件是否恒真或恒假(缺失值与任何值比较只在 != 时为真).
+        """
+        column_stats = _column_stats(stats, self.column) if _is_number(self.value) else None
+        if column_stats is None:
+            return self
+        low, high, nmiss = column_stats
+        v, op = self.value, self.op
+        if op is operator.ne:
+            # != 的结果与 == 相反, 缺失值为真
+            equal = Compare(self.column, operator.eq, v).simplify(stats)
+            return Const(not equal.value) if isinstance(equal, Const) else self
+        if op is operator.gt:
+            always, never = low > v, high <= v
+        elif op is operator.ge:
+            always, never = low >= v, high < v
+        elif op is operator.lt:
+            always, never = high < v, low >= v
+        elif op is operator.le:
+            always, never = high <= v, low > v
+        else:
+            always, never = low == high == v, v < low or v > high
+        if never:
+            return Const(False)
+        if always and nmiss == 0:
+            return Const(True)
+        return self
+
+    def partition_match(self, values):
+        if self.column not in values:
+            return None
+        try:
+            return bool(self.op(typed_value(values[self.column]), self.value))
+        except TypeError:
+            return None
+
+
+class ColumnCompare:
+    """
+    column op column
+    """
+
+    def __init__(self, left, op, right):
+        self.left = left
+        self.op = op
+        self.right = right
+
+    def columns(self):
+        return {self.left, self.right}
+
+    def evaluate(self, df):
+        return _as_mask(self.op(df[self.left], df[self.right]))
+
+    def simplify(self, stats):
+        return self
+
+    def partition_match(self, values):
+        if self.left not in values or self.right not in values:
+            return None
+        try:
+            return bool(self.op(typed_value(values[self.left]), typed_value(values[self.right])))
+        except TypeError:
+            return None
+
+
+class In:
+    """
+    column [not] in (v1, v2, ...)
+    """
+
+    def __init__(self, column, values, negate=False):
+        self.column = column
+        self.values = values
+        self.negate = negate
+
+    def columns(self):
+        return {self.column}
+
+    def evaluate(self, df):
+        mask = _as_mask(df[self.column].isin(self.values))
+        return ~mask if self.negate else mask
+
+    def simplify(self, stats):
+        column_stats = _column_stats(stats, self.column) if all(_is_number(v) for v in self.values) else None
+        if column_stats is None:
+            return self
+        low, high, _ = column_stats
+        if all(v < low or v > high for v in self.values):
+            # 没有任何值落在 [min, max] 内, 缺失值也不属于集合
+            return Const(self.negate)
+        return self
+
+    def partition_match(self, values):
+        if self.column not in values:
+            return None
+        value = typed_value(values[self.column])
+        return (value in self.values) != self.negate
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def columns(self):
+        return self.child.columns()
+
+    def evaluate(self, df):
+        return ~self.child.evaluate(df)
+
+    def simplify(self, stats):
+        child = self.child.simplify(stats)
+        if isinstance(child, Const):
+            return Const(not child.value)
+        return Not(child)
+
+    def partition_match(self, values):
+        match = self.child.partition_match(values)
+        return None if match is None else not match
+
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+    def columns(self):
+        return set().union(*(c.columns() for c in self.children))
+
+    def evaluate(self, df):
+        mask = self.children[0].evaluate(df)
+        for child in self.children[1:]:
+            if _is_all(mask, False):
+                break
+            mask = mask & child.evaluate(df)
+        return mask
+
+    def simplify(self, stats):
+        children = []
+        for child in (c.simplify(stats) for c in self.children):
+            if isinstance(child, Const):
+                if not child.value:
+                    return Const(False)
+                continue
+            children.append(child)
+        if not children:
+            return Const(True)
+        return children[0] if len(children) == 1 else And(children)
+
+    def partition_match(self, values):
+        matches = [c.partition_match(values) for c in self.children]
+        if False in matches:
+            return False
+        return True if all(matches) else None
+
+
+class Or:
+    def __init__(self, children):
+        self.children = children
+
+    def columns(self):
+        return set().union(*(c.columns() for c in self.children))
+
+    def evaluate(self, df):
+        mask = self.children[0].evaluate(df)
+        for child in self.children[1:]:
+            if _is_all(mask, True):
+                break
+            mask = mask | child.evaluate(df)
+        return mask
+
+    def simplify(self, stats):
+        children = []
+        for child in (c.simplify(stats) for c in self.children):
+            if isinstance(child, Const):
+                if child.value:
+                    return Const(True)
+                continue
+            children.append(child)
+        if not children:
+            return Const(False)
+        return children[0] if len(children) == 1 else Or(children)
+
+    def partition_match(self, values):
+        matches = [c.partition_match(values) for c in self.children]
+        if True in matches:
+            return True
+        return False if all(m is False for m in matches) else None
+
+
+def tokenize(where_string):
+    tokens = []
+    pos = 0
+    text = where_string.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise FilterSyntaxError("unexpected character at {}: {!r}".format(pos, text[pos:pos + 10]))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1]
+        elif kind == "number":
+            value = typed_value(value)
+        elif kind == "name":
+            if value.startswith("`"):
+                value = value[1:-1]
+            elif value.lower() in _KEYWORDS:
+                kind, value = "keyword", value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value is not None and token[1] != value):
+            raise FilterSyntaxError("unexpected token {!r}".format(token[1]))
+        self.pos += 1
+        return token
+
+    def accept(self, kind, *values):
+        token = self.peek()
+        if token[0] == kind and (not values or token[1] in values):
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise FilterSyntaxError("unexpected token {!r}".format(self.peek()[1]))
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.accept("keyword", "or") or self.accept("punct", "|"):
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.accept("keyword", "and") or self.accept("punct", "&"):
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.accept("keyword", "not") or self.accept("punct", "~"):
+            return Not(self.parse_not())
+        return self.parse_comparison()
+
+    def parse_operand(self):
+        kind, value = self.take()
+        if kind not in ("name", "number", "string"):
+            raise FilterSyntaxError("unexpected token {!r}".format(value))
+        return kind, value
+
+    def parse_list(self):
+        self.take("punct", "(")
+        values = []
+        while True:
+            kind, value = self.parse_operand()
+            if kind == "name":
+                raise FilterSyntaxError("only constants are allowed in a list")
+            values.append(value)
+            if not self.accept("punct", ","):
+                break
+        self.take("punct", ")")
+        return values
+
+    def parse_comparison(self):
+        if self.accept("punct", "("):
+            node = self.parse_or()
+            self.take("punct", ")")
+            return node
+        left_kind, left = self.parse_operand()
+        negate = self.accept("keyword", "not")
+        if self.accept("keyword", "in"):
+            if left_kind != "name":
+                raise FilterSyntaxError("the left side of in must be a column")
+            return In(left, self.parse_list(), negate)
+        if negate:
+            raise FilterSyntaxError("expected in after not")
+        _, op_text = self.take("op")
+        op = _OPERATORS[op_text]
+        right_kind, right = self.parse_operand()
+        if left_kind == "name" and right_kind == "name":
+            return ColumnCompare(left, op, right)
+        if left_kind == "name":
+            return Compare(left, op, right)
+        if right_kind == "name":
+            return Compare(right, _FLIPPED[op], left)
+        return Const(bool(op(left, right)))
+
+
+class WhereFilter:
+    """
+    A where_string compiled once into an expression tree, evaluated as vectorized boolean masks.
+
+    where_string:str
+    tree:the root node (Compare, ColumnCompare, In, Not, And, Or or Const)
+    """
+
+    def __init__(self, where_string, tree):
+        self.where_string = where_string
+        self.tree = tree
+
+    @property
+    def columns(self):
+        return self.tree.columns()
+
+    def mask(self, df, stats=None):
+        tree = self.tree.simplify(stats) if stats else self.tree
+        return _to_numpy_mask(tree.evaluate(df))
+
+    def apply(self, df, stats=None):
+        """
+        This function returns the rows of df that satisfy the filter, the same as
+        df.query(where_string) for the syntax both support.
+
+        Inputs.
+        ---------
+        df:pd.DataFrame
+        stats:dict or None, {column: (min, max, nmiss)} of df (see stats_from_profile), clauses that
+              the stats prove always true or false are not evaluated
+
+        Outputs.
+        ---------
+        pd.DataFrame, df itself when the filter is always true
+
+        """
+        tree = self.tree.simplify(stats) if stats else self.tree
+        if isinstance(tree, Const):
+            return df if tree.value else df.iloc[0:0]
+        return df[_to_numpy_mask(tree.evaluate(df))]
+
+    def partition_match(self, values):
+        """
+        分区键取值 values 下条件是否可能成立: False 表示该分区一定没有符合条件的行.
+        """
+        return self.tree.partition_match(values)
+
+
+@lru_cache(maxsize=MAX_COMPILED_FILTERS)
+def compile_where(where_string):
+    """
+    This function parses where_string into a WhereFilter, compiled filters are cached by string.
+
+    Outputs.
+    ---------
+    WhereFilter, or None when the string uses syntax the compiler does not support (e.g.
+    arithmetic or @variables), the caller then falls back to DataFrame.query
+
+    """
+    try:
+        return WhereFilter(where_string, _Parser(tokenize(where_string)).parse())
+    except FilterSyntaxError:
+        return None
+
+
+def stats_from_profile(profile):
+    """
+    由数据概况(data_profile.profile_frame)取出数值列的 {列名: (最小值, 最大值, 缺失值个数)}.
+    """
+    numeric = profile[profile["numeric"].astype(bool)]
+    return {col: (numeric.at[col, "min"], numeric.at[col, "max"], numeric.at[col, "nmiss"]) for col in numeric.index}
+
+
+def apply_where(df, where_string, stats=None):
+    """
+    按筛选条件筛选数据, 无法编译的条件退回 DataFrame.query.
+    """
+    if not where_string:
+        return df
+    where_filter = compile_where(where_string)
+    if where_filter is None:
+        return df.query(where_string)
+    missing = where_filter.columns - set(df.columns)
+    if missing:
+        # 条件中引用的名称不是列(如 True/False 或局部变量), 交给 query 处理
+        return df.query(where_string)
+    return where_filter.apply(df, stats)
@@ -4,32 +4,44 @@
 author: neo
 """
 
+import asyncio
+import bisect
 import hashlib
+import inspect
+import ipaddress
+import logging
 import os
-import re
+import random
 import sys
+import threading
 import traceback
 import time
 import ujson
-import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from functools import wraps
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import idgen, janitor, timing, validators
+
+
+logger = logging.getLogger(__name__)
 
 MAX_EXCEED_TIME = 10
 
 
 def contain_dangerous_char(s):
     """
-    检查字符串中是否包括危险字符
+    检查字符串中是否包括危险字符, 整列检查用 validators.dangerous_char_mask
     :param s: string
     :return: True/False
     """
-    p = re.compile('[\&\<\>\"\'\/\(\)]')
-    l = p.findall(str(s))
-    if len(l) > 0:
-        return True
-    else:
-        return False
+    return validators.contains_dangerous_char(s)
 
 
 def get_md5(content):
@@ -45,10 +57,11 @@ def get_md5(content):
 
 def get_rand_16():
     """
-    获取随机的16位字符串
+    获取16位的唯一字符串: 80位id的 base32 编码(见 idgen.new_short_id), 按生成时间排序, 节点号为每个进程随机生成的30位数;
+    可按时间推算, 不能作为保密的令牌
     :return: string
     """
-    return get_md5_16(uuid.uuid1().hex)
+    return idgen.new_short_id()
 
 
 def get_md5_16(content):
@@ -62,64 +75,681 @@ def get_md5_16(content):
 
 def record_spent_time(funcname):
     """
-    每个handler请求时间的装饰器
+    每个handler请求时间的装饰器, 耗时记录在 share.timing.registry 的直方图中(不再逐次打印),
+    超过 MAX_EXCEED_TIME 的请求记录警告日志; 可用 registry.set_slow_threshold 为单个handler设置阈值
     :param funcname:
     :return: function return
     """
+    return timing.registry.timed(str(funcname), slow_seconds=MAX_EXCEED_TIME)
+
+
+class LockMetrics(object):
+    """
+    锁的竞争统计: 获取次数、需要等待的次数、等待时间和持有时间(纳秒)
+    """
+
+    __slots__ = ("name", "acquisitions", "contended", "wait_ns", "max_wait_ns", "hold_ns", "max_hold_ns")
+
+    def __init__(self, name=""):
+        self.name = name
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_ns = 0
+        self.max_wait_ns = 0
+        self.hold_ns = 0
+        self.max_hold_ns = 0
+
+    def record_wait(self, wait_ns, contended):
+        # 在持有锁之后调用, 不需要额外加锁
+        self.acquisitions += 1
+        self.contended += contended
+        self.wait_ns += wait_ns
+        if wait_ns > self.max_wait_ns:
+            self.max_wait_ns = wait_ns
+
+    def record_hold(self, hold_ns):
+        self.hold_ns += hold_ns
+        if hold_ns > self.max_hold_ns:
+            self.max_hold_ns = hold_ns
+
+    def snapshot(self):
+        """
+        :return: dict, 时间单位为秒
+        """
+        n = self.acquisitions or 1
+        return {
+            "name": self.name,
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_seconds": self.wait_ns / 1e9,
+            "mean_wait_seconds": self.wait_ns / n / 1e9,
+            "max_wait_seconds": self.max_wait_ns / 1e9,
+            "hold_seconds": self.hold_ns / 1e9,
+            "mean_hold_seconds": self.hold_ns / n / 1e9,
+            "max_hold_seconds": self.max_hold_ns / 1e9,
+        }
+
+
+class MeteredLock(object):
+    """
+    带竞争统计的锁, 用法与 threading.Lock 相同; 只在需要观察竞争时使用, 普通场景直接用 threading.Lock
+    """
+
+    def __init__(self, lock=None, name=""):
+        """
+        :param lock: threading.Lock/RLock, 默认新建 threading.Lock
+        :param name: string
+        """
+        self.lock = lock if lock is not None else threading.Lock()
+        self.metrics = LockMetrics(name)
+        self._acquired_at = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(blocking=False):
+            self.metrics.record_wait(0, False)
+        else:
+            if not blocking:
+                return False
+            start = time.perf_counter_ns()
+            if not self.lock.acquire(timeout=timeout):
+                return False
+            self.metrics.record_wait(time.perf_counter_ns() - start, True)
+        self._acquired_at = time.perf_counter_ns()
+        return True
+
+    def release(self):
+        self.metrics.record_hold(time.perf_counter_ns() - self._acquired_at)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+def rlock(lock):
+    """
+    加锁执行函数的装饰器, 函数抛出异常时也会释放锁; lock 为 asyncio.Lock 时用于 async 函数
+    :param lock: threading.Lock/RLock、MeteredLock 或 asyncio.Lock
+    :return: function return
+    """
+
+    def on_lock(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_handler_func(*args, **kwargs):
+                async with lock:
+                    return await func(*args, **kwargs)
+
+            return async_handler_func
 
-    def record_spent(func):
         @wraps(func)
         def handler_func(*args, **kwargs):
-            start_time = time.time()
-            print("start " + str(funcname) + " time: " + str(start_time))
+            with lock:
+                return func(*args, **kwargs)
 
-            res = func(*args, **kwargs)
+        return handler_func
+
+    return on_lock
 
-            end_time = time.time()
-            print("end " + str(funcname) + " time: " + str(end_time))
 
-            spent_time = end_time - start_time
-            if spent_time > MAX_EXCEED_TIME:
-                print("handler " + str(funcname) + " spent time: " + str(spent_time) + ",exceed time!")
-            else:
-                print("handler " + str(funcname) + " spent time: " + str(spent_time) + ",ok.")
-            return res
+class RWLock(object):
+    """
+    读写锁: 多个读者可以同时持有, 写者独占; 有写者等待时新的读者排在写者之后, 避免写者饿死.
+    不可重入(持有读锁时再申请写锁会死锁)
+    """
+
+    def __init__(self, name="", metrics=False):
+        """
+        :param name: string
+        :param metrics: bool, 是否记录读、写的等待和持有时间
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self.read_metrics = LockMetrics(name + ":read") if metrics else None
+        self.write_metrics = LockMetrics(name + ":write") if metrics else None
+
+    def acquire_read(self):
+        start = time.perf_counter_ns() if self.read_metrics else 0
+        with self._cond:
+            contended = self._writer or self._waiting_writers > 0
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+            if self.read_metrics:
+                self.read_metrics.record_wait(time.perf_counter_ns() - start, contended)
+        return time.perf_counter_ns() if self.read_metrics else 0
+
+    def release_read(self, acquired_at=0):
+        with self._cond:
+            if self.read_metrics:
+                self.read_metrics.record_hold(time.perf_counter_ns() - acquired_at)
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        start = time.perf_counter_ns() if self.write_metrics else 0
+        with self._cond:
+            contended = self._writer or self._readers > 0
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+            if self.write_metrics:
+                self.write_metrics.record_wait(time.perf_counter_ns() - start, contended)
+        return time.perf_counter_ns() if self.write_metrics else 0
+
+    def release_write(self, acquired_at=0):
+        with self._cond:
+            if self.write_metrics:
+                self.write_metrics.record_hold(time.perf_counter_ns() - acquired_at)
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read_lock(self):
+        acquired_at = self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read(acquired_at)
+
+    @contextmanager
+    def write_lock(self):
+        acquired_at = self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write(acquired_at)
+
+
+class AsyncRWLock(object):
+    """
+    RWLock 的 asyncio 版本, 在同一个事件循环中使用
+    """
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @asynccontextmanager
+    async def read_lock(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._writer and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield self
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @asynccontextmanager
+    async def write_lock(self):
+        async with self._cond:
+            self._waiting_writers += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield self
+        finally:
+            async with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def read_locked(rw_lock):
+    """
+    以读锁执行函数的装饰器
+    :param rw_lock: RWLock 或 AsyncRWLock(用于 async 函数)
+    :return: function return
+    """
+    return _locked_by(rw_lock.read_lock)
+
+
+def write_locked(rw_lock):
+    """
+    以写锁执行函数的装饰器
+    :param rw_lock: RWLock 或 AsyncRWLock(用于 async 函数)
+    :return: function return
+    """
+    return _locked_by(rw_lock.write_lock)
+
+
+def _locked_by(lock_context):
+    def on_lock(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_handler_func(*args, **kwargs):
+                async with lock_context():
+                    return await func(*args, **kwargs)
+
+            return async_handler_func
+
+        @wraps(func)
+        def handler_func(*args, **kwargs):
+            with lock_context():
+                return func(*args, **kwargs)
 
         return handler_func
 
-    return record_spent
+    return on_lock
 
 
-def rlock(lock):
+class StripedLock(object):
+    """
+    分段锁: 按key的哈希值映射到固定个数的锁之一, 不同key大多落在不同的锁上, 互不等待
     """
-    每个handler请求时间的装饰器
-    :param lock:
+
+    def __init__(self, stripes=64, lock_factory=threading.Lock, metrics=False, name=""):
+        """
+        :param stripes: int, 锁的个数
+        :param lock_factory: function, 如 threading.Lock、threading.RLock 或 asyncio.Lock
+        :param metrics: bool, 是否记录每个锁的竞争统计(仅线程锁)
+        :param name: string
+        """
+        self.locks = [lock_factory() for _ in range(stripes)]
+        if metrics:
+            if any(inspect.iscoroutinefunction(lock.acquire) for lock in self.locks[:1]):
+                # MeteredLock 只能包装同步的 acquire/release
+                raise ValueError("metrics is only supported for thread locks")
+            self.locks = [MeteredLock(lock, "{0}[{1}]".format(name, i)) for i, lock in enumerate(self.locks)]
+
+    def for_key(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+    def metrics(self):
+        return [lock.metrics.snapshot() for lock in self.locks if isinstance(lock, MeteredLock)]
+
+
+def striped_lock(striped, key=0):
+    """
+    按参数加分段锁的装饰器, 同一key的调用互斥, 不同key并行; striped 使用 asyncio.Lock 时用于 async 函数
+    :param striped: StripedLock
+    :param key: int 位置参数的下标, string 参数名, 或 function(*args, **kwargs) 返回key
     :return: function return
     """
 
     def on_lock(func):
+        signature = inspect.signature(func) if isinstance(key, str) else None
+
+        def get_key(args, kwargs):
+            if callable(key):
+                return key(*args, **kwargs)
+            if signature is not None:
+                if key in kwargs:
+                    return kwargs[key]
+                # 未传入的参数取其默认值
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                return bound.arguments[key]
+            return args[key]
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_handler_func(*args, **kwargs):
+                async with striped.for_key(get_key(args, kwargs)):
+                    return await func(*args, **kwargs)
+
+            return async_handler_func
+
         @wraps(func)
         def handler_func(*args, **kwargs):
-            lock.acquire()
-            res = func(*args, **kwargs)
-            lock.release()
-            return res
+            with striped.for_key(get_key(args, kwargs)):
+                return func(*args, **kwargs)
 
         return handler_func
 
     return on_lock
 
 
+class _Flight(object):
+    """
+    正在计算中的缓存未命中, 同一个key的并发调用等待同一次计算的结果
+    """
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LRUCache(object):
+    """
+    线程安全的LRU缓存: 按条目数和估计的字节数淘汰最久未使用的条目(O(1)), 每个条目可以有各自的过期时间
+    """
+
+    def __init__(self, maxsize=128, max_bytes=None, ttl=None, sizeof=sys.getsizeof):
+        """
+        :param maxsize: int, 最多缓存的条目数, None 时不限
+        :param max_bytes: int, 缓存值的估计字节数之和的上限, None 时不限
+        :param ttl: float, 默认的过期时间(s), None 时不过期
+        :param sizeof: function, 估计缓存值字节数的函数
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # {key: (value, 过期时间, 字节数)}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        获取缓存值, 不存在或已过期时返回 default
+        :param key: hashable
+        :param default:
+        :return:
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[1] is None or item[1] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                self._pop(key)
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        写入缓存
+        :param key: hashable
+        :param value:
+        :param ttl: float, 该条目的过期时间(s), 默认使用缓存的 ttl
+        :return:
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # 单个值超过字节上限时不缓存
+                return
+            self._data[key] = (value, expire_at, size)
+            self.nbytes += size
+            while (self.maxsize is not None and len(self._data) > self.maxsize) or \
+                    (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _pop(self, key):
+        value, _, size = self._data.pop(key)
+        self.nbytes -= size
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """
+        命中、未命中、淘汰、过期次数及当前条目数和字节数
+        :return: dict
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._data),
+                "bytes": self.nbytes,
+            }
+
+
+_KWARGS_MARK = (object(),)
+_MISSING = object()
+# async_memoize 中领头的调用被取消时交给等待者的结果
+_RETRY = object()
+
+
+def make_cache_key(args, kwargs):
+    """
+    由调用参数生成缓存key(与 functools.lru_cache 相同的做法, 不做序列化); 参数不可哈希时抛出 TypeError
+    :param args: tuple
+    :param kwargs: dict
+    :return: hashable
+    """
+    if kwargs:
+        key = args + _KWARGS_MARK + tuple(sorted(kwargs.items()))
+    elif len(args) == 1 and type(args[0]) in (int, str):
+        return args[0]
+    else:
+        key = args
+    hash(key)
+    return key
+
+
+def memoize(maxsize=128, ttl=None, max_bytes=None, sizeof=sys.getsizeof):
+    """
+    缓存函数结果的装饰器(如数据库查询结果), 按条目数/字节数LRU淘汰, 结果在 ttl 秒后过期;
+    同一参数的并发未命中只执行一次函数, 其余调用等待其结果; 函数抛出异常时不缓存.
+    参数不可哈希时直接调用函数, 不缓存. 被装饰的函数有 cache 属性(LRUCache), 可查看 stats() 或 clear()
+    :param maxsize: int, 最多缓存的条目数
+    :param ttl: float, 过期时间(s), None 时不过期
+    :param max_bytes: int, 缓存值估计字节数之和的上限
+    :param sizeof: function, 估计缓存值字节数的函数
+    :return: function
+    """
+
+    def decorator(func):
+        cache = LRUCache(maxsize=maxsize, max_bytes=max_bytes, ttl=ttl, sizeof=sizeof)
+        flights = {}
+        flights_lock = threading.Lock()
+
+        @wraps(func)
+        def handler_func(*args, **kwargs):
+            try:
+                key = make_cache_key(args, kwargs)
+            except TypeError:
+                return func(*args, **kwargs)
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            with flights_lock:
+                flight = flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = flights[key] = _Flight()
+            if not leader:
+                flight.event.wait()
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+
+            try:
+                flight.result = func(*args, **kwargs)
+                cache.set(key, flight.result)
+                return flight.result
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with flights_lock:
+                    del flights[key]
+                flight.event.set()
+
+        handler_func.cache = cache
+        return handler_func
+
+    return decorator
+
+
+def async_memoize(maxsize=128, ttl=None, max_bytes=None, sizeof=sys.getsizeof):
+    """
+    memoize 的 asyncio 版本, 用于 async 函数: 同一参数的并发未命中等待同一个 Future
+    :param maxsize: int
+    :param ttl: float
+    :param max_bytes: int
+    :param sizeof: function
+    :return: function
+    """
+
+    def decorator(func):
+        cache = LRUCache(maxsize=maxsize, max_bytes=max_bytes, ttl=ttl, sizeof=sizeof)
+        flights = {}
+
+        @wraps(func)
+        async def handler_func(*args, **kwargs):
+            try:
+                key = make_cache_key(args, kwargs)
+            except TypeError:
+                return await func(*args, **kwargs)
+            while True:
+                value = cache.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+                flight = flights.get(key)
+                if flight is None:
+                    break
+                # shield: 某个等待者被取消时不影响正在进行的计算
+                value = await asyncio.shield(flight)
+                if value is not _RETRY:
+                    return value
+                # 领头的调用被取消, 由等待者之一重新计算
+
+            flight = flights[key] = asyncio.get_running_loop().create_future()
+            try:
+                result = await func(*args, **kwargs)
+                cache.set(key, result)
+                flight.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                # 只取消领头的调用本身, 唤醒等待者重试而不是把取消传给它们
+                flight.set_result(_RETRY)
+                raise
+            except BaseException as e:
+                flight.set_exception(e)
+                # 没有其他等待者时避免 "exception was never retrieved" 警告
+                flight.exception()
+                raise
+            finally:
+                del flights[key]
+
+        handler_func.cache = cache
+        return handler_func
+
+    return decorator
+
+
+# 文件哈希每次读取的字节数
+DIGEST_CHUNK_SIZE = 1 << 20
+# 指纹模式抽样的块数及每块字节数
+FINGERPRINT_BLOCKS = 16
+FINGERPRINT_BLOCK_SIZE = 64 << 10
+# 文件摘要按 (设备, inode, 大小, 修改时间) 缓存
+_file_digests = LRUCache(maxsize=1024)
+
+
+def _new_hash(algorithm):
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.new(algorithm)
+
+
+def _hash_file(f, h, chunk_size):
+    # 复用同一块缓冲区, readinto 不产生新的bytes对象
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            break
+        h.update(view[:n])
+
+
+def _fingerprint_file(f, h, size):
+    # 文件大小 + 均匀分布的若干块(含首尾), 不读全文件
+    h.update(str(size).encode("utf-8"))
+    if size <= FINGERPRINT_BLOCKS * FINGERPRINT_BLOCK_SIZE:
+        _hash_file(f, h, FINGERPRINT_BLOCK_SIZE)
+        return
+    step = (size - FINGERPRINT_BLOCK_SIZE) / (FINGERPRINT_BLOCKS - 1)
+    buf = bytearray(FINGERPRINT_BLOCK_SIZE)
+    for i in range(FINGERPRINT_BLOCKS):
+        f.seek(int(i * step))
+        n = f.readinto(buf)
+        h.update(memoryview(buf)[:n])
+
+
+def get_file_digest(file_path, algorithm="md5", fingerprint=False, chunk_size=DIGEST_CHUNK_SIZE):
+    """
+    获取文件的摘要(如作为缓存key), 分块读入同一缓冲区计算, 内存占用与文件大小无关;
+    结果按 (inode, 大小, 修改时间) 缓存, 文件未变化时不重复计算
+    :param file_path: string
+    :param algorithm: string, "md5"(与 get_md5 兼容) 或 "blake2b"(更快) 等 hashlib 支持的算法
+    :param fingerprint: bool, True 时只对文件大小、修改时间和抽样的若干块计算摘要(大文件时远快于全文件,
+                        但不能发现未被抽到的块的修改)
+    :param chunk_size: int, 每次读取的字节数
+    :return: string
+    """
+    stat = os.stat(file_path)
+    key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, algorithm, fingerprint)
+    digest = _file_digests.get(key)
+    if digest is not None:
+        return digest
+
+    h = _new_hash(algorithm)
+    with open(file_path, "rb", buffering=0) as f:
+        if fingerprint:
+            h.update(str(stat.st_mtime_ns).encode("utf-8"))
+            _fingerprint_file(f, h, stat.st_size)
+        else:
+            _hash_file(f, h, chunk_size)
+    digest = h.hexdigest()
+    _file_digests.set(key, digest)
+    return digest
+
+
 def convert_to_json(data):
     """
-    字符串转换为dict
-    :param data: string or dict
+    字符串转换为dict; 大的请求体或JSONL文件用 json_stream 分块解析
+    :param data: string, bytes or dict
     :return: dict
     """
     if isinstance(data, dict):
         return data
 
-    if isinstance(data, str):
+    if isinstance(data, (str, bytes)):
         return ujson.loads(data)
 
     return {}
@@ -127,70 +757,401 @@ def convert_to_json(data):
 
 def is_ip(ipstr):
     """
-    判断字符串是否为IPv4地址
+    判断字符串是否为IPv4地址, 整列检查用 validators.ipv4_mask
     :param ipstr: string
     :return: True/False
     """
-    p = re.compile('^((25[0-5]|2[0-4]\d|[01]?\d\d?)\.){3}(25[0-5]|2[0-4]\d|[01]?\d\d?)$')
-    if p.match(ipstr):
-        return True
-    else:
-        return False
+    return validators.is_ipv4(ipstr)
+
+
+def ipv4_to_int(ipstr):
+    """
+    IPv4地址转换为整数, 不是合法IPv4地址时返回 -1 (不创建 ipaddress 对象, 用于批量转换)
+    :param ipstr: string
+    :return: int
+    """
+    parts = str(ipstr).split('.')
+    if len(parts) != 4:
+        return -1
+    value = 0
+    for part in parts:
+        if not part.isdigit() or len(part) > 3:
+            return -1
+        n = int(part)
+        if n > 255:
+            return -1
+        value = value * 256 + n
+    return value
+
+
+def _ip_interval(r):
+    # [start_ip, end_ip]、CIDR("10.0.0.0/8") 或单个ip 转换为 (版本, 起始整数, 结束整数)
+    if isinstance(r, str):
+        network = ipaddress.ip_network(r.strip(), strict=False)
+        return network.version, int(network.network_address), int(network.broadcast_address)
+    (start_version, start), (end_version, end) = _ip_bound(r[0]), _ip_bound(r[1])
+    if start_version != end_version:
+        raise ValueError("ip range {0} mixes IPv4 and IPv6".format(r))
+    return start_version, min(start, end), max(start, end)
+
+
+def _ip_bound(ip):
+    # IPv4 用 ipv4_to_int 转换(与 contains 一致, 接受 "192.168.001.1" 这样补零的写法), 其余交给 ipaddress
+    ip = ip.strip()
+    value = ipv4_to_int(ip)
+    if value >= 0:
+        return 4, value
+    address = ipaddress.ip_address(ip)
+    return address.version, int(address)
+
+
+def _merge_intervals(intervals):
+    # 合并重叠或相邻的区间, 返回按起点排序的 (starts, ends)
+    starts, ends = [], []
+    for start, end in sorted(intervals):
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+class IPRangeIndex(object):
+    """
+    IP段索引: 构建时把全部ip段转换为整数区间, 合并重叠区间并排序, 查询时二分查找 O(log n); 支持IPv4和IPv6.
+    大批量查询(如日志处理)用 contains_many, IPv4 在 numpy 中向量化查找
+    """
+
+    def __init__(self, ranges):
+        """
+        :param ranges: [[start_ip, end_ip], "10.0.0.0/8", "::1", ...], 起止ip均包含在内
+        """
+        intervals = {4: [], 6: []}
+        for r in ranges:
+            if isinstance(r, str) and '/' not in r:
+                r = [r, r]
+            version, start, end = _ip_interval(r)
+            intervals[version].append((start, end))
+        self._starts, self._ends = {}, {}
+        for version, items in intervals.items():
+            self._starts[version], self._ends[version] = _merge_intervals(items)
+        self._arrays = None
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def _contains_int(self, version, value):
+        starts = self._starts[version]
+        i = bisect.bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._ends[version][i]
+
+    def contains(self, ip):
+        """
+        判断ip是否在任一ip段内
+        :param ip: string or ipaddress object
+        :return: True/False
+        """
+        value = ipv4_to_int(ip) if isinstance(ip, str) else -1
+        if value >= 0:
+            return self._contains_int(4, value)
+        try:
+            address = ipaddress.ip_address(ip.strip() if isinstance(ip, str) else ip)
+        except ValueError:
+            return False
+        return self._contains_int(address.version, int(address))
+
+    __contains__ = contains
+
+    def contains_many(self, ips):
+        """
+        批量判断ip是否在ip段内
+        :param ips: iterable of string, 或 IPv4 的整数数组(numpy)
+        :return: numpy bool array
+        """
+        if np is None:
+            raise ImportError("contains_many requires numpy")
+        if self._arrays is None:
+            self._arrays = (np.array(self._starts[4], dtype=np.int64), np.array(self._ends[4], dtype=np.int64))
+        starts, ends = self._arrays
+
+        if isinstance(ips, np.ndarray) and np.issubdtype(ips.dtype, np.integer):
+            values = ips.astype(np.int64, copy=False)
+            others = None
+        else:
+            ips = list(ips)
+            values = np.fromiter((ipv4_to_int(ip) for ip in ips), dtype=np.int64, count=len(ips))
+            # 不是IPv4格式的(IPv6或非法地址)逐个查找
+            others = np.flatnonzero(values < 0)
+
+        i = np.searchsorted(starts, values, side="right") - 1
+        mask = (i >= 0) & (values >= 0)
+        if len(ends):
+            mask &= values <= ends[np.maximum(i, 0)]
+        else:
+            mask[:] = False
+        if others is not None:
+            for k in others:
+                mask[k] = self.contains(ips[k])
+        return mask
+
+
+# is_ip_in_range 按 range_list 对象(id)缓存的索引个数
+MAX_CACHED_IP_RANGES = 32
+# {id(range_list): (range_list, 长度, IPRangeIndex)}, 保存 range_list 的引用使其 id 不会被复用
+_ip_range_indexes = LRUCache(maxsize=MAX_CACHED_IP_RANGES)
+
+
+def ip_range_index(range_list):
+    """
+    取 range_list 对应的 IPRangeIndex: 按列表对象缓存, 命中时 O(1), 不再逐项比较 range_list;
+    同一个列表被修改(长度变化)时重新构建. 原地替换元素时请换用新的列表, 或直接构建 IPRangeIndex 持有
+    :param range_list: list/tuple, 或 IPRangeIndex
+    :return: IPRangeIndex
+    """
+    if isinstance(range_list, IPRangeIndex):
+        return range_list
+    entry = _ip_range_indexes.get(id(range_list))
+    if entry is None or entry[0] is not range_list or entry[1] != len(range_list):
+        entry = (range_list, len(range_list), IPRangeIndex(range_list))
+        _ip_range_indexes.set(id(range_list), entry)
+    return entry[2]
 
 
 def is_ip_in_range(ip, range_list=[]):
     """
-    判断ip是否在指定区间的ip段内
+    判断ip是否在指定区间的ip段内, 是 IPRangeIndex 的简单包装: 同一个 range_list 的索引只构建一次(见 ip_range_index)
     :param ip:
-    :param range_list: [[start_ip, end_ip], [], ...]
+    :param range_list: [[start_ip, end_ip], [], ...], 也可以是CIDR, 或已构建的 IPRangeIndex
     :return: 0/1
     """
-    ip2int = lambda x: sum([256 ** j * int(i) for j, i in enumerate(x.split('.')[::-1])])
-    compare_ip = ip2int(ip)
-    for r in range_list:
-        start_ip = ip2int(r[0])
-        end_ip = ip2int(r[1])
-        if compare_ip>=start_ip and compare_ip<=end_ip:
-            return 1
-
-    return 0
+    return 1 if ip_range_index(range_list).contains(ip) else 0
 
 
 def safe_rm_dir(need_del_dir='aaaaaaaaaaaaaaaaaaa'):
     """
-    安全删除目录(只能删除两级子目录下数据)，防误删
+    安全删除目录(只能删除两级子目录下数据)，防误删; 在进程内删除, 不再启动 rm 进程.
+    结果目录的定期清理见 janitor.OutputJanitor
     :param need_del_dir:
-    :return:
+    :return: int, 释放的字节数, 未通过检查时为 -1
     """
-    if 2 >= len(need_del_dir.strip('/').split('/')):
-        print("rm_dir error!")
-        return
-    os.system("rm -rf {0}".format(need_del_dir))
+    return janitor.remove_tree(need_del_dir)
 
 
 def time_refresh(interval):
     """
-    作用：每隔指定间隔执行某函数, 目前支持Python3
+    作用：每隔指定间隔刷新某函数的结果, 目前支持Python3
     使用场景：当需要间隔一定时间执行某函数，但又不希望过重的启动一个定时器来控制，如某些较少发生变化的配置信息，我们不希望
             每次使用时都重新从数据库或配置文件读取，但又希望能够周期性的刷新配置，此时便可用到该装饰器；
+    现在等同于 refresh_ahead(interval, jitter=0): 两次刷新之间返回最近一次的结果(不再返回None), 到期后在后台刷新,
+    刷新失败时保留旧值、记录日志并退避重试. 新代码请直接使用 refresh_ahead
     :param interval: int, 执行间隔（s）
     :return: function return
     """
-    last_refresh_time = 0
+    return refresh_ahead(interval, jitter=0)
+
+
+# 后台刷新的线程数
+REFRESH_WORKERS = 4
+_refresh_executor = None
+_refresh_executor_lock = threading.Lock()
+
+
+def _get_refresh_executor():
+    global _refresh_executor
+    with _refresh_executor_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="refresh")
+        return _refresh_executor
+
+
+class _RefreshEntry(object):
+    __slots__ = ("value", "next_refresh", "failures", "refreshing", "lock", "loading")
+
+    def __init__(self):
+        self.value = _MISSING
+        self.next_refresh = 0
+        self.failures = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        # async_get 第一次加载时的 Future, 并发的第一次调用等待同一次加载
+        self.loading = None
+
+
+class RefreshingValues(object):
+    """
+    按参数保存函数最近一次的结果并立即返回(stale-while-revalidate): 到达刷新间隔后由后台刷新,
+    刷新失败时保留旧值并按指数退避重试. 只有某个参数第一次调用时需要等待函数执行
+    """
+
+    def __init__(self, func, interval, jitter=0.1, max_backoff=None, maxsize=1024):
+        """
+        :param func: function
+        :param interval: float, 刷新间隔(s)
+        :param jitter: float, 刷新间隔的随机抖动比例, 避免大量key同时刷新
+        :param max_backoff: float, 刷新失败后重试间隔的上限(s), 默认为 10 * interval
+        :param maxsize: int, 最多保存的参数个数, 超过时淘汰最久未使用的
+        """
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff if max_backoff is not None else 10 * interval
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._tasks = set()
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _RefreshEntry()
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _next_interval(self, failures):
+        if failures:
+            return min(self.interval * 2 ** failures, self.max_backoff)
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _succeeded(self, entry, value):
+        entry.value = value
+        entry.failures = 0
+        entry.next_refresh = time.monotonic() + self._next_interval(0)
+
+    def _failed(self, entry, e):
+        entry.failures += 1
+        entry.next_refresh = time.monotonic() + self._next_interval(entry.failures)
+        logger.warning("refresh %s error: %s, keep the last value", getattr(self.func, "__name__", self.func), e)
+
+    def _claim_refresh(self, entry):
+        # 到期且没有正在进行的刷新时, 由当前调用发起刷新
+        with entry.lock:
+            if entry.refreshing or time.monotonic() < entry.next_refresh:
+                return False
+            entry.refreshing = True
+            return True
+
+    def _refresh(self, entry, args, kwargs):
+        try:
+            self._succeeded(entry, self.func(*args, **kwargs))
+        except Exception as e:
+            self._failed(entry, e)
+        finally:
+            entry.refreshing = False
+
+    def get(self, *args, **kwargs):
+        """
+        返回最近一次的结果, 到期时提交后台刷新
+        :return: function return
+        """
+        try:
+            key = make_cache_key(args, kwargs)
+        except TypeError:
+            # 参数不可哈希时不保存结果, 直接调用
+            return self.func(*args, **kwargs)
+        entry = self._entry(key)
+        if entry.value is _MISSING:
+            with entry.lock:
+                if entry.value is _MISSING:
+                    # 第一次调用: 同步执行, 出错时抛出(没有旧值可用)
+                    self._succeeded(entry, self.func(*args, **kwargs))
+            return entry.value
+        if self._claim_refresh(entry):
+            _get_refresh_executor().submit(self._refresh, entry, args, kwargs)
+        return entry.value
+
+    async def async_get(self, *args, **kwargs):
+        """
+        get 的 asyncio 版本, func 为 async 函数, 后台刷新为事件循环中的任务
+        :return: function return
+        """
+        try:
+            key = make_cache_key(args, kwargs)
+        except TypeError:
+            return await self.func(*args, **kwargs)
+        entry = self._entry(key)
+        while entry.value is _MISSING:
+            if entry.loading is not None:
+                value = await asyncio.shield(entry.loading)
+                if value is not _RETRY:
+                    return value
+                # 发起加载的调用被取消, 由等待者之一重新加载
+                continue
+            loading = entry.loading = asyncio.get_running_loop().create_future()
+            try:
+                self._succeeded(entry, await self.func(*args, **kwargs))
+                loading.set_result(entry.value)
+            except asyncio.CancelledError:
+                loading.set_result(_RETRY)
+                raise
+            except BaseException as e:
+                # 第一次加载出错时抛出(没有旧值可用), 等待者同样得到该异常
+                loading.set_exception(e)
+                loading.exception()
+                raise
+            finally:
+                entry.loading = None
+            return entry.value
+        if self._claim_refresh(entry):
+            task = asyncio.get_running_loop().create_task(self._async_refresh(entry, args, kwargs))
+            # 保留任务的引用, 避免刷新完成前被回收
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return entry.value
+
+    async def _async_refresh(self, entry, args, kwargs):
+        try:
+            self._succeeded(entry, await self.func(*args, **kwargs))
+        except Exception as e:
+            self._failed(entry, e)
+        finally:
+            entry.refreshing = False
+
+    def invalidate(self, *args, **kwargs):
+        """
+        使某个参数的结果在下次调用时刷新(仍先返回旧值)
+        """
+        try:
+            key = make_cache_key(args, kwargs)
+        except TypeError:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            entry.next_refresh = 0
+
+
+def refresh_ahead(interval, jitter=0.1, max_backoff=None, maxsize=1024):
+    """
+    作用：time_refresh 的替代, 间隔刷新的同时, 调用方总能立即拿到最近一次的结果(按参数分别保存), 不会拿到None,
+         也不会阻塞在刷新上; 适用于配置、权限等较少变化又需要周期性刷新的数据. 支持 async 函数
+    :param interval: int, 刷新间隔（s）
+    :param jitter: float, 刷新间隔的随机抖动比例
+    :param max_backoff: float, 刷新失败后重试间隔的上限（s）
+    :param maxsize: int, 最多保存的参数个数
+    :return: function return
+    """
 
     def refresh(func):
+        values = RefreshingValues(func, interval, jitter=jitter, max_backoff=max_backoff, maxsize=maxsize)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_handler_func(*args, **kwargs):
+                return await values.async_get(*args, **kwargs)
+
+            async_handler_func.values = values
+            return async_handler_func
+
         @wraps(func)
         def handler_func(*args, **kwargs):
-            nonlocal last_refresh_time
-            cur_time = time.time()
-            if interval < cur_time-last_refresh_time:
-                res = func(*args, **kwargs)
-                last_refresh_time = cur_time
-                return res
-            else:
-                return
+            return values.get(*args, **kwargs)
 
+        handler_func.values = values
         return handler_func
 
     return refresh
-
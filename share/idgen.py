@@ -0,0 +1,200 @@
+# coding=utf-8
+
+"""
+author: neo
+"""
+
+import os
+import random
+import threading
+import time
+import weakref
+
+
+# 时间戳起点 2020-01-01 00:00:00 UTC(毫秒)
+EPOCH_MS = 1577836800000
+
+# 64位: 41位毫秒时间戳 | 10位节点号 | 12位序号, 每个节点每毫秒4096个
+NODE_BITS_64 = 10
+SEQUENCE_BITS_64 = 12
+# 80位(16个 base32 字符): 42位毫秒时间戳 | 8位序号 | 30位节点号(每个进程随机生成)
+SEQUENCE_BITS_80 = 8
+NODE_BITS_80 = 30
+# 128位: 48位毫秒时间戳 | 24位序号 | 56位节点号(每个进程随机生成)
+SEQUENCE_BITS_128 = 24
+NODE_BITS_128 = 56
+# {位数: (序号位数, 节点号位数)}
+LAYOUTS = {64: (SEQUENCE_BITS_64, NODE_BITS_64), 80: (SEQUENCE_BITS_80, NODE_BITS_80),
+           128: (SEQUENCE_BITS_128, NODE_BITS_128)}
+
+# Crockford base32, 字符顺序与数值顺序一致, 定长编码后按字符串排序即按时间排序
+BASE32_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ENCODINGS = ("hex", "base32", "int")
+
+_generators = weakref.WeakSet()
+
+
+def _random_node(bits):
+    return random.SystemRandom().getrandbits(bits)
+
+
+def encode_base32(value, length):
+    """
+    整数编码为定长的 Crockford base32 字符串
+    :param value: int
+    :param length: int
+    :return: string
+    """
+    chars = []
+    for _ in range(length):
+        value, r = divmod(value, 32)
+        chars.append(BASE32_ALPHABET[r])
+    return "".join(reversed(chars))
+
+
+class IdGenerator(object):
+    """
+    按时间递增、可排序的唯一id: 时间戳 + 节点号 + 序号, 不做哈希.
+    同一毫秒内序号用完时逻辑时钟前进1毫秒(不等待), 系统时间回拨时沿用上次的时间戳, 保证单调递增.
+    64位id的节点号只有10位, 随机生成时不同进程很容易取到相同的节点号, 因此必须由调用方为每个进程分配唯一的 node_id;
+    80位(节点号30位)和128位(节点号56位)id的节点号默认随机生成, 可以不指定.
+    线程安全; fork 后子进程重置状态, 未指定节点号时重新生成随机节点号, 不会与父进程产生相同的id.
+    id 可以按时间推算, 不能作为需要保密的令牌
+    """
+
+    def __init__(self, bits=128, node_id=None, encoding="hex"):
+        """
+        :param bits: int, 128、80 或 64
+        :param node_id: int, 节点号, 64位时必须指定(0~1023, 每个进程/机器唯一); 80位、128位时默认每个进程随机生成
+        :param encoding: string, "hex"、"base32" 或 "int"
+        """
+        if bits not in LAYOUTS:
+            raise ValueError("bits must be one of {0}".format(tuple(LAYOUTS)))
+        if encoding not in ENCODINGS:
+            raise ValueError("encoding must be one of {0}".format(ENCODINGS))
+        self.bits = bits
+        self.encoding = encoding
+        self.sequence_bits, self.node_bits = LAYOUTS[bits]
+        if node_id is None and bits == 64:
+            raise ValueError("node_id is required for 64-bit ids")
+        if node_id is not None and not 0 <= node_id < 1 << self.node_bits:
+            raise ValueError("node_id must be in [0, {0})".format(1 << self.node_bits))
+        self.fixed_node = node_id
+        self._max_sequence = (1 << self.sequence_bits) - 1
+        self._reset()
+        _generators.add(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.node_id = self.fixed_node if self.fixed_node is not None else _random_node(self.node_bits)
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _compose(self, ms, sequence):
+        if self.bits == 64:
+            return ((ms - EPOCH_MS) << (NODE_BITS_64 + SEQUENCE_BITS_64)) | (self.node_id << SEQUENCE_BITS_64) | sequence
+        return ((ms - EPOCH_MS) << (self.sequence_bits + self.node_bits)) | (sequence << self.node_bits) | self.node_id
+
+    def _allocate(self, n):
+        # 分配n个(毫秒, 起始序号, 个数), 调用方持有锁
+        now = int(time.time() * 1000)
+        ms, sequence = self._last_ms, self._sequence + 1
+        if now > ms:
+            ms, sequence = now, 0
+        blocks = []
+        while n > 0:
+            if sequence > self._max_sequence:
+                ms, sequence = ms + 1, 0
+            count = min(n, self._max_sequence - sequence + 1)
+            blocks.append((ms, sequence, count))
+            sequence += count
+            n -= count
+        self._last_ms, self._sequence = ms, sequence - 1
+        return blocks
+
+    def next_int(self):
+        with self._lock:
+            (ms, sequence, _), = self._allocate(1)
+        return self._compose(ms, sequence)
+
+    def next_ints(self, n):
+        """
+        一次分配n个id(只加一次锁), 按生成顺序递增
+        :param n: int
+        :return: list of int
+        """
+        with self._lock:
+            blocks = self._allocate(n)
+        ids = []
+        for ms, sequence, count in blocks:
+            if self.bits == 64:
+                first = self._compose(ms, sequence)
+                ids.extend(range(first, first + count))
+            else:
+                ids.extend(self._compose(ms, s) for s in range(sequence, sequence + count))
+        return ids
+
+    def encode(self, value):
+        if self.encoding == "hex":
+            return format(value, "0{0}x".format(self.bits // 4))
+        if self.encoding == "base32":
+            return encode_base32(value, (self.bits + 4) // 5)
+        return value
+
+    def next_id(self):
+        """
+        :return: 编码后的id
+        """
+        return self.encode(self.next_int())
+
+    def next_ids(self, n):
+        """
+        :param n: int
+        :return: list, 编码后的id
+        """
+        encode = self.encode
+        return [encode(value) for value in self.next_ints(n)]
+
+    @staticmethod
+    def timestamp(value, bits=128):
+        """
+        由id取出生成时间
+        :param value: int
+        :param bits: int
+        :return: float, unix时间戳(s)
+        """
+        shift = sum(LAYOUTS[bits])
+        return ((value >> shift) + EPOCH_MS) / 1000.0
+
+
+def _after_fork_in_child():
+    for generator in list(_generators):
+        generator._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+default_generator = IdGenerator(bits=128)
+short_generator = IdGenerator(bits=80, encoding="base32")
+
+
+def new_id():
+    """
+    32位十六进制的128位id, 按生成时间排序
+    :return: string
+    """
+    return default_generator.next_id()
+
+
+def new_ids(n):
+    return default_generator.next_ids(n)
+
+
+def new_short_id():
+    """
+    16个字符的80位id(Crockford base32), 按生成时间排序
+    :return: string
+    """
+    return short_generator.next_id()
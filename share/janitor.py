@@ -0,0 +1,310 @@
+# coding=utf-8
+
+"""
+author: neo
+"""
+
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# 删除文件的并发线程数
+DELETE_WORKERS = 4
+# 每秒最多删除的文件数, 避免大量删除时占满磁盘IO
+MAX_DELETES_PER_SECOND = 500
+# 修改时间在该时间(s)之内的文件视为仍在写入, 任何策略都不删除
+MIN_FILE_AGE = 600
+
+
+def is_safe_path(path, root=None):
+    """
+    防误删: 路径至少有三级(只能删除两级子目录下的数据), 且给定 root 时必须位于 root 之内
+    :param path: string
+    :param root: string
+    :return: True/False
+    """
+    if 2 >= len(path.strip('/').split('/')):
+        return False
+    if root is not None:
+        real_root = os.path.realpath(root)
+        real_path = os.path.realpath(path)
+        if real_path == real_root or os.path.commonpath([real_root, real_path]) != real_root:
+            return False
+    return True
+
+
+class RateLimiter(object):
+    """
+    令牌桶限速, 多个线程共用
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: float, 每秒允许的次数, None 或 0 时不限速
+        """
+        self.rate = rate
+        self._tokens = rate or 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def scan_files(root):
+    """
+    用 os.scandir 遍历目录下的全部文件(不跟随符号链接)
+    :param root: string
+    :return: list of (path, size, mtime)
+    """
+    files = []
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        files.append((entry.path, stat.st_size, stat.st_mtime))
+        except OSError as e:
+            logger.warning("scan %s error: %s", directory, e)
+    return files
+
+
+def _tree_size(path):
+    # 目录下全部条目(含符号链接本身)的字节数
+    total = 0
+    for directory, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def remove_tree(path, root=None):
+    """
+    进程内删除目录或文件(不启动 rm 进程), 保留防误删检查; 与 rm -rf 一样, 路径不存在时按通配符展开.
+    目录用 shutil.rmtree 删除(符号链接、管道等特殊文件一并删除, 不跟随符号链接)
+    :param path: string
+    :param root: string, 只允许删除 root 之内的路径
+    :return: int, 释放的字节数, 未通过检查时返回 -1
+    """
+    if not is_safe_path(path, root):
+        print("rm_dir error!")
+        return -1
+    freed = 0
+    for target in [path] if os.path.lexists(path) else glob.glob(path):
+        if not is_safe_path(target, root):
+            print("rm_dir error!")
+            continue
+        try:
+            if os.path.isdir(target) and not os.path.islink(target):
+                size = _tree_size(target)
+                shutil.rmtree(target, onerror=lambda func, p, exc: logger.warning("remove %s error: %s", p, exc[1]))
+                # 部分删除失败时只计算已删除的部分
+                freed += size - (_tree_size(target) if os.path.lexists(target) else 0)
+            else:
+                size = os.lstat(target).st_size
+                os.remove(target)
+                freed += size
+        except OSError as e:
+            logger.warning("remove %s error: %s", target, e)
+    return freed
+
+
+def remove_empty_dirs(root, keep_root=True, keep=()):
+    """
+    自下而上删除空目录
+    :param root: string
+    :param keep_root: bool, 是否保留 root 本身
+    :param keep: iterable, 不删除的目录
+    :return: int, 删除的目录数
+    """
+    keep = {os.path.abspath(k) for k in keep}
+    removed = 0
+    for directory, _, _ in sorted(os.walk(root), key=lambda w: -len(w[0])):
+        if (keep_root and os.path.abspath(directory) == os.path.abspath(root)) or os.path.abspath(directory) in keep:
+            continue
+        try:
+            os.rmdir(directory)
+            removed += 1
+        except OSError:
+            # 非空或已被删除
+            pass
+    return removed
+
+
+class OutputJanitor(object):
+    """
+    分析结果目录的保留策略: 目录结构为 root/<分析名>/<YYYYMMDD>/<结果文件>.
+    依次执行
+        1. 过期: 修改时间早于 max_age 的文件;
+        2. 配额: 每个分析的文件总大小超过其配额时, 从最旧的文件删起;
+        3. 总量: 全部文件超过 max_total_bytes 时, 从最旧的文件删起;
+    最近 min_age 秒内修改过的文件(可能仍在写入)不删除. 删除在线程池中进行并限速, 结束后删除空的日期目录.
+    """
+
+    def __init__(self, root, max_age=None, max_total_bytes=None, quotas=None, default_quota=None,
+                 min_age=MIN_FILE_AGE, workers=DELETE_WORKERS, max_deletes_per_second=MAX_DELETES_PER_SECOND):
+        """
+        :param root: string, 结果根目录(如 settings.CLOUD_OUT_DIR)
+        :param max_age: float, 文件保留时间(s), None 时不按时间删除
+        :param max_total_bytes: int, 全部结果文件的总大小上限
+        :param quotas: dict, {分析名: 字节数}, 每个分析的配额
+        :param default_quota: int, 未在 quotas 中的分析的配额
+        :param min_age: float, 最近修改过的文件的保护时间(s)
+        :param workers: int, 删除的线程数
+        :param max_deletes_per_second: float, 每秒最多删除的文件数
+        """
+        self.root = root
+        self.max_age = max_age
+        self.max_total_bytes = max_total_bytes
+        self.quotas = quotas or {}
+        self.default_quota = default_quota
+        self.min_age = min_age
+        self.workers = workers
+        self.limiter = RateLimiter(max_deletes_per_second)
+        self.last_report = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _analysis(self, path):
+        return os.path.relpath(path, self.root).split(os.sep)[0]
+
+    def plan(self, files, now=None):
+        """
+        根据策略选出要删除的文件
+        :param files: list of (path, size, mtime), scan_files 的结果
+        :param now: float
+        :return: (list of (path, size), dict 各策略删除的文件数)
+        """
+        now = time.time() if now is None else now
+        candidates = sorted((f for f in files if now - f[2] >= self.min_age), key=lambda f: f[2])
+        selected = {}
+        reasons = {"age": 0, "quota": 0, "total": 0}
+
+        if self.max_age is not None:
+            for path, size, mtime in candidates:
+                if now - mtime > self.max_age:
+                    selected[path] = size
+                    reasons["age"] += 1
+
+        totals = {}
+        for path, size, _ in files:
+            if path not in selected:
+                analysis = self._analysis(path)
+                totals[analysis] = totals.get(analysis, 0) + size
+        for path, size, _ in candidates:
+            if path in selected:
+                continue
+            analysis = self._analysis(path)
+            quota = self.quotas.get(analysis, self.default_quota)
+            if quota is not None and totals[analysis] > quota:
+                selected[path] = size
+                totals[analysis] -= size
+                reasons["quota"] += 1
+
+        if self.max_total_bytes is not None:
+            total = sum(totals.values())
+            for path, size, _ in candidates:
+                if total <= self.max_total_bytes:
+                    break
+                if path not in selected:
+                    selected[path] = size
+                    total -= size
+                    reasons["total"] += 1
+        return list(selected.items()), reasons
+
+    def _delete(self, item):
+        # 返回 (释放的字节数, 错误), 文件已不存在时为 (None, None)
+        path, size = item
+        if not is_safe_path(path, self.root):
+            return None, "unsafe path"
+        self.limiter.acquire()
+        try:
+            os.remove(path)
+            return size, None
+        except FileNotFoundError:
+            return None, None
+        except OSError as e:
+            return None, str(e)
+
+    def run(self):
+        """
+        扫描并按策略删除一次
+        :return: dict, 扫描的文件数和字节数、删除的文件数、释放的字节数、删除的空目录数、各策略删除数、错误及耗时
+        """
+        start = time.time()
+        files = scan_files(self.root)
+        to_delete, reasons = self.plan(files, now=start)
+        freed, deleted, errors = 0, 0, []
+        if to_delete:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="janitor") as pool:
+                for item, (size, error) in zip(to_delete, pool.map(self._delete, to_delete)):
+                    if error:
+                        errors.append((item[0], error))
+                    elif size is not None:
+                        freed += size
+                        deleted += 1
+        # 保留分析名目录和当天的日期目录
+        keep = [os.path.join(self.root, name) for name in os.listdir(self.root)] if os.path.isdir(self.root) else []
+        keep += [os.path.join(path, time.strftime('%Y%m%d')) for path in keep]
+        removed_dirs = remove_empty_dirs(self.root, keep=keep) if os.path.isdir(self.root) else 0
+
+        self.last_report = {
+            "scanned_files": len(files),
+            "scanned_bytes": sum(f[1] for f in files),
+            "deleted_files": deleted,
+            "freed_bytes": freed,
+            "removed_dirs": removed_dirs,
+            "reasons": reasons,
+            "errors": errors[:100],
+            "seconds": time.time() - start,
+        }
+        logger.info("janitor %s freed %d bytes in %d files", self.root, freed, deleted)
+        return self.last_report
+
+    def start(self, interval=3600):
+        """
+        后台线程每隔 interval 秒执行一次 run
+        :param interval: float
+        :return: threading.Thread
+        """
+
+        def loop():
+            while not self._stopped.wait(interval):
+                try:
+                    self.run()
+                except Exception:
+                    logger.exception("janitor %s error", self.root)
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=loop, name="janitor", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,195 @@
+# coding=utf-8
+
+"""
+author: neo
+"""
+
+import gzip
+import ujson
+
+
+# 每次读取的字节数
+CHUNK_SIZE = 1 << 20
+# 单行(NDJSON)或整个请求体(JSON)允许的最大字节数
+MAX_LINE_BYTES = 16 << 20
+MAX_BODY_BYTES = 64 << 20
+
+
+class JSONStreamError(ValueError):
+    """
+    无法解析的行, line 为从1开始的行号(请求体为记录序号)
+    """
+
+    def __init__(self, message, line=None):
+        super(JSONStreamError, self).__init__(message if line is None else "line {0}: {1}".format(line, message))
+        self.line = line
+
+
+def loads_lines(lines, first_line=1, line_numbers=None):
+    """
+    逐行解析多行JSON, 每行必须恰好是一个JSON值(不能拼接成数组一次解析: "[1", "2]" 这样的非法行会被接受)
+    :param lines: list of bytes/string, 不含空行
+    :param first_line: int, 第一行的行号, 用于错误信息
+    :param line_numbers: list, 各行的行号(跳过了空行时), 默认从 first_line 开始连续编号
+    :return: list
+    """
+    loads = ujson.loads
+    try:
+        return [loads(line) for line in lines]
+    except ValueError:
+        pass
+    # 定位出错的行
+    for i, line in enumerate(lines):
+        try:
+            loads(line)
+        except ValueError as e:
+            raise JSONStreamError(str(e), line_numbers[i] if line_numbers else first_line + i)
+
+
+def _open(path_or_file):
+    if hasattr(path_or_file, "read"):
+        return path_or_file, False
+    if str(path_or_file).endswith(".gz"):
+        return gzip.open(path_or_file, "rb"), True
+    return open(path_or_file, "rb"), True
+
+
+def iter_ndjson_batches(path_or_file, chunk_size=CHUNK_SIZE, max_line_bytes=MAX_LINE_BYTES):
+    """
+    按固定大小分块读取NDJSON(JSON Lines)文件, 每块中完整的行一次解析, 内存占用与文件大小无关
+    :param path_or_file: string(.gz 文件自动解压) 或以二进制打开的文件对象
+    :param chunk_size: int, 每次读取的字节数
+    :param max_line_bytes: int, 单行的最大字节数, 超过时抛出 JSONStreamError
+    :return: generator, 每次返回一块中的记录(list)
+    """
+    f, should_close = _open(path_or_file)
+    try:
+        rest = b""
+        line_no = 1
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                rest += chunk
+                if len(rest) > max_line_bytes:
+                    raise JSONStreamError("line exceeds {0} bytes".format(max_line_bytes), line_no)
+                continue
+            lines = (rest + chunk[:end]).split(b"\n")
+            rest = chunk[end + 1:]
+            yield _decode_lines(lines, line_no)
+            line_no += len(lines)
+        if rest.strip():
+            yield _decode_lines([rest], line_no)
+    finally:
+        if should_close:
+            f.close()
+
+
+def _decode_lines(lines, line_no):
+    # 去掉空行(及 \r), 出错时的行号仍按原文件计算
+    kept, numbers = [], []
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if line:
+            kept.append(line)
+            numbers.append(line_no + i)
+    return loads_lines(kept, line_numbers=numbers)
+
+
+def iter_ndjson(path_or_file, chunk_size=CHUNK_SIZE, max_line_bytes=MAX_LINE_BYTES):
+    """
+    逐条返回NDJSON文件中的记录(分块读取、分批解析)
+    :param path_or_file: string 或二进制文件对象
+    :param chunk_size: int
+    :param max_line_bytes: int
+    :return: generator
+    """
+    for records in iter_ndjson_batches(path_or_file, chunk_size, max_line_bytes):
+        for record in records:
+            yield record
+
+
+class IncrementalJSONDecoder(object):
+    """
+    请求体边接收边解析:
+        ndjson=True 时每收到完整的一行即解析, 只缓存未结束的一行;
+        ndjson=False 时缓存整个请求体, 在 close() 时解析;
+    缓存超过上限时抛出 JSONStreamError, 内存占用有界
+    """
+
+    def __init__(self, ndjson=False, max_bytes=None):
+        """
+        :param ndjson: bool
+        :param max_bytes: int, 缓存的上限, 默认 NDJSON 为 MAX_LINE_BYTES, JSON 为 MAX_BODY_BYTES
+        """
+        self.ndjson = ndjson
+        self.max_bytes = max_bytes or (MAX_LINE_BYTES if ndjson else MAX_BODY_BYTES)
+        self.records = 0
+        self._parts = []
+        self._size = 0
+
+    def feed(self, data):
+        """
+        输入一段请求体
+        :param data: bytes
+        :return: list, 本段数据中已完整的记录(ndjson=False 时总是空)
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self.ndjson:
+            end = data.rfind(b"\n")
+            if end >= 0:
+                lines = (b"".join(self._parts) + data[:end]).split(b"\n")
+                self._parts, self._size = [data[end + 1:]], len(data) - end - 1
+                if self._size > self.max_bytes:
+                    raise JSONStreamError("line exceeds {0} bytes".format(self.max_bytes))
+                records = loads_lines([line for line in (line.strip() for line in lines) if line], self.records + 1)
+                self.records += len(records)
+                return records
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            raise JSONStreamError("request body exceeds {0} bytes".format(self.max_bytes))
+        return []
+
+    def close(self):
+        """
+        请求体结束
+        :return: list(ndjson=True 时为最后一行的记录) 或解析后的整个JSON
+        """
+        body = b"".join(self._parts)
+        self._parts, self._size = [], 0
+        if self.ndjson:
+            records = loads_lines([body.strip()], self.records + 1) if body.strip() else []
+            self.records += len(records)
+            return records
+        try:
+            return ujson.loads(body)
+        except ValueError as e:
+            raise JSONStreamError(str(e))
+
+
+def decode_request_body(chunks, ndjson=False, max_bytes=None):
+    """
+    解析分块到达的请求体(如 Django 的 request 对象可按块迭代)
+    :param chunks: iterable of bytes
+    :param ndjson: bool, True 时返回逐条记录的 generator
+    :param max_bytes: int
+    :return: generator(ndjson=True) 或解析后的JSON
+    """
+    decoder = IncrementalJSONDecoder(ndjson=ndjson, max_bytes=max_bytes)
+    if ndjson:
+        return _iter_records(decoder, chunks)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder.close()
+
+
+def _iter_records(decoder, chunks):
+    for chunk in chunks:
+        for record in decoder.feed(chunk):
+            yield record
+    for record in decoder.close():
+        yield record
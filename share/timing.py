@@ -0,0 +1,343 @@
+# coding=utf-8
+
+"""
+author: neo
+"""
+
+import inspect
+import logging
+import threading
+import time
+import ujson
+import weakref
+from functools import wraps
+
+
+logger = logging.getLogger(__name__)
+
+# 直方图每个2的幂区间再等分为 2**SUB_BUCKET_BITS 个桶, 相对误差不超过 1/2**SUB_BUCKET_BITS
+SUB_BUCKET_BITS = 4
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_LINEAR_LIMIT = _SUB_BUCKETS << 1
+DEFAULT_SLOW_SECONDS = 10
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bucket_index(value):
+    """
+    耗时(纳秒)所在的桶: 小于32的值每个值一个桶, 之后每个2的幂区间16个桶(对数-线性分桶)
+    :param value: int
+    :return: int
+    """
+    if value < _LINEAR_LIMIT:
+        return max(value, 0)
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+def bucket_bounds(index):
+    """
+    桶的取值范围 [low, high)
+    :param index: int
+    :return: (int, int)
+    """
+    if index < _LINEAR_LIMIT:
+        return index, index + 1
+    shift = index // _SUB_BUCKETS - 1
+    low = (index - shift * _SUB_BUCKETS) << shift
+    return low, low + (1 << shift)
+
+
+class Histogram(object):
+    """
+    单个线程内某个函数的耗时直方图, 只由所属线程写入, 不加锁
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max", "slow")
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.slow = 0
+
+    def record(self, value):
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, n in dict(other.counts).items():
+            self.counts[index] = self.counts.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.slow += other.slow
+
+    def quantile(self, q):
+        """
+        分位数(纳秒), 取所在桶的中点
+        :param q: float, 0~1
+        :return: int
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                return min(max((low + high - 1) // 2, self.min), self.max)
+        return self.max
+
+
+class _ThreadOwner(object):
+    """
+    存放在线程局部变量中, 线程结束时被回收, 由弱引用回调合并该线程的直方图
+    """
+
+    __slots__ = ("__weakref__",)
+
+
+class TimingRegistry(object):
+    """
+    按函数名记录耗时: 每个线程写自己的直方图(无锁), 导出时再合并;
+    线程结束后其直方图并入已结束线程的汇总, 每个线程一个请求的服务中记录的直方图个数不会一直增长;
+    慢调用阈值可按函数名单独设置, 超过阈值时记录警告日志
+    """
+
+    def __init__(self, default_slow_seconds=DEFAULT_SLOW_SECONDS):
+        self.default_slow_seconds = default_slow_seconds
+        self.slow_seconds = {}
+        self._local = threading.local()
+        # {线程的弱引用: {函数名: Histogram}}, 运行中的线程
+        self._threads = {}
+        # {函数名: Histogram}, 已结束的线程合并后的直方图
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def set_slow_threshold(self, name, seconds):
+        """
+        设置函数的慢调用阈值
+        :param name: string
+        :param seconds: float, None 时恢复默认阈值
+        :return:
+        """
+        if seconds is None:
+            self.slow_seconds.pop(name, None)
+        else:
+            self.slow_seconds[name] = seconds
+
+    def _histogram(self, name):
+        histograms = getattr(self._local, "histograms", None)
+        if histograms is None:
+            # 每个线程只在第一次记录时加锁登记
+            owner = _ThreadOwner()
+            histograms = {}
+            with self._lock:
+                self._threads[weakref.ref(owner, self._retire)] = histograms
+            self._local.owner, self._local.histograms = owner, histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        return histogram
+
+    def _retire(self, ref):
+        # 线程结束(线程局部变量被回收)时把它的直方图并入汇总
+        with self._lock:
+            histograms = self._threads.pop(ref, None)
+            for name, histogram in (histograms or {}).items():
+                self._retired.setdefault(name, Histogram()).merge(histogram)
+
+    def record(self, name, elapsed_ns, slow_seconds=None):
+        """
+        记录一次耗时
+        :param name: string, 函数名
+        :param elapsed_ns: int, 纳秒
+        :param slow_seconds: float, 慢调用阈值, 默认取 set_slow_threshold 设置的值
+        :return:
+        """
+        histogram = self._histogram(name)
+        histogram.record(elapsed_ns)
+        threshold = self.slow_seconds.get(name, self.default_slow_seconds if slow_seconds is None else slow_seconds)
+        if elapsed_ns > threshold * 1e9:
+            histogram.slow += 1
+            logger.warning("handler %s spent time: %.3fs, exceed time!", name, elapsed_ns / 1e9)
+
+    def timer(self, name, slow_seconds=None):
+        """
+        计时的上下文管理器
+        :param name: string
+        :param slow_seconds: float
+        :return: Timer
+        """
+        return Timer(self, name, slow_seconds)
+
+    def timed(self, name=None, slow_seconds=None):
+        """
+        计时装饰器, 支持普通函数和 async 函数
+        :param name: string, 默认为函数的 __qualname__
+        :param slow_seconds: float
+        :return: function
+        """
+
+        def decorator(func):
+            func_name = name or func.__qualname__
+
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_handler_func(*args, **kwargs):
+                    start = time.perf_counter_ns()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.record(func_name, time.perf_counter_ns() - start, slow_seconds)
+
+                return async_handler_func
+
+            @wraps(func)
+            def handler_func(*args, **kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(func_name, time.perf_counter_ns() - start, slow_seconds)
+
+            return handler_func
+
+        return decorator
+
+    def merged(self):
+        """
+        合并各线程的直方图
+        :return: dict, {函数名: Histogram}
+        """
+        merged = {}
+        with self._lock:
+            for name, histogram in self._retired.items():
+                merged.setdefault(name, Histogram()).merge(histogram)
+            threads = [list(histograms.items()) for histograms in self._threads.values()]
+        for histograms in threads:
+            for name, histogram in histograms:
+                merged.setdefault(name, Histogram()).merge(histogram)
+        return merged
+
+    def snapshot(self, quantiles=DEFAULT_QUANTILES):
+        """
+        各函数的调用次数、总耗时、最小/最大/平均耗时、分位数及慢调用次数(秒)
+        :param quantiles: tuple
+        :return: dict
+        """
+        snapshot = {}
+        for name, h in sorted(self.merged().items()):
+            snapshot[name] = {
+                "count": h.count,
+                "sum": h.total / 1e9,
+                "min": (h.min or 0) / 1e9,
+                "max": h.max / 1e9,
+                "mean": h.total / h.count / 1e9 if h.count else 0.0,
+                "quantiles": {str(q): h.quantile(q) / 1e9 for q in quantiles},
+                "slow": h.slow,
+            }
+        return snapshot
+
+    def to_json(self, quantiles=DEFAULT_QUANTILES):
+        return ujson.dumps(self.snapshot(quantiles))
+
+    def to_prometheus(self, metric="handler_spent_seconds", quantiles=DEFAULT_QUANTILES):
+        """
+        Prometheus 文本格式(summary 类型), 函数名作为 handler 标签
+        :param metric: string, 指标名
+        :param quantiles: tuple
+        :return: string
+        """
+        lines = ["# TYPE {} summary".format(metric)]
+        slow_lines = ["# TYPE {}_slow_total counter".format(metric)]
+        for name, stats in self.snapshot(quantiles).items():
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            for q, value in stats["quantiles"].items():
+                lines.append('{}{{handler="{}",quantile="{}"}} {:.9f}'.format(metric, label, q, value))
+            lines.append('{}_sum{{handler="{}"}} {:.9f}'.format(metric, label, stats["sum"]))
+            lines.append('{}_count{{handler="{}"}} {}'.format(metric, label, stats["count"]))
+            slow_lines.append('{}_slow_total{{handler="{}"}} {}'.format(metric, label, stats["slow"]))
+        return "\n".join(lines + slow_lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._threads = {}
+            self._retired = {}
+        self._local = threading.local()
+
+
+class Timer(object):
+    """
+    计时的上下文管理器, 退出时把耗时记录到 registry
+    """
+
+    __slots__ = ("registry", "name", "slow_seconds", "start", "elapsed_ns")
+
+    def __init__(self, registry, name, slow_seconds=None):
+        self.registry = registry
+        self.name = name
+        self.slow_seconds = slow_seconds
+        self.start = None
+        self.elapsed_ns = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed_ns = time.perf_counter_ns() - self.start
+        self.registry.record(self.name, self.elapsed_ns, self.slow_seconds)
+        return False
+
+
+class PeriodicExporter(threading.Thread):
+    """
+    后台线程, 每隔 interval 秒把 registry 的快照交给 sink(如写文件、推送到监控)
+    """
+
+    def __init__(self, registry, sink, interval=60, fmt="json"):
+        """
+        :param registry: TimingRegistry
+        :param sink: function, 参数为导出的字符串
+        :param interval: float, 导出间隔(s)
+        :param fmt: string, "json" 或 "prometheus"
+        """
+        super(PeriodicExporter, self).__init__(daemon=True)
+        self.registry = registry
+        self.sink = sink
+        self.interval = interval
+        self.fmt = fmt
+        self._stopped = threading.Event()
+
+    def export(self):
+        if self.fmt == "prometheus":
+            return self.registry.to_prometheus()
+        return self.registry.to_json()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sink(self.export())
+            except Exception:
+                logger.exception("export timing snapshot error")
+
+    def stop(self):
+        self._stopped.set()
+
+
+registry = TimingRegistry()
+timed = registry.timed
+timer = registry.timer
@@ -0,0 +1,98 @@
+# coding=utf-8
+
+"""
+author: neo
+"""
+
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+# 表单及上传数据中不允许出现的危险字符
+DANGEROUS_CHARS = "&<>\"'/()"
+DANGEROUS_CHAR_PATTERN = re.compile("[" + re.escape(DANGEROUS_CHARS) + "]")
+IPV4_PATTERN = re.compile(r"^((25[0-5]|2[0-4]\d|[01]?\d\d?)\.){3}(25[0-5]|2[0-4]\d|[01]?\d\d?)$")
+
+_DANGEROUS_SET = frozenset(DANGEROUS_CHARS)
+_STRIP_TABLE = str.maketrans("", "", DANGEROUS_CHARS)
+
+
+def contains_dangerous_char(s):
+    """
+    检查字符串中是否包括危险字符(集合判断, 不使用正则)
+    :param s: string
+    :return: True/False
+    """
+    return not _DANGEROUS_SET.isdisjoint(s if isinstance(s, str) else str(s))
+
+
+def strip_dangerous_chars(s):
+    """
+    去掉字符串中的危险字符(str.translate)
+    :param s: string
+    :return: string
+    """
+    return (s if isinstance(s, str) else str(s)).translate(_STRIP_TABLE)
+
+
+def is_ipv4(s):
+    """
+    判断字符串是否为IPv4地址
+    :param s: string
+    :return: True/False
+    """
+    return IPV4_PATTERN.match(s) is not None
+
+
+def _is_series(values):
+    return pd is not None and isinstance(values, pd.Series)
+
+
+def _mask(func, values):
+    if np is None:
+        return [func(v) for v in values]
+    values = values if hasattr(values, "__len__") else list(values)
+    return np.fromiter((func(v) for v in values), dtype=bool, count=len(values))
+
+
+def dangerous_char_mask(values):
+    """
+    批量检查是否包括危险字符
+    :param values: pd.Series(字符串列, 空值为False) 或字符串的iterable
+    :return: pd.Series(bool, 与values同索引) 或 numpy bool array
+    """
+    if _is_series(values):
+        # 字符串列用 pandas 的字符串方法整列匹配, pyarrow 字符串类型时在 Arrow 中向量化执行
+        return values.astype("string").str.contains(DANGEROUS_CHAR_PATTERN, na=False).astype(bool)
+    return _mask(contains_dangerous_char, values)
+
+
+def ipv4_mask(values):
+    """
+    批量判断是否为IPv4地址
+    :param values: pd.Series 或字符串的iterable
+    :return: pd.Series(bool) 或 numpy bool array
+    """
+    if _is_series(values):
+        return values.astype("string").str.match(IPV4_PATTERN, na=False).astype(bool)
+    return _mask(lambda v: isinstance(v, str) and is_ipv4(v), values)
+
+
+def strip_dangerous_column(values):
+    """
+    批量去掉危险字符
+    :param values: pd.Series 或字符串的iterable
+    :return: pd.Series 或 list
+    """
+    if _is_series(values):
+        return values.str.translate(_STRIP_TABLE)
+    return [strip_dangerous_chars(v) for v in values]